@@ -1,45 +1,25 @@
 import os
 import shutil
 import ntpath
-import fnmatch
 import subprocess
 import tempfile
-import time
 import sys
+import queue
+import threading
+import time
+from collections import OrderedDict
 from configparser import ConfigParser
 from tkinter import *
 from tkinter.ttk import *
 from tkinter.filedialog import askopenfilename
 from tkinter.filedialog import askdirectory
 from tkinter import messagebox
-from zipfile import ZipFile
-
-# Definition of all layers to be recognized.
-# https://www.pcbway.com/helpcenter/technical_support/Gerber_File_Extention_from_Different_Software.html
-# Specify layer name, an array of patterns to look for, one pattern to dismiss.
-# When opening gerber files, the application will begin to look for the first pattern in the first layer. Then the
-# second pattern of the first layer and so on. As soon as a layer has been found, that file will not be tagged for
-# another layer even if it happens to match a filter on a sequent layer.
-# It's important that the last layer is the outline of the pcb, since this is included in all layers when exporting
-# to png.
-filetypes = [
-               ['Top Solder Paste', ['*.gtp', '*-F?Paste.*', '*.crc', '*.tsp', '*.stp', '*.toppaste.gbr', '*.creammask_top.gbr', '*.tcream.ger'], ''],
-               ['Top Silk Screen', ['*.gto', '*-F?SilkS.*', '*.plc', '*.tsk', '*.sst', '*.silkscreen_top.gbr', '*.topsilk.gbr', '*.topsilkscreen.ger', 'to'], ''],
-               ['Top Solder Mask', ['*.gts', '*-F?Mask.*', '*.stc', '*.tsm', '*.smt', '*.topmask.gbr', '*.soldermask_top.gbr', '*.topsoldermask.ger', 'ts'], ''],
-               ['Copper Layer L1', ['*.gtl', '*-L1.*', '*.g1', '*-F?Cu*', '*.cmp', '*.top', '*.top.gbr', '*.copper_l1.gbr', '*.toplayer.ger', 'tl'], '*.pos'],
-               ['Copper Layer L2', ['*.g1', '*.g2', '*-L2.*', '*-In1?Cu*', '*-Inner1?Cu*', '*.ly1', '*.ly2', '*.in1', '*.internalplane1.ger', '*.copper_l2.gbr', 'l2', '*.gbl', '*-B?Cu*', '*.sol', '*.bot', '*.bottom.gbr', '*.bottomlayer.ger', 'bl'], '*.pos'],
-               ['Copper Layer L3', ['*.g2', '*.g3', '*-L3.*', '*-In2?Cu*', '*-Inner2?Cu*', '*.ly2', '*.ly3', '*.in2', '*.internalplane2.ger', '*.copper_l3.gbr', 'l3', '*.gbl', '*-B?Cu*', '*.sol', '*.bot', '*.bottom.gbr', '*.bottomlayer.ger', 'bl'], '*.pos'],
-               ['Copper Layer L4', ['*.g3', '*.g4', '*-L4.*', '*-In3?Cu*', '*-Inner3?Cu*', '*.ly3', '*.ly4', '*.in3', '*.internalplane3.ger', '*.copper_l4.gbr', 'l4', '*.gbl', '*-B?Cu*', '*.sol', '*.bot', '*.bottom.gbr', '*.bottomlayer.ger', 'bl'], '*.pos'],
-               ['Copper Layer L5', ['*.g4', '*.g5', '*-L5.*', '*-In4?Cu*', '*-Inner4?Cu*', '*.ly4', '*.ly5', '*.in4', '*.internalplane4.ger', '*.copper_l5.gbr', 'l5', '*.gbl', '*-B?Cu*', '*.sol', '*.bot', '*.bottom.gbr', '*.bottomlayer.ger', 'bl'], '*.pos'],
-               ['Copper Layer L6', ['*.g5', '*.g6', '*-L6.*', '*.gbl', '*-B?Cu*', '*.sol', '*.bot', '*.bottom.gbr', '*.copper_l6.gbr', '*.bottomlayer.ger', 'bl'], '*.pos'],
-               ['Bottom Solder Mask', ['*.gbs', '*-B?Mask.*', '*.sts', '*.bsm', '*.smb', '*.bottommask.gbr', '*.soldermask_bottom.gbr', '*.bottomsoldermask.ger', 'bs'], ''],
-               ['Bottom Silk Screen', ['*.gbo', '*-B?SilkS.*', '*.pls', '*.bsk', '*.ssb', '*.silkscreen_bottom.gbr', '*.bottomsilk.gbr', '*.bottomsilkscreen.ger'], ''],
-               ['Bottom Solder Paste', ['*.gbp', '*-B?Paste.*', '*.crs', '*.bsp', '*.spb', '*.bottompaste.gbr', '*.creammask_bottom.gbr', '*.bcream.ger'], ''],
-               ['Plated Drill File', ['*-PTH.drl', '*.drl', '*.txt', '*.xln', '*.exc', '*.drd', '*.tap', '*.fab.gbr', '*.plated-drill.cnc', 'drl'], '*NPTH*'],
-               ['Non-Plated Drill File', ['*NPTH.drl', '*.holes_npth.xln'], ''],
-               ['Eco1 Layer', ['*-User?Eco1.*', '*-Eco1?User.*', 'vcut'], ''],
-               ['Outline of PCB', ['*.gm1', '*-Edge?Cuts.*', '*.gko', '*.gm3', '*.dim', '*.gml', '*.fab', '*.out.gbr', '*.board_outline.gbr', '*.boardout.ger', 'ko'], ''],
-            ]
+import grbcore
+import grbpyramid
+
+# The layers to be recognized and the color templates for the png export (see grbcore.py)
+filetypes = grbcore.filetypes
+png_color_template = grbcore.png_color_template
 
 # Color templates for viewing all layers at the same time in GerbV
 # Specify template name, background color, an array with color for each layer and a corresponding layer index in the
@@ -88,24 +68,6 @@ pcb_color_template = [
                          ],
                      ]
 
-# Color templates for exporting the gerbers to png.
-png_color_template = [
-                       ['Green Copper Layers on White background',  # Template Name
-                        '#FFFFFF',    # Background
-                        '#00690B',    # Gerber 1 color
-                        '#00690B',    # Gerber 2 color
-                        '#00FF0880',  # Gerber 1 color on the combined picture
-                        '#0000A7FF',  # Gerber 2 color on the combined picture
-                       ],
-                       ['Green and Blue Copper Layers on White background',  # Template Name
-                        '#FFFFFF',    # Background
-                        '#00690B',    # Gerber 1 color
-                        '#000080',    # Gerber 2 color
-                        '#00FF0880',  # Gerber 1 color on the combined picture
-                        '#0000A7FF',  # Gerber 2 color on the combined picture
-                       ],
-                     ]
-
 # Color templates for "diff" of a particular layer in GerbV.
 diff_gerbv_args = [
                 ["Red and Blue on Black", "--background=#000000", "--foreground=#ff000055", "--foreground=#0000ff"],
@@ -119,9 +81,19 @@ def write_settings_file():
 # Read Settings file. Create it if it doesn't exist.
 settings_object = ConfigParser()
 if not os.path.exists('settings.ini'):
-    settings_object['PATHS'] = {'gerbv_path': '', 'grb_file1': '', 'grb_file2': '', 'png_export_path': ''}
+    import drilldiff
+
+    settings_object['PATHS'] = {'gerbv_path': '', 'grb_file1': '', 'grb_file2': '', 'png_export_path': '',
+                                'render_cache_path': ''}
     settings_object['TEMPLATES'] = {'diff_color_combobox': 0, 'png_color_combobox': 0, 'gerber_color_combobox': 0}
-    settings_object['OTHER'] = {'png_export_dpi': '300'}
+    settings_object['OTHER'] = {'png_export_dpi': '300', 'png_export_workers': str(grbcore.default_workers()),
+                                'ssim_tile_size': str(grbcore.default_ssim_tile_size), 'png_renderer': '0',
+                                'render_cache_size': str(grbcore.default_render_cache_size),
+                                'change_merge_distance': str(grbcore.default_change_merge_distance),
+                                'png_coarse_dpi': '0', 'export_profile': '0', 'png_export_images': '1',
+                                'png_export_pyramids': '1', 'png_diff_mode': '0', 'png_export_artifact': '0',
+                                'drill_position_tolerance': str(drilldiff.default_position_tolerance),
+                                'drill_diameter_tolerance': str(drilldiff.default_diameter_tolerance)}
     write_settings_file()
 else:
     # Read File
@@ -130,12 +102,128 @@ settings_paths = settings_object['PATHS']
 settings_templates = settings_object['TEMPLATES']
 settings_other = settings_object['OTHER']
 
+# Start profiling an export if export_profile is set to 1 in settings.ini. The time and memory usage of every stage of
+# every layer is written to export-profile.jsonl in the export png dir (see grbcore.new_profile()).
+def start_export_profile(export_path):
+    if (settings_other.get('export_profile', '0') != '1'):
+        return None
+    try:
+        return grbcore.new_profile(os.path.join(export_path, "export-profile.jsonl"))
+    except OSError as e:
+        print("Unable to profile the export. Error:", e)
+        return None
+
+# Export png images of every revision of the gerber files in a git revision range, and find the differences between
+# every revision and the revision before it. Every revision is only rendered once, so N revisions take N renders
+# instead of 2N. The settings (GerbV, export png dir, DPI, templates etc.) are the same as in the GUI.
+# The images of every revision are written to a directory named by the revision in the export png dir, and the
+# images with the differences marked to a directory for every pair of revisions.
+def export_revisions(path, rev_range):
+    export_path = settings_paths['png_export_path']
+    if (not export_path):
+        print("No export png dir selected. Select one in the GUI first.")
+        return
+    gerbv = settings_paths['gerbv_path']
+    template = png_color_template[int(settings_templates['png_color_combobox'])]
+    print("Using png color template:", template[0])
+    bg_color = template[1]
+    layer_color = template[2]
+    dpi = settings_other['png_export_dpi']
+    renderer = grbcore.renderers[int(settings_other.get('png_renderer', '0'))]
+    workers = int(settings_other.get('png_export_workers', str(grbcore.default_workers())))
+    tile_size = int(settings_other.get('ssim_tile_size', str(grbcore.default_ssim_tile_size)))
+    merge_distance = float(settings_other.get('change_merge_distance', str(grbcore.default_change_merge_distance)))
+    diff_mode = grbcore.diff_modes[int(settings_other.get('png_diff_mode', '0'))]
+    cache = None
+    if (settings_paths.get('render_cache_path', '')):
+        cache = (settings_paths.get('render_cache_path', ''),
+                 float(settings_other.get('render_cache_size', str(grbcore.default_render_cache_size))))
+
+    revisions = grbcore.git_revisions(path, rev_range)
+    print("Revisions to compare:", revisions)
+
+    temp_dir = tempfile.mkdtemp(prefix="GrbDiff-Revisions-")
+    try:
+        # Render every layer of every revision
+        renders = []
+        layer_images = []
+        layer_sources = []
+        for revision in revisions:
+            revision_dir = os.path.join(temp_dir, revision[:12])
+            layer_files = grbcore.git_revision_files(path, revision, revision_dir, filetypes)
+            print("Files in revision", revision[:12], [os.path.basename(f) for f in layer_files if f is not None])
+            export_dir = os.path.join(export_path, revision[:12])
+            os.makedirs(export_dir, exist_ok=True)
+            images = {}
+            sources = {}
+            for index, filepath in enumerate(layer_files):
+                if (filepath is None):
+                    continue
+                files = [filepath]
+                if (layer_files[-1] is not None):
+                    files.append(layer_files[-1])  # Board outline layer
+                colors = [layer_color] * len(files)
+                image = os.path.join(export_dir, filetypes[index][0].replace(" ", "_") + ".png")
+                source = {'files': files, 'colors': colors, 'bg_color': bg_color, 'dpi': dpi}
+                renders.append({'args': grbcore.gerbv_export_args(gerbv, files, colors, bg_color, dpi, image),
+                                'source': source, 'image': image, 'renderer': renderer, 'cache': cache})
+                images[index] = image
+                sources[index] = source
+            layer_images.append(images)
+            layer_sources.append(sources)
+
+        # Compare every revision with the revision before it
+        diffs = []
+        diff_layers = []
+        for r in range(1, len(revisions)):
+            pair_dir = os.path.join(export_path, revisions[r-1][:12] + "-" + revisions[r][:12])
+            os.makedirs(pair_dir, exist_ok=True)
+            for index in sorted(layer_images[r-1].keys() & layer_images[r].keys()):
+                name = filetypes[index][0].replace(" ", "_")
+                diffs.append({'images': (layer_images[r-1][index], layer_images[r][index]),
+                              'source': layer_sources[r-1][index],
+                              'outputs': (os.path.join(pair_dir, name + "-1.png"), os.path.join(pair_dir, name + "-2.png")),
+                              'report': os.path.join(pair_dir, name + "-diff.json"),
+                              'tile_size': tile_size, 'merge_distance': merge_distance, 'diff_mode': diff_mode})
+                diff_layers.append((r, index))
+
+        def progress(done, total):
+            print("Exporting and finding differences:", done, "of", total, "tasks done")
+
+        profile = start_export_profile(export_path)
+        try:
+            results = grbcore.run_render_and_diff_jobs(renders, diffs, workers, progress, profile)
+        finally:
+            grbcore.finish_profile(profile)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    for r in range(1, len(revisions)):
+        export_result = "Png Export Result " + revisions[r-1][:12] + ".." + revisions[r][:12] + ":\r\n"
+        for index, layer in enumerate(filetypes):
+            export_result = export_result + layer[0] + ": "
+            if (r, index) in diff_layers:
+                export_result = export_result + results[diff_layers.index((r, index))] + "\r\n"
+            else:
+                export_result = export_result + "Not available in both revisions.\r\n"
+        print(export_result)
+        pair_dir = os.path.join(export_path, revisions[r-1][:12] + "-" + revisions[r][:12])
+        with open(os.path.join(pair_dir, "Result.txt"), 'w', newline='') as f:
+            f.write(export_result)
+
 # Check if files are supplied as arguments
 gerber1_arg = ''
 gerber2_arg = ''
 single_gerber = False
+rev_range = ''
 arguments = sys.argv
 if(len(arguments)>1):
+    if ('-r' in arguments and arguments.index('-r') + 1 < len(arguments)):
+        index = arguments.index('-r')
+        rev_range = arguments[index + 1]
+        print('Argument -r found. Will compare the revisions', rev_range)
+        del arguments[index:index + 2]
+
     for a in list(arguments):
         print('Got argument:', a)
         if(a=='-s'):
@@ -155,6 +243,14 @@ if(len(arguments)>1):
 else:
     print('No arguments supplied.')
 
+if (rev_range != ''):
+    try:
+        export_revisions(gerber1_arg or '.', rev_range)
+    except (subprocess.CalledProcessError, ValueError, OSError) as e:
+        print("Unable to compare the revisions. Error:", e)
+        sys.exit(1)
+    sys.exit(0)
+
 # create root window
 root = Tk()
 
@@ -193,6 +289,10 @@ my_canvas.create_window((0,0),window= second_frame, anchor="nw")
 
 row=1
 dpi_entry_variable = StringVar()  # Declaration
+workers_entry_variable = StringVar()  # Declaration
+merge_distance_entry_variable = StringVar()  # Declaration
+coarse_dpi_entry_variable = StringVar()  # Declaration
+cache_size_entry_variable = StringVar()  # Declaration
 
 # Add headlines
 second_frame.grid_rowconfigure(row, minsize=15)
@@ -211,11 +311,26 @@ layernames = []
 firstgerbers = []
 secondgerbers = []
 diffbutton = []
+viewbutton = []
+layerresults = []
 
 global gerber1_path
 gerber1_path = ''
 global gerber2_path
 gerber2_path = ''
+# The zip archive and its files for Gerber 1 and 2, if a zip archive is opened
+zip_archives = {1: None, 2: None}
+# The file or zip archive that is opened as Gerber 1 and 2
+opened_gerbers = {1: None, 2: None}
+
+# Get the path of a file of Gerber 1 or 2. Files in a zip archive are extracted the first time they are used.
+def gerber_filepath(sel, filename):
+    path = gerber1_path if sel == 1 else gerber2_path
+    if (zip_archives[sel] is not None):
+        (zip_filepath, members) = zip_archives[sel]
+        if (filename in members):
+            return grbcore.extract_zip_member(zip_filepath, members[filename], path, filename).replace("/", os.sep)
+    return os.path.join(path, filename).replace("/", os.sep)
 
 def diff_gerbers(x):
     if(not gerbv_path["text"]):
@@ -229,9 +344,9 @@ def diff_gerbers(x):
         messagebox.showwarning("Info", f"No Gerber 2 file to diff with.")
     else:
         print(gerbv_path["text"])
-        filepath1 = os.path.join(gerber1_path, firstgerbers[x].get()).replace("/", os.sep)
+        filepath1 = gerber_filepath(1, firstgerbers[x].get())
         print(filepath1)
-        filepath2 = os.path.join(gerber2_path, secondgerbers[x].get()).replace("/", os.sep)
+        filepath2 = gerber_filepath(2, secondgerbers[x].get())
         print(filepath2)
         process_args = [gerbv_path["text"], filepath1, filepath2]
         for a in diff_gerbv_args[diff_color_combobox.current()][1:]:
@@ -251,6 +366,10 @@ for index, value in enumerate(filetypes):
     secondgerbers[index].set("---")
     diffbutton.append(Button(second_frame, text='Diff in GerbV',command=lambda index=index: diff_gerbers(index)))
     diffbutton[index].grid(column=4, row=row, sticky=W, padx=10)
+    viewbutton.append(Button(second_frame, text='View', command=lambda index=index: view_layer(index)))
+    viewbutton[index].grid(column=5, row=row, sticky=W, padx=10)
+    layerresults.append(Label(second_frame, text=""))
+    layerresults[index].grid(column=6, row=row, sticky=W, padx=10)
     row = row+1
 
 second_frame.grid_columnconfigure(2, minsize=250)
@@ -267,7 +386,9 @@ def select_gerber_file(sel):
             write_settings_file()
         open_gerber_file(sel_file, sel)
 
-def open_gerber_file(sel_file, sel):
+# Open a gerber file or zip archive as Gerber 1 or 2. 'members' is the list of files in the zip archive, if it has
+# already been read (see grbcore.zip_members()).
+def open_gerber_file(sel_file, sel, members=None):
     # Clear filelist
     if (sel==1):
         for grb_file in firstgerbers:
@@ -282,37 +403,25 @@ def open_gerber_file(sel_file, sel):
 
     if (sel_file.endswith(".zip")):
         print("Chosen file is a zip archive.")
+        # The files are classified by the list of files in the archive. A file is only extracted when it's used, to a
+        # new temporary directory, so there is no need to wait for the files of an earlier archive to be removed.
+        tmp_dir_prefix = "GrbDiff-Zip" + str(sel) + "-"
+        filedir = tempfile.mkdtemp(prefix=tmp_dir_prefix)
+        for name in os.listdir(tempfile.gettempdir()):
+            old_dir = os.path.join(tempfile.gettempdir(), name)
+            if (name.startswith(tmp_dir_prefix) and old_dir != filedir):
+                grbcore.remove_dir_later(old_dir)
+        if (members is None):
+            members = grbcore.zip_members(sel_file)
+        zip_archives[sel] = (sel_file, members)
         if (sel==1):
             gerber1_dir.configure(text=sel_file)
-            tmp_dir_name = "GrbDiff-Zip1"
-            filedir = os.path.join(tempfile.gettempdir(), tmp_dir_name)
             listOfGlobals['gerber1_path'] = filedir
         else:
             gerber2_dir.configure(text=sel_file)
-            tmp_dir_name = "GrbDiff-Zip2"
-            filedir = os.path.join(tempfile.gettempdir(), tmp_dir_name)
             listOfGlobals['gerber2_path'] = filedir
-
-        # If the directory exists, remove it
-        if os.path.exists(filedir):
-            shutil.rmtree(filedir)
-
-        # Wait for the directory to be removed
-        for delay in 0.1, 0.2, 0.3, 0.4, 0.5, 0.6:
-            if not os.path.exists(filedir): break
-            time.sleep(delay)
-
-        # Create the directory
-        os.mkdir(filedir)
-
-        # Unpack zip archive
-        with ZipFile(sel_file) as zipObj:
-            for zip_info in zipObj.infolist():
-                if zip_info.is_dir():
-                    continue
-                zip_info.filename = os.path.basename(zip_info.filename)
-                zipObj.extract(zip_info, filedir)
     else:
+        zip_archives[sel] = None
         filedir = ntpath.dirname(sel_file)
         if (sel==1):
             gerber1_dir.configure(text=filedir)
@@ -323,42 +432,40 @@ def open_gerber_file(sel_file, sel):
 
 
     print("Selected filepath for Gerber", sel, ":", filedir)
+    opened_gerbers[sel] = sel_file
+    watch_state['signatures'][sel] = gerber_signature(sel)
 
     if (single_gerber == True):
         print("Just using the single file supplied as argument.")
         filelist = [ntpath.basename(sel_file)]
+    elif (zip_archives[sel] is not None):
+        filelist = list(zip_archives[sel][1])
+        print("Files in zip archive:")
     else:
         # Get all files an folders in path, and discard the folders
         filelist = [f for f in os.listdir(filedir) if os.path.isfile(os.path.join(filedir, f))]
         print("Files in path:")
     print(filelist)
 
-    temp_filelist = filelist.copy()
     filelist_with_null = filelist.copy()
     filelist_with_null.insert (0, "---")
+    if (single_gerber == True):
+        layer_files = grbcore.classify_files(filelist, filetypes)
+    elif (zip_archives[sel] is not None):
+        layer_files = grbcore.classify_zip_files(sel_file, zip_archives[sel][1], filetypes)
+    else:
+        layer_files = grbcore.classify_files(filelist, filetypes,
+                                             lambda f: grbcore.read_file_head(os.path.join(filedir, f)))
     for index, value in enumerate(filetypes):
-        found=0
         if (sel == 1):
             firstgerbers[index]['values'] = filelist_with_null
         else:
             secondgerbers[index]['values'] = filelist_with_null
-        #print(index, "filetype", value)
-        for filter in value[1]:
-            #print("filter", filter)
-            for f in list(temp_filelist):
-                #print("file:", f)
-                if ( fnmatch.fnmatch(f, filter ) and not fnmatch.fnmatch(f, value[2] ) ):
-                    #print("Match!", f, filter)
-                    if (sel==1):
-                        firstgerbers[index].set(f)
-                    else:
-                        secondgerbers[index].set(f)
-                    # Remove file from temporary filelist so it won't be found again on other layers.
-                    temp_filelist.remove(f)
-                    found=1
-                    break
-            if (found == 1):
-                break
+        if (layer_files[index] is not None):
+            if (sel==1):
+                firstgerbers[index].set(layer_files[index])
+            else:
+                secondgerbers[index].set(layer_files[index])
 
 
 def open_gerber_files(sel):
@@ -373,12 +480,10 @@ def open_gerber_files(sel):
     for layer in pcb_color_template[gerber_color_combobox.current()][2]:
         if (sel==1):
             filename = firstgerbers[layer[1]].get()
-            path = gerber1_path
         else:
             filename = secondgerbers[layer[1]].get()
-            path = gerber2_path
         if (filename != "---"):
-            filepath = os.path.join(path, filename).replace("/", os.sep)
+            filepath = gerber_filepath(sel, filename)
             color = layer[0]
             process_args.append(filepath)
             process_args.append("--foreground="+color)
@@ -424,146 +529,318 @@ png_export_dir_label = Label(second_frame, text="")
 png_export_dir_label.grid(column=2, row=row, columnspan=3, sticky=W, padx=10)
 row = row + 1
 
-def export_layer(layer_index, sel):
+# Get the files and colors for exporting one of the images of a layer to png.
+# sel is '1' or '2' for the layer of Gerber 1 or 2, or 'combined' for both of them in the same image.
+def export_layer_render(layer_index, sel):
     print("Using png color template:", png_color_template[png_color_combobox.current()][0])
     bg_color = png_color_template[png_color_combobox.current()][1]
     if (sel == '1' or sel == '2'):
         if (sel=='1'):
             filename = firstgerbers[layer_index].get()
-            path = gerber1_path
             layer_color = png_color_template[png_color_combobox.current()][2]
             outline_filename = firstgerbers[-1].get()  # Get filename of board outline layer
         elif (sel=='2'):
             filename = secondgerbers[layer_index].get()
-            path = gerber2_path
             layer_color = png_color_template[png_color_combobox.current()][3]
             outline_filename = secondgerbers[-1].get()  # Get filename of board outline layer
-        filepath = os.path.join(path, filename).replace("/", os.sep)
-        outline_filepath = os.path.join(path, outline_filename).replace("/", os.sep)
-        process_args = [gerbv_path["text"], "-a", "--background="+bg_color, "--foreground="+layer_color, "--foreground="+layer_color]
-        process_args.append(filepath)
-        process_args.append(outline_filepath)
+        files = [gerber_filepath(int(sel), filename)]
+        colors = [layer_color]
+        if (outline_filename != "---"):
+            files.append(gerber_filepath(int(sel), outline_filename))
+            colors.append(layer_color)
     if (sel == 'combined'):
         filename1 = firstgerbers[layer_index].get()
-        path1 = gerber1_path
         layer_color1 = png_color_template[png_color_combobox.current()][4]
         outline1_filename = firstgerbers[-1].get()  # Get filename of board outline layer
 
         filename2 = secondgerbers[layer_index].get()
-        path2 = gerber2_path
         layer_color2 = png_color_template[png_color_combobox.current()][5]
         outline2_filename = secondgerbers[-1].get()  # Get filename of board outline layer
 
-        filepath1 = os.path.join(path1, filename1).replace("/", os.sep)
-        filepath2 = os.path.join(path2, filename2).replace("/", os.sep)
-        outline_filepath1 = os.path.join(path1, outline1_filename).replace("/", os.sep)
-        outline_filepath2 = os.path.join(path2, outline2_filename).replace("/", os.sep)
-        process_args = [gerbv_path["text"], "-a", "--background="+bg_color, "--foreground="+layer_color1, "--foreground="+layer_color2, "--foreground="+layer_color1, "--foreground="+layer_color2]
-        process_args.append(filepath1)
-        process_args.append(filepath2)
-        process_args.append(outline_filepath1)
-        process_args.append(outline_filepath2)
-
-    process_args.append("--export=png")
-    process_args.append("--dpi="+png_dpi_entry.get())
-
-    export_filename = filetypes[layer_index][0].replace(" ", "_") + "-" + sel + ".png"
+        files = [gerber_filepath(1, filename1), gerber_filepath(2, filename2)]
+        colors = [layer_color1, layer_color2]
+        if (outline1_filename != "---"):
+            files.append(gerber_filepath(1, outline1_filename))
+            colors.append(layer_color1)
+        if (outline2_filename != "---"):
+            files.append(gerber_filepath(2, outline2_filename))
+            colors.append(layer_color2)
+
+    return {'files': files, 'colors': colors, 'bg_color': bg_color, 'dpi': png_dpi_entry.get()}
+
+# Get the GerbV arguments for exporting one of the images of a layer to png.
+def export_layer_args(layer_index, sel, render):
+    export_filepath = export_layer_filepath(layer_index, sel)
+    return grbcore.gerbv_export_args(gerbv_path["text"], render['files'], render['colors'], render['bg_color'],
+                                     render['dpi'], export_filepath)
+
+# Get the path of the exported png of a layer, or of its change report if sel is 'diff'
+def export_layer_filepath(layer_index, sel):
+    export_filename = filetypes[layer_index][0].replace(" ", "_") + "-" + sel + (".json" if sel == 'diff' else ".png")
     export_path = png_export_dir_label["text"]
-    export_filepath = os.path.join(export_path, export_filename).replace("/", os.sep)
-    process_args.append("-o" + export_filepath)
-
-    print("Starting GerbV with these args:", process_args)
-    returncode = subprocess.call(process_args, stdin=None, stdout=None, stderr=None)
-    print("GerbV process exited with code:", returncode)
-
-def export_png():
-    # Save dpi setting
+    return os.path.join(export_path, export_filename).replace("/", os.sep)
+
+# The png export runs on a background thread, and sends its progress and the result of every layer to the GUI through
+# export_events, which is read by poll_export_events() on the main thread
+export_events = queue.Queue()
+# 'layer_keys' has the key (see export_layer_key()) of every layer as it was when it was last exported
+export_state = {'cancel': None, 'job_layers': [], 'layer_keys': {}, 'job_keys': {}, 'only_changed': False}
+
+# Get a key for the export of a layer, which changes when the contents of its files or the settings of the export
+# change (see grbcore.render_cache_key()). Returns None if any of the files can't be read.
+def export_layer_key(job, digests):
+    try:
+        keys = [grbcore.render_cache_key(job['renderer'], source, digests) for source in job['sources']]
+    except OSError:
+        return None
+    return (tuple(keys), job.get('fine_dpi'), job['merge_distance'], job['tile_size'], job['diff_mode'], job['report'],
+            job['artifact'], job['pyramids'])
+
+# Export the layers to png and find the differences. If only_changed is True, only the layers whose files or settings
+# have changed since they were last exported are exported, like in watch mode.
+def export_png(only_changed=False):
+    if (export_state['cancel'] is not None):
+        return  # An export is already running
+
+    # Save dpi and worker settings
     settings_other['png_export_dpi'] = png_dpi_entry.get()
+    settings_other['png_export_workers'] = png_workers_entry.get()
+    settings_other['png_renderer'] = str(png_renderer_combobox.current())
+    settings_other['render_cache_size'] = render_cache_size_entry.get()
+    settings_other['change_merge_distance'] = merge_distance_entry.get()
+    settings_other['png_coarse_dpi'] = png_coarse_dpi_entry.get()
+    settings_other['png_diff_mode'] = str(png_diff_mode_combobox.current())
     write_settings_file()
 
+    # Collect everything that is needed from the GUI before the workers are started
+    tile_size = int(settings_other.get('ssim_tile_size', str(grbcore.default_ssim_tile_size)))
+    cache = None
+    if (render_cache_dir_label["text"]):
+        try:
+            cache = (render_cache_dir_label["text"], float(render_cache_size_entry.get()))
+        except ValueError:
+            cache = (render_cache_dir_label["text"], grbcore.default_render_cache_size)
+    try:
+        merge_distance = float(merge_distance_entry.get())
+    except ValueError:
+        merge_distance = grbcore.default_change_merge_distance
+    # With a coarse DPI, the whole layers are compared at the coarse DPI and only the changed parts at the export DPI
+    try:
+        coarse = 0 < float(png_coarse_dpi_entry.get()) < float(png_dpi_entry.get())
+    except ValueError:
+        coarse = False
+    jobs = []
+    job_layers = []
+    job_keys = {}
+    digests = {}
+    for index, layer in enumerate(filetypes):
+        if (firstgerbers[index].get() == "---" or secondgerbers[index].get() == "---"):
+            export_state['layer_keys'].pop(index, None)
+            layerresults[index].configure(text="")
+        else:
+            sources = [export_layer_render(index, sel) for sel in ('1', '2', 'combined')]
+            if coarse:
+                for source in sources:
+                    source['dpi'] = png_coarse_dpi_entry.get()
+            renders = [export_layer_args(index, sel, render) for sel, render in zip(('1', '2', 'combined'), sources)]
+            images = [export_layer_filepath(index, sel) for sel in ('1', '2', 'combined')]
+            job = {'renders': renders, 'sources': sources, 'images': images, 'tile_size': tile_size,
+                   'renderer': grbcore.renderers[png_renderer_combobox.current()], 'cache': cache,
+                   'merge_distance': merge_distance, 'report': export_layer_filepath(index, 'diff'),
+                   'diff_mode': grbcore.diff_modes[png_diff_mode_combobox.current()],
+                   'pyramids': settings_other.get('png_export_pyramids', '1') != '0', 'layer': layer[0], 'raw': True,
+                   'png': settings_other.get('png_export_images', '1') != '0', 'skip_identical': True,
+                   'artifact': None}
+            if settings_other.get('png_export_artifact', '0') != '0':
+                job['artifact'] = os.path.splitext(export_layer_filepath(index, 'diff'))[0] + ".zip"
+            if coarse:
+                job['fine_dpi'] = png_dpi_entry.get()
+            job_keys[index] = export_layer_key(job, digests)
+            if (only_changed and job_keys[index] is not None and
+                    export_state['layer_keys'].get(index) == job_keys[index]):
+                continue
+            jobs.append(job)
+            job_layers.append(index)
+
+    try:
+        workers = int(png_workers_entry.get())
+    except ValueError:
+        workers = grbcore.default_workers()
+    if (only_changed and not jobs):
+        print("No layers have changed.")
+        export_png_status.configure(text="No layers have changed. "+time.strftime("%H:%M:%S"))
+        return
+    print("Exporting", len(jobs), "layers using", workers, "workers.")
+    profile = start_export_profile(png_export_dir_label["text"])
+
+    for index in job_layers:
+        layerresults[index].configure(text="Waiting")
+    cancel = threading.Event()
+    export_state['cancel'] = cancel
+    export_state['job_layers'] = job_layers
+    export_state['job_keys'] = job_keys
+    export_state['only_changed'] = only_changed
+    export_png_btn.configure(state=DISABLED)
+    cancel_export_btn.configure(state=NORMAL)
+
+    # Everything below runs on the background thread and must not touch the GUI
+    last_progress = [None]
+
+    def progress(done, total):
+        if (last_progress[0] != done):
+            last_progress[0] = done
+            export_events.put(('progress', done, total))
+
+    def layer_done(job_index, result):
+        export_events.put(('layer', job_layers[job_index], result))
+
+    def run_export():
+        try:
+            results = grbcore.run_export_jobs(jobs, workers, progress, layer_done, cancel, profile)
+        except Exception as e:
+            print("Unable to export png. Error:", e)
+            results = ["Failed to export. Error: "+str(e)] * len(jobs)
+        grbcore.finish_profile(profile)
+        export_events.put(('done', results))
+
+    threading.Thread(target=run_export, daemon=True).start()
+    root.after(100, poll_export_events)
+
+# Show the events of the running export in the GUI, until the export is done
+def poll_export_events():
+    while True:
+        try:
+            event = export_events.get_nowait()
+        except queue.Empty:
+            break
+        if (event[0] == 'progress'):
+            export_png_status.configure(text="Exporting and finding differences: "+str(event[1])+" of "+str(event[2])+
+                                        " tasks done")
+        elif (event[0] == 'layer'):
+            layerresults[event[1]].configure(text=event[2])
+        elif (event[0] == 'done'):
+            finish_export(event[1])
+            return
+    root.after(100, poll_export_events)
+
+# Show the result of an export that is done
+def finish_export(results):
+    job_layers = export_state['job_layers']
+    export_state['cancel'] = None
+    export_png_btn.configure(state=NORMAL)
+    cancel_export_btn.configure(state=DISABLED)
+    export_png_status.configure(text="")
+
+    # Remember what the layers were exported from, so they aren't exported again by watch mode until they change
+    for index, result in zip(job_layers, results):
+        if (result.startswith("OK")):
+            export_state['layer_keys'][index] = export_state['job_keys'].get(index)
+        else:
+            export_state['layer_keys'].pop(index, None)
+
     export_result = "Png Export Result:\r\n"
     for index, layer in enumerate(filetypes):
         export_result = export_result + layer[0] + ": "
-        if (firstgerbers[index].get() == "---" or secondgerbers[index].get() == "---"):
+        if index in job_layers:
+            export_result = export_result + results[job_layers.index(index)] + "\r\n"
+        else:
             export_result = export_result + "Not available in both Gerbers.\r\n"
+    # The viewer shows the new images
+    if (viewer['layer'] is not None):
+        view_layer(viewer['layer'])
+    if (export_state['only_changed']):
+        # The results are shown in the rows of the layers, since a message box for every change would be in the way
+        print(export_result)
+        export_png_status.configure(text="Exported "+str(len(job_layers))+" changed layers. "+time.strftime("%H:%M:%S"))
+    else:
+        messagebox.showwarning("Info", export_result)
+
+# Cancel the running export. GerbV processes that are running are killed, and layers that haven't been done are
+# skipped.
+def cancel_export():
+    if (export_state['cancel'] is not None):
+        export_state['cancel'].set()
+        export_png_status.configure(text="Cancelling the export")
+
+# Watch mode: Gerber 1 and 2 are checked for changes every watch_interval ms. When they have changed, and haven't
+# changed for watch_settle_time seconds (a CAD tool writes many files when it exports gerbers), they are opened again
+# and only the layers whose files have changed are exported again.
+watch_interval = 1000
+watch_settle_time = 2.0
+watch_state = {'signatures': {}, 'changed': None, 'gerbers': set(), 'polling': False}
+
+# Get a signature of the files of Gerber 1 or 2 (see grbcore.path_signature()), or None if they can't be read
+def gerber_signature(sel):
+    if (opened_gerbers[sel] is None):
+        return None
+    try:
+        if (zip_archives[sel] is not None or single_gerber):
+            return grbcore.path_signature(opened_gerbers[sel])
+        return grbcore.path_signature(gerber1_path if sel == 1 else gerber2_path)
+    except OSError:
+        return None
+
+def watch_poll():
+    if (not watch_var.get()):
+        watch_state['polling'] = False
+        return
+    for sel in (1, 2):
+        signature = gerber_signature(sel)
+        if (signature != watch_state['signatures'].get(sel)):
+            watch_state['signatures'][sel] = signature
+            watch_state['changed'] = time.time()
+            watch_state['gerbers'].add(sel)
+    if (watch_state['changed'] is not None and time.time() - watch_state['changed'] >= watch_settle_time and
+            export_state['cancel'] is None):
+        watch_state['changed'] = None
+        for sel in sorted(watch_state['gerbers']):
+            print("Gerber", sel, "has changed. Opening it again.")
+            open_gerber_file(opened_gerbers[sel], sel)
+        watch_state['gerbers'] = set()
+        export_png(only_changed=True)
+    root.after(watch_interval, watch_poll)
+
+def toggle_watch():
+    if (watch_var.get() and not watch_state['polling']):
+        print("Watching Gerber 1 and 2 for changes.")
+        watch_state['changed'] = None
+        watch_state['gerbers'] = set()
+        watch_state['polling'] = True
+        root.after(watch_interval, watch_poll)
+
+# Cancel a running export when the window is closed, so that GerbV processes aren't left running
+def close_window():
+    cancel_export()
+    root.destroy()
+
+# Compare the objects of the gerber files of every layer without rendering them. The holes of the drill files are
+# matched within the tolerances in settings.ini.
+def vector_diff():
+    import drilldiff
+
+    export_path = png_export_dir_label["text"]
+    drill = {'position_tolerance': float(settings_other.get('drill_position_tolerance',
+                                                            str(drilldiff.default_position_tolerance))),
+             'diameter_tolerance': float(settings_other.get('drill_diameter_tolerance',
+                                                            str(drilldiff.default_diameter_tolerance)))}
+    diff_result = "Vector Diff Result:\r\n"
+    for index, layer in enumerate(filetypes):
+        diff_result = diff_result + layer[0] + ": "
+        if (firstgerbers[index].get() == "---" or secondgerbers[index].get() == "---"):
+            diff_result = diff_result + "Not available in both Gerbers.\r\n"
         else:
-            export_png_status.configure(text="Exporting "+layer[0]+" Gerber 1")
+            export_png_status.configure(text="Comparing "+layer[0])
             root.update()  # For the GUI to update
-            export_layer(index, '1')
-            export_png_status.configure(text="Exporting "+layer[0]+" Gerber 2")
-            root.update()  # For the GUI to update
-            export_layer(index, '2')
-            export_png_status.configure(text="Exporting "+layer[0]+" Combined Gerber 1&2")
-            root.update()  # For the GUI to update
-            export_layer(index, 'combined')
-            export_png_status.configure(text="Finding differences in "+layer[0])
-            root.update()  # For the GUI to update
-
-            img_path = png_export_dir_label["text"]
-            img1_filename = layer[0].replace(" ", "_") + "-1.png"
-            img2_filename = layer[0].replace(" ", "_") + "-2.png"
-            img3_filename = layer[0].replace(" ", "_") + "-combined.png"
-            img1 = os.path.join(img_path, img1_filename).replace("/", os.sep)
-            img2 = os.path.join(img_path, img2_filename).replace("/", os.sep)
-            img3 = os.path.join(img_path, img3_filename).replace("/", os.sep)
-
-            # The code for finding the differences in the images is "borrowed" from Alison Américo:
-            # https://github.com/alisonamerico/image-difference
-            from skimage.metrics import structural_similarity  # scikit-image
-            import imutils
-            import cv2  # opencv-python
-
-            # load the two input images
-            imageA = cv2.imread(img1)
-            imageB = cv2.imread(img2)
-            imageC = cv2.imread(img3)
-
-            h1, w1, c1 = imageA.shape
-            print("Resolution of", img1, "is", w1, "x", h1)
-
-            h2, w2, c2 = imageB.shape
-            print("Resolution of", img2, "is", w2, "x", h2)
-
-            # convert the images to grayscale
-            grayA = cv2.cvtColor(imageA, cv2.COLOR_BGR2GRAY)
-            grayB = cv2.cvtColor(imageB, cv2.COLOR_BGR2GRAY)
-
-            if (h1 == h2 and w1 == w2):
-                try:
-                    # compute the Structural Similarity Index (SSIM) between the two
-                    # images, ensuring that the difference image is returned
-                    (score, diff) = structural_similarity(grayA, grayB, full=True)
-                    diff = (diff * 255).astype("uint8")
-                    print("SSIM: {}".format(score))
-
-                    # threshold the difference image, followed by finding contours to
-                    # obtain the regions of the two input images that differ
-                    thresh = cv2.threshold(diff, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
-                    cnts = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                    cnts = imutils.grab_contours(cnts)
-
-                    # loop over the contours
-                    for c in cnts:
-                        # compute the bounding box of the contour and then draw the
-                        # bounding box on both input images to represent where the two
-                        # images differ
-                        (x, y, w, h) = cv2.boundingRect(c)
-                        cv2.rectangle(imageA, (x, y), (x + w, y + h), (0, 0, 255), 2, cv2.LINE_AA)
-                        cv2.rectangle(imageB, (x, y), (x + w, y + h), (0, 0, 255), 2, cv2.LINE_AA)
-                        cv2.rectangle(imageC, (x, y), (x + w, y + h), (0, 0, 255), 2, cv2.LINE_AA)
-
-                    cv2.imwrite(img1, imageA)
-                    cv2.imwrite(img2, imageB)
-                    cv2.imwrite(img3, imageC)
-
-                    export_result = export_result + "OK. Images are "+format(round(score*100,2))+"% equal.\r\n"
-                except Exception as e:
-                    print("Unable to compare", img1, "and", img2, "Error:", e)
-                    export_result = export_result+"Failed to compare images. Error: "+str(e)+"\r\n"
-            else:
-                print("Images does not have the same resolution. Not able to compare", img1, "and", img2)
-                export_result = export_result+"Image 1 and 2 has different resolutions.\r\n"
-    messagebox.showwarning("Info", export_result)
+            filepath1 = gerber_filepath(1, firstgerbers[index].get())
+            filepath2 = gerber_filepath(2, secondgerbers[index].get())
+            report_filepath = None
+            if export_path:
+                report_filename = layer[0].replace(" ", "_") + "-vector-diff.json"
+                report_filepath = os.path.join(export_path, report_filename).replace("/", os.sep)
+            diff_result = diff_result + grbcore.vector_diff_layer(filepath1, filepath2, report_filepath,
+                                                                  drill if layer[0] in grbcore.drill_filetypes
+                                                                  else None) + "\r\n"
+    messagebox.showwarning("Info", diff_result)
     export_png_status.configure(text="")
 
 second_frame.grid_rowconfigure(row, minsize=15)
@@ -573,6 +850,16 @@ export_png_btn = Button(second_frame, text='Export png', command=lambda: export_
 export_png_btn.grid(column=1, row=row, sticky=W, padx=10)
 export_png_status = Label(second_frame, text="")
 export_png_status.grid(column=2, row=row, columnspan=3, sticky=W, padx=10)
+cancel_export_btn = Button(second_frame, text='Cancel export', command=lambda: cancel_export(), state=DISABLED)
+cancel_export_btn.grid(column=5, row=row, sticky=W, padx=10)
+row = row + 1
+
+vector_diff_btn = Button(second_frame, text='Vector diff', command=lambda: vector_diff())
+vector_diff_btn.grid(column=1, row=row, sticky=W, padx=10)
+watch_var = IntVar(value=0)
+watch_checkbutton = Checkbutton(second_frame, text='Watch for changes', variable=watch_var,
+                                command=lambda: toggle_watch())
+watch_checkbutton.grid(column=5, row=row, sticky=W, padx=10)
 row = row + 1
 
 # Add headline
@@ -654,25 +941,276 @@ png_dpi_entry = Entry(second_frame, width=50, textvariable=dpi_entry_variable)
 png_dpi_entry.grid(column=2, row=row, columnspan=3, sticky=W, padx=10)
 row = row + 1
 
+png_coarse_dpi_label = Label(second_frame, text="Export png coarse DPI (0 = off)")
+png_coarse_dpi_label.grid(column=1, row=row, sticky=W, padx=10)
+png_coarse_dpi_entry = Entry(second_frame, width=50, textvariable=coarse_dpi_entry_variable)
+png_coarse_dpi_entry.grid(column=2, row=row, columnspan=3, sticky=W, padx=10)
+row = row + 1
+
+png_workers_label = Label(second_frame, text="Export png workers")
+png_workers_label.grid(column=1, row=row, sticky=W, padx=10)
+png_workers_entry = Entry(second_frame, width=50, textvariable=workers_entry_variable)
+png_workers_entry.grid(column=2, row=row, columnspan=3, sticky=W, padx=10)
+row = row + 1
+
+merge_distance_label = Label(second_frame, text="Merge changes closer than (mm)")
+merge_distance_label.grid(column=1, row=row, sticky=W, padx=10)
+merge_distance_entry = Entry(second_frame, width=50, textvariable=merge_distance_entry_variable)
+merge_distance_entry.grid(column=2, row=row, columnspan=3, sticky=W, padx=10)
+row = row + 1
+
+# Renderers for the png export
+# The order is the same as in grbcore.renderers
+png_renderers = ["Built-in renderer (GerbV is used for files it can't render)", "GerbV",
+                 "GerbV, every file rendered once"]
+
+png_renderer_label = Label(second_frame, text="Export png renderer")
+png_renderer_label.grid(column=1, row=row, sticky=W, padx=10)
+png_renderer_combobox = Combobox(second_frame, width=50, values=png_renderers)
+png_renderer_combobox.grid(column=2, row=row, columnspan=3, sticky=W, padx=10)
+png_renderer_combobox.current(settings_other.get('png_renderer', '0'))
+row = row + 1
+
+# Ways of finding the differences in the png export
+# The order is the same as in grbcore.diff_modes
+png_diff_modes = ["SSIM (ignores small differences in the edges)", "Exact (every pixel, 1-bit images)"]
+
+png_diff_mode_label = Label(second_frame, text="Export png diff")
+png_diff_mode_label.grid(column=1, row=row, sticky=W, padx=10)
+png_diff_mode_combobox = Combobox(second_frame, width=50, values=png_diff_modes)
+png_diff_mode_combobox.grid(column=2, row=row, columnspan=3, sticky=W, padx=10)
+png_diff_mode_combobox.current(settings_other.get('png_diff_mode', '0'))
+row = row + 1
+
+def select_render_cache_dir():
+    folder_selected = askdirectory(title="Select Directory for the render cache")
+    if folder_selected:
+        print("Selected Folder:", folder_selected)
+        render_cache_dir_label.configure(text=folder_selected)
+        settings_paths['render_cache_path'] = folder_selected
+        write_settings_file()
+
+render_cache_dir_btn = Button(second_frame, text='Select render cache dir', command=lambda: select_render_cache_dir())
+render_cache_dir_btn.grid(column=1, row=row, sticky=W, padx=10)
+render_cache_dir_label = Label(second_frame, text="")
+render_cache_dir_label.grid(column=2, row=row, columnspan=3, sticky=W, padx=10)
+row = row + 1
+
+render_cache_size_label = Label(second_frame, text="Render cache size (MB)")
+render_cache_size_label.grid(column=1, row=row, sticky=W, padx=10)
+render_cache_size_entry = Entry(second_frame, width=50, textvariable=cache_size_entry_variable)
+render_cache_size_entry.grid(column=2, row=row, columnspan=3, sticky=W, padx=10)
+row = row + 1
+
+second_frame.grid_rowconfigure(row, minsize=15)
+row = row + 1
+
+# Viewer for the exported images of a layer. The images are shown from their image pyramids (see
+# grbpyramid.write_image_pyramid()), and only the tiles that are visible are loaded. The zoom is a power of 2, so the
+# tiles of a level are shown as they are when zoomed out, and zoomed in by a whole number when zoomed in.
+# Recently used tiles are kept in an LRU cache, so flipping between the images of a layer is instant.
+viewer_tile_cache_size = 192
+viewer_max_zoom = 3
+viewer = {'layer': None, 'sel': '1', 'images': {}, 'infos': {}, 'regions': [], 'zoom': 0, 'x': 0.0, 'y': 0.0,
+          'tiles': OrderedDict(), 'shown': [], 'drag': None}
+viewer_names = {'1': "Gerber 1", '2': "Gerber 2", 'combined': "Combined"}
+
+# Get a tile of an image pyramid as a PhotoImage, zoomed in by 'factor'.
+# Returns None if the tile doesn't exist, which means that it only has the background color.
+def viewer_tile(img, level, tile_row, tile_column, factor):
+    key = (img, level, tile_row, tile_column, factor)
+    tiles = viewer['tiles']
+    if (key in tiles):
+        tiles.move_to_end(key)
+        return tiles[key]
+    tile_path = grbpyramid.pyramid_tile_path(img, level, tile_row, tile_column)
+    photo = None
+    if (os.path.isfile(tile_path)):
+        photo = PhotoImage(file=tile_path)
+        if (factor > 1):
+            photo = photo.zoom(factor)
+    tiles[key] = photo
+    if (len(tiles) > viewer_tile_cache_size):
+        tiles.popitem(last=False)
+    return photo
+
+# Get the size of the viewer on the screen
+def viewer_size():
+    width = viewer_canvas.winfo_width()
+    height = viewer_canvas.winfo_height()
+    if (width <= 1 or height <= 1):
+        return (int(viewer_canvas['width']), int(viewer_canvas['height']))
+    return (width, height)
+
+# Draw the visible tiles of the selected image, and the change regions on top of them
+def viewer_draw():
+    viewer_canvas.delete(ALL)
+    viewer['shown'] = []
+    info = viewer['infos'].get(viewer['sel'])
+    if (info is None):
+        viewer_status.configure(text="")
+        return
+    img = viewer['images'][viewer['sel']]
+    viewer_canvas.configure(background=info['background'])
+    zoom = viewer['zoom']
+    level = max(0, -zoom)
+    factor = 2 ** max(0, zoom)
+    scale = 2.0 ** zoom  # Pixels on the screen per pixel of the image
+    tile_span = info['tile_size'] * 2 ** level  # Pixels of the image per tile
+    (width, height) = viewer_size()
+    first_column = max(0, int(viewer['x'] // tile_span))
+    last_column = min((info['width'] - 1) // tile_span, int((viewer['x'] + width/scale) // tile_span))
+    first_row = max(0, int(viewer['y'] // tile_span))
+    last_row = min((info['height'] - 1) // tile_span, int((viewer['y'] + height/scale) // tile_span))
+    for tile_row in range(first_row, last_row + 1):
+        for tile_column in range(first_column, last_column + 1):
+            photo = viewer_tile(img, level, tile_row, tile_column, factor)
+            if (photo is not None):
+                viewer['shown'].append(photo)  # Tkinter doesn't keep a reference to the image
+                viewer_canvas.create_image((tile_column*tile_span - viewer['x'])*scale,
+                                           (tile_row*tile_span - viewer['y'])*scale, image=photo, anchor=NW)
+    # The change regions are found in the common frame of image 1 and 2. The combined image has a frame of its own.
+    if (viewer_show_changes.get() and viewer['sel'] != 'combined'):
+        for (x, y, w, h) in viewer['regions']:
+            viewer_canvas.create_rectangle((x - viewer['x'])*scale, (y - viewer['y'])*scale,
+                                           (x + w - viewer['x'])*scale, (y + h - viewer['y'])*scale,
+                                           outline="#ff0000", width=2)
+    zoom_text = ("1:" + str(2 ** -zoom)) if zoom < 0 else (str(2 ** zoom) + ":1")
+    viewer_status.configure(text=filetypes[viewer['layer']][0] + " - " + viewer_names[viewer['sel']] + " - Zoom " +
+                            zoom_text + " - " + str(len(viewer['regions'])) + " changes")
+
+# Show image 1, 2 or the combined image of the layer, at the same place and zoom
+def viewer_select(sel):
+    if (viewer['infos'].get(sel) is not None):
+        viewer['sel'] = sel
+        viewer_draw()
+
+# Zoom in (step 1) or out (step -1) around a point in the viewer
+def viewer_zoom(step, x=None, y=None):
+    info = viewer['infos'].get(viewer['sel'])
+    if (info is None):
+        return
+    (width, height) = viewer_size()
+    if (x is None):
+        (x, y) = (width/2, height/2)
+    zoom = min(viewer_max_zoom, max(1 - info['levels'], viewer['zoom'] + step))
+    # Keep the point of the image under the pointer in the same place
+    viewer['x'] = viewer['x'] + x/2.0**viewer['zoom'] - x/2.0**zoom
+    viewer['y'] = viewer['y'] + y/2.0**viewer['zoom'] - y/2.0**zoom
+    viewer['zoom'] = zoom
+    viewer_draw()
+
+# Zoom out until the whole image fits in the viewer, and center it
+def viewer_fit():
+    info = viewer['infos'].get(viewer['sel'])
+    if (info is None):
+        return
+    (width, height) = viewer_size()
+    zoom = 0
+    while (zoom > 1 - info['levels'] and (info['width']*2.0**zoom > width or info['height']*2.0**zoom > height)):
+        zoom = zoom - 1
+    viewer['zoom'] = zoom
+    viewer['x'] = (info['width'] - width/2.0**zoom)/2
+    viewer['y'] = (info['height'] - height/2.0**zoom)/2
+    viewer_draw()
+
+def viewer_mouse_wheel(event):
+    if (event.num == 4 or event.delta > 0):
+        viewer_zoom(1, event.x, event.y)
+    else:
+        viewer_zoom(-1, event.x, event.y)
+
+def viewer_drag_start(event):
+    viewer_canvas.focus_set()
+    viewer['drag'] = (event.x, event.y, viewer['x'], viewer['y'])
+
+def viewer_drag(event):
+    if (viewer['drag'] is not None):
+        (x, y, view_x, view_y) = viewer['drag']
+        viewer['x'] = view_x - (event.x - x)/2.0**viewer['zoom']
+        viewer['y'] = view_y - (event.y - y)/2.0**viewer['zoom']
+        viewer_draw()
+
+# Show the exported images of a layer in the viewer
+def view_layer(layer_index):
+    images = {sel: export_layer_filepath(layer_index, sel) for sel in ('1', '2', 'combined')}
+    infos = {sel: grbpyramid.read_image_pyramid(img) for sel, img in images.items()}
+    if (infos['1'] is None and infos['2'] is None and infos['combined'] is None):
+        messagebox.showwarning("Info", "There are no exported images of " + filetypes[layer_index][0] +
+                               " to view. Export png first.")
+        return
+    regions = []
+    report = grbcore.read_change_report(export_layer_filepath(layer_index, 'diff'))
+    if (report is not None):
+        # Regions that were found in the windows of a coarse to fine diff are not in the frame of the images
+        regions = [region['pixels'] for region in report['regions'] if 'window' not in region]
+    keep_view = viewer['layer'] == layer_index
+    viewer.update({'layer': layer_index, 'images': images, 'infos': infos, 'regions': regions})
+    viewer['tiles'].clear()
+    if (infos.get(viewer['sel']) is None):
+        viewer['sel'] = '1' if infos['1'] is not None else ('2' if infos['2'] is not None else 'combined')
+    if (keep_view):
+        viewer_draw()
+    else:
+        viewer_fit()
+
+viewer_show_changes = IntVar(value=1)
+viewer_buttons = Frame(second_frame)
+viewer_buttons.grid(column=1, row=row, columnspan=5, sticky=W, padx=10)
+Button(viewer_buttons, text='Gerber 1 (1)', command=lambda: viewer_select('1')).pack(side=LEFT)
+Button(viewer_buttons, text='Gerber 2 (2)', command=lambda: viewer_select('2')).pack(side=LEFT)
+Button(viewer_buttons, text='Combined (3)', command=lambda: viewer_select('combined')).pack(side=LEFT)
+Button(viewer_buttons, text='Zoom in', command=lambda: viewer_zoom(1)).pack(side=LEFT)
+Button(viewer_buttons, text='Zoom out', command=lambda: viewer_zoom(-1)).pack(side=LEFT)
+Button(viewer_buttons, text='Fit', command=lambda: viewer_fit()).pack(side=LEFT)
+Checkbutton(viewer_buttons, text='Show changes', variable=viewer_show_changes, command=lambda: viewer_draw()).pack(side=LEFT)
+viewer_status = Label(viewer_buttons, text="")
+viewer_status.pack(side=LEFT, padx=10)
+row = row + 1
+
+viewer_canvas = Canvas(second_frame, width=1100, height=600, background="#000000", highlightthickness=0)
+viewer_canvas.grid(column=1, row=row, columnspan=5, sticky=W, padx=10)
+viewer_canvas.bind("<ButtonPress-1>", viewer_drag_start)
+viewer_canvas.bind("<B1-Motion>", viewer_drag)
+viewer_canvas.bind("<MouseWheel>", viewer_mouse_wheel)
+viewer_canvas.bind("<Button-4>", viewer_mouse_wheel)
+viewer_canvas.bind("<Button-5>", viewer_mouse_wheel)
+viewer_canvas.bind("<Key-1>", lambda event: viewer_select('1'))
+viewer_canvas.bind("<Key-2>", lambda event: viewer_select('2'))
+viewer_canvas.bind("<Key-3>", lambda event: viewer_select('combined'))
+row = row + 1
+
 # Get settings.
 gerbv_path.configure(text=settings_paths['gerbv_path'])
 dpi_entry_variable.set(settings_other['png_export_dpi'])
+coarse_dpi_entry_variable.set(settings_other.get('png_coarse_dpi', '0'))
+workers_entry_variable.set(settings_other.get('png_export_workers', str(grbcore.default_workers())))
+merge_distance_entry_variable.set(settings_other.get('change_merge_distance',
+                                                     str(grbcore.default_change_merge_distance)))
 png_export_dir_label.configure(text=settings_paths['png_export_path'])
+render_cache_dir_label.configure(text=settings_paths.get('render_cache_path', ''))
+cache_size_entry_variable.set(settings_other.get('render_cache_size', str(grbcore.default_render_cache_size)))
 
+file1_path = gerber1_arg
 if (gerber1_arg == ''):
     file1_path_settings = settings_paths['grb_file1']
     if (file1_path_settings != ''):
         if ( os.path.isfile(file1_path_settings) or os.path.isdir(file1_path_settings) ):
-            open_gerber_file(file1_path_settings, 1)
-else:
-    open_gerber_file(gerber1_arg, 1)
+            file1_path = file1_path_settings
 
+file2_path = gerber2_arg
 if (gerber2_arg == ''):
     file2_path_settings = settings_paths['grb_file2']
     if (file2_path_settings != ''):
         if ( os.path.isfile(file2_path_settings) or os.path.isdir(file2_path_settings) ):
-            open_gerber_file(file2_path_settings, 2)
-else:
-    open_gerber_file(gerber2_arg, 2)
+            file2_path = file2_path_settings
+
+# Read the lists of files of both zip archives at the same time
+zip_file_lists = grbcore.read_zip_members([file1_path, file2_path])
+if (file1_path != ''):
+    open_gerber_file(file1_path, 1, zip_file_lists[0])
+if (file2_path != ''):
+    open_gerber_file(file2_path, 2, zip_file_lists[1])
 
+root.protocol("WM_DELETE_WINDOW", close_window)
 root.mainloop()
\ No newline at end of file
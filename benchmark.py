@@ -0,0 +1,414 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import drilldiff
+import grbcore
+
+# Benchmarks of GrbDiff on synthetic boards, so that the speed of a change can be measured and compared with earlier
+# runs. Nothing here needs GerbV or a display.
+#
+# python benchmark.py [options]
+#     Generate boards of every size, run the scenarios for every size, DPI and renderer and write the results as JSON.
+#     Run "python benchmark.py --help" for the options.
+# python benchmark.py generate DIR [options]
+#     Only generate two revisions of a synthetic board, in DIR/1 and DIR/2.
+# python benchmark.py gerbv ARGS
+#     A stand-in for GerbV (see gerbv_stand_in()). It's started through the script written by write_gerbv_stand_in().
+
+# Name of the files of a generated board
+board_name = "board"
+
+
+# Write a gerber file. 'apertures' maps the D code to its definition, like "C,0.250000", and every object is
+# ('flash', x, y, D code), ('draw', x1, y1, x2, y2, D code) or ('region', [(x, y), ...]) in mm.
+def write_gerber(filepath, file_function, apertures, objects):
+    def coordinate(value):
+        return str(int(round(value*1000000)))
+
+    lines = ["G04 Synthetic board for the benchmarks of GrbDiff*",
+             "%TF.FileFunction," + file_function + "*%",
+             "%FSLAX46Y46*%",
+             "%MOMM*%",
+             "%LPD*%",
+             "G01*"]
+    for code, definition in sorted(apertures.items()):
+        lines.append("%ADD" + str(code) + definition + "*%")
+    current = None
+    for obj in objects:
+        if obj[0] == 'region':
+            points = obj[1]
+            lines.append("G36*")
+            lines.append("X" + coordinate(points[0][0]) + "Y" + coordinate(points[0][1]) + "D02*")
+            for (x, y) in points[1:] + points[:1]:
+                lines.append("X" + coordinate(x) + "Y" + coordinate(y) + "D01*")
+            lines.append("G37*")
+            continue
+        if obj[-1] != current:
+            current = obj[-1]
+            lines.append("D" + str(current) + "*")
+        if obj[0] == 'flash':
+            lines.append("X" + coordinate(obj[1]) + "Y" + coordinate(obj[2]) + "D03*")
+        else:
+            lines.append("X" + coordinate(obj[1]) + "Y" + coordinate(obj[2]) + "D02*")
+            lines.append("X" + coordinate(obj[3]) + "Y" + coordinate(obj[4]) + "D01*")
+    lines.append("M02*")
+    with open(filepath, 'w', newline='') as f:
+        f.write("\n".join(lines) + "\n")
+
+
+# Write an Excellon drill file. 'holes' is a list of (x, y, diameter) in mm.
+def write_excellon(filepath, file_function, holes):
+    diameters = sorted(set(diameter for (x, y, diameter) in holes))
+    lines = ["M48", "; #@! TF.FileFunction," + file_function, "FMAT,2", "METRIC,TZ"]
+    for tool, diameter in enumerate(diameters, 1):
+        lines.append("T" + str(tool) + "C" + format(diameter, '.3f'))
+    lines.extend(["%", "G90", "G05"])
+    for tool, diameter in enumerate(diameters, 1):
+        lines.append("T" + str(tool))
+        for (x, y, hole_diameter) in holes:
+            if hole_diameter == diameter:
+                lines.append("X" + format(x, '.3f') + "Y" + format(y, '.3f'))
+    lines.extend(["T0", "M30"])
+    with open(filepath, 'w', newline='') as f:
+        f.write("\n".join(lines) + "\n")
+
+
+# Get the layers of a board with a number of copper layers: the filename (matching grbcore.filetypes), the file
+# function and the kind of layer. Inner layers are named like KiCad names them.
+def board_layers(copper_layers):
+    copper_layers = max(2, min(6, copper_layers))
+    layers = [(board_name + "-F_Paste.gtp", "Paste,Top", 'paste'),
+              (board_name + "-F_SilkS.gto", "Legend,Top", 'silk'),
+              (board_name + "-F_Mask.gts", "Soldermask,Top", 'mask'),
+              (board_name + "-F_Cu.gtl", "Copper,L1,Top", 'outer')]
+    for inner in range(1, copper_layers - 1):
+        layers.append((board_name + "-In" + str(inner) + "_Cu.g" + str(inner + 1),
+                       "Copper,L" + str(inner + 1) + ",Inr", 'inner'))
+    layers.extend([(board_name + "-B_Cu.gbl", "Copper,L" + str(copper_layers) + ",Bot", 'outer'),
+                   (board_name + "-B_Mask.gbs", "Soldermask,Bot", 'mask'),
+                   (board_name + "-B_SilkS.gbo", "Legend,Bot", 'silk'),
+                   (board_name + "-B_Paste.gbp", "Paste,Bot", 'paste'),
+                   (board_name + "-PTH.drl", "Plated,1," + str(copper_layers) + ",PTH", 'drill'),
+                   (board_name + "-NPTH.drl", "NonPlated,1," + str(copper_layers) + ",NPTH", 'drill'),
+                   (board_name + "-Edge_Cuts.gm1", "Profile,NP", 'outline')])
+    return layers
+
+
+# Generate two revisions of a synthetic board in directory/1 and directory/2.
+# size is the width of the board in mm (the height is 3/4 of the width), copper_layers the number of copper layers
+# (2-6), density the number of pads per cm2, and change the part of the pads, tracks and holes that are moved in
+# revision 2. The same seed always gives the same boards.
+# Returns the list of filenames, which is the same for both revisions.
+def generate_board(directory, size=100.0, copper_layers=4, density=2.0, change=0.01, seed=1):
+    width = float(size)
+    height = width*0.75
+    count = max(1, int(density*width*height/100.0))
+    rnd = random.Random(seed)
+
+    def point(margin=2.0):
+        return (round(rnd.uniform(margin, width - margin), 3), round(rnd.uniform(margin, height - margin), 3))
+
+    # The features of the board. Pads are (x, y, D code), tracks (x1, y1, x2, y2) and holes (x, y, diameter).
+    pads = [point() + (rnd.choice((11, 12, 13)),) for i in range(count)]
+    tracks = []
+    for i in range(count):
+        (x, y) = point()
+        if rnd.random() < 0.5:
+            tracks.append((x, y, min(width - 2.0, x + rnd.uniform(1.0, 15.0)), y))
+        else:
+            tracks.append((x, y, x, min(height - 2.0, y + rnd.uniform(1.0, 15.0))))
+    holes = [(x, y, 0.4) for (x, y, code) in pads[:count//4]] + [point(5.0) + (3.2,) for i in range(4)]
+    pour = [(1.0, 1.0), (width/2, 1.0), (width/2, height/2), (1.0, height/2)]
+
+    # Revision 2 has a part of the features moved
+    moved = random.Random(seed + 1)
+
+    def move(items, distance=0.5):
+        result = list(items)
+        for index in moved.sample(range(len(result)), int(round(len(result)*change))):
+            item = result[index]
+            result[index] = (round(item[0] + distance, 3), item[1]) + tuple(item[2:])
+        return result
+
+    revisions = [(pads, tracks, holes), (move(pads), move(tracks), move(holes))]
+    layers = board_layers(copper_layers)
+    for revision, (revision_pads, revision_tracks, revision_holes) in enumerate(revisions, 1):
+        revision_dir = os.path.join(directory, str(revision))
+        os.makedirs(revision_dir, exist_ok=True)
+        for (filename, file_function, kind) in layers:
+            filepath = os.path.join(revision_dir, filename)
+            if kind == 'drill':
+                plated = file_function.startswith("Plated")
+                write_excellon(filepath, file_function, [hole for hole in revision_holes if (hole[2] < 1.0) == plated])
+                continue
+            apertures = {10: "C,0.250000", 11: "R,1.500000X1.000000", 12: "C,1.200000", 13: "O,1.800000X0.900000"}
+            objects = []
+            if kind == 'outline':
+                apertures = {10: "C,0.100000"}
+                corners = [(0.0, 0.0), (width, 0.0), (width, height), (0.0, height)]
+                objects = [('draw',) + corners[i] + corners[(i + 1) % 4] + (10,) for i in range(4)]
+            elif kind in ('outer', 'paste', 'mask'):
+                if kind == 'mask':
+                    apertures = {11: "R,1.600000X1.100000", 12: "C,1.300000", 13: "O,1.900000X1.000000"}
+                objects = [('flash', x, y, code) for (x, y, code) in revision_pads]
+                if kind == 'outer':
+                    objects.extend(('draw',) + track + (10,) for track in revision_tracks)
+            elif kind == 'inner':
+                objects = [('region', pour)] + [('draw',) + track + (10,) for track in revision_tracks[::2]]
+            elif kind == 'silk':
+                apertures = {10: "C,0.150000"}
+                objects = [('draw', x - 1.0, y + 0.8, x + 1.0, y + 0.8, 10) for (x, y, code) in revision_pads[::3]]
+            write_gerber(filepath, file_function, apertures, objects)
+        # A file that isn't a layer, like the ones that are usually in a zip archive of gerbers
+        with open(os.path.join(revision_dir, board_name + "-job.gbrjob"), 'w') as f:
+            json.dump({'Header': {'GenerationSoftware': {'Application': "GrbDiff benchmark"}}}, f)
+    return sorted(os.listdir(os.path.join(directory, "1")))
+
+
+# A stand-in for GerbV that exports png images with the built in renderer of GrbDiff (see gerber.py). It takes the
+# same arguments as GrbDiff gives GerbV: --background, --foreground, --dpi, --origin, --window_inch, -o and the files.
+# The output is the same every time, so results can be compared between runs.
+# Returns the exit code.
+def gerbv_stand_in(args):
+    import cv2  # opencv-python
+    import gerber
+
+    def option(name):
+        return [arg.split('=', 1)[1] for arg in args if arg.startswith(name + '=')]
+
+    files = [arg for arg in args if not arg.startswith('-')]
+    outputs = [arg[2:] for arg in args if arg.startswith('-o')]
+    if not files or not outputs:
+        print("Usage: gerbv [-a] --background=#RRGGBB --foreground=#RRGGBBAA ... --export=png --dpi=DPI -oFILE FILES")
+        return 2
+    dpi = float((option('--dpi') or ['300'])[0])
+    background = (option('--background') or ['#000000'])[0]
+    foregrounds = option('--foreground')
+    colors = [foregrounds[index] if index < len(foregrounds) else '#FFFFFF' for index in range(len(files))]
+    try:
+        parsed = [gerber.parse_file(filepath) for filepath in files]
+        frame = None
+        if option('--origin') and option('--window_inch'):
+            (left, bottom) = [float(value) for value in option('--origin')[0].split('x')]
+            (width, height) = [float(value) for value in option('--window_inch')[0].split('x')]
+            frame = (left, bottom, int(round(width*dpi)), int(round(height*dpi)))
+        image = gerber.render_image(parsed, colors, background, dpi, frame)[0]
+    except (gerber.Unsupported, OSError) as e:
+        print("Unable to render", files, "Error:", e)
+        return 1
+    return 0 if cv2.imwrite(outputs[0], image) else 1
+
+
+# Write an executable script to 'directory' that starts the GerbV stand-in, since GrbDiff starts GerbV as a program.
+# Returns the path of the script.
+def write_gerbv_stand_in(directory):
+    script = os.path.abspath(__file__)
+    if os.name == 'nt':
+        filepath = os.path.join(directory, "gerbv.cmd")
+        with open(filepath, 'w') as f:
+            f.write('@"' + sys.executable + '" "' + script + '" gerbv %*\n')
+    else:
+        filepath = os.path.join(directory, "gerbv")
+        with open(filepath, 'w') as f:
+            f.write('#!/bin/sh\nexec "' + sys.executable + '" "' + script + '" gerbv "$@"\n')
+        os.chmod(filepath, 0o755)
+    return filepath
+
+
+# Run a function 'repeat' times and get the time of every run in seconds. 'setup' is called before every run, and
+# isn't included in the time.
+def timed(function, repeat, setup=None):
+    times = []
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+# Render an image like the png export does, without the render cache
+def render(process_args, source, export_filepath, renderer):
+    context = grbcore.new_render_context()
+    try:
+        return grbcore.render_file(process_args, source, export_filepath, renderer, context)
+    finally:
+        grbcore.finish_render_context(context)
+
+
+# Get the sources (see grbcore.render_images()) of the three images of a layer of a generated board, like the png
+# export of GrbDiff makes them with the first png color template
+def layer_sources(board_dir, filename, dpi):
+    template = grbcore.png_color_template[0]
+    (bg_color, color1, color2, combined1, combined2) = template[1:6]
+    outline = board_name + "-Edge_Cuts.gm1"
+    file1 = os.path.join(board_dir, "1", filename)
+    file2 = os.path.join(board_dir, "2", filename)
+    outline1 = os.path.join(board_dir, "1", outline)
+    outline2 = os.path.join(board_dir, "2", outline)
+    return [{'files': [file1, outline1], 'colors': [color1, color1], 'bg_color': bg_color, 'dpi': str(dpi)},
+            {'files': [file2, outline2], 'colors': [color2, color2], 'bg_color': bg_color, 'dpi': str(dpi)},
+            {'files': [file1, file2, outline1, outline2], 'colors': [combined1, combined2, combined1, combined2],
+             'bg_color': bg_color, 'dpi': str(dpi)}]
+
+
+# Run the scenarios on a generated board and add the results to 'results':
+# - classify: match the files of a revision with the layers, reading the file function of the files, as when a
+#   directory is opened in GrbDiff
+# - drill: compare the holes of the plated drill files of the revisions (see drilldiff.py)
+# - render: render the image of gerber 1 of the top copper layer with every renderer
+# - diff: find and mark the differences between the images of the top copper layer (the SSIM or the exact diff, the
+#   change regions and the marked images) with every diff mode
+# - export: the png export of all layers, with every renderer
+def run_scenarios(board_dir, filelist, size, dpis, renderers, diff_modes, gerbv, work_dir, repeat, workers, results):
+    def add(scenario, times, **params):
+        result = dict(scenario=scenario, size_mm=size, **params)
+        result.update({'times': [round(t, 6) for t in times], 'best': round(min(times), 6),
+                       'median': round(statistics.median(times), 6)})
+        print(format(scenario, '10'), json.dumps(params), "best", format(min(times), '.4f'), "s, median",
+              format(statistics.median(times), '.4f'), "s")
+        results.append(result)
+
+    revision_dir = os.path.join(board_dir, "1")
+    times = timed(lambda: grbcore.classify_files(filelist, grbcore.filetypes,
+                                                 lambda f: grbcore.read_file_head(os.path.join(revision_dir, f))),
+                  repeat)
+    add('classify', times, files=len(filelist))
+
+    drill_files = [os.path.join(board_dir, revision, board_name + "-PTH.drl") for revision in ("1", "2")]
+    times = timed(lambda: drilldiff.compare_files(*drill_files), repeat)
+    result = drilldiff.compare_files(*drill_files)
+    add('drill', times, holes=result['unchanged'] + len(result['removed']) + len(result['moved']) +
+        len(result['resized']))
+
+    filename = board_name + "-F_Cu.gtl"
+    for dpi in dpis:
+        sources = layer_sources(board_dir, filename, dpi)
+        images = [os.path.join(work_dir, "layer-" + sel + ".png") for sel in ('1', '2', 'combined')]
+        for renderer in renderers:
+            process_args = grbcore.gerbv_export_args(gerbv, sources[0]['files'], sources[0]['colors'],
+                                                     sources[0]['bg_color'], dpi, images[0])
+            times = timed(lambda: render(process_args, sources[0], images[0], renderer), repeat)
+            add('render', times, dpi=dpi, renderer=renderer)
+
+        # The diff overwrites the images with the differences marked, so they are rendered again before every run
+        rendered = [os.path.join(work_dir, "rendered-" + sel + ".png") for sel in ('1', '2', 'combined')]
+        for source, image in zip(sources, rendered):
+            process_args = grbcore.gerbv_export_args(gerbv, source['files'], source['colors'], source['bg_color'],
+                                                     dpi, image)
+            render(process_args, source, image, 'native')
+        report = {'dpi': dpi, 'frame': None, 'filepath': None, 'merge_distance': grbcore.default_change_merge_distance}
+
+        def copy_images():
+            for source_image, image in zip(rendered, images):
+                shutil.copyfile(source_image, image)
+
+        for mode in diff_modes:
+            times = timed(lambda: grbcore.diff_layer_images(*images, grbcore.default_ssim_tile_size, None, report,
+                                                            mode=mode), repeat, copy_images)
+            add('diff', times, dpi=dpi, mode=mode, regions=len(report['content']['regions']))
+
+        for renderer in renderers:
+            jobs = []
+            for (layer_filename, file_function, kind) in board_layers(len([f for f in filelist if "_Cu." in f])):
+                if kind == 'outline':
+                    continue
+                sources_of_layer = layer_sources(board_dir, layer_filename, dpi)
+                layer_images = [os.path.join(work_dir, layer_filename.replace(".", "_") + "-" + sel + ".png")
+                                for sel in ('1', '2', 'combined')]
+                renders = [grbcore.gerbv_export_args(gerbv, source['files'], source['colors'], source['bg_color'], dpi,
+                                                     image)
+                           for source, image in zip(sources_of_layer, layer_images)]
+                jobs.append({'renders': renders, 'sources': sources_of_layer, 'images': layer_images,
+                             'renderer': renderer})
+            times = timed(lambda: grbcore.run_export_jobs(jobs, workers), repeat)
+            add('export', times, dpi=dpi, renderer=renderer, layers=len(jobs), workers=workers)
+
+
+# Print how much faster or slower every result is than the same scenario in an earlier run
+def compare_results(results, earlier_filepath):
+    with open(earlier_filepath) as f:
+        earlier = json.load(f)['results']
+
+    def key(result):
+        return json.dumps({name: value for name, value in result.items()
+                           if name not in ('times', 'best', 'median', 'regions')}, sort_keys=True)
+
+    earlier_results = {key(result): result for result in earlier}
+    print("Compared with", earlier_filepath, "(best times):")
+    for result in results:
+        other = earlier_results.get(key(result))
+        if other is None:
+            continue
+        ratio = result['best']/other['best'] if other['best'] > 0 else float('inf')
+        print(format(result['scenario'], '10'), key(result), format(other['best'], '.4f'), "->",
+              format(result['best'], '.4f'), "s", format(ratio, '.2f') + "x")
+
+
+def main(argv):
+    if argv[:1] == ['gerbv']:
+        return gerbv_stand_in(argv[1:])
+
+    parser = argparse.ArgumentParser(description="Benchmarks of GrbDiff on synthetic boards")
+    parser.add_argument('command', nargs='?', choices=['run', 'generate'], default='run')
+    parser.add_argument('directory', nargs='?', help="where the boards are generated (generate only)")
+    parser.add_argument('--sizes', default="50,100", help="widths of the boards in mm, like 50,100,200")
+    parser.add_argument('--dpis', default="150,300", help="DPIs of the renders, like 150,300,600")
+    parser.add_argument('--layers', type=int, default=4, help="number of copper layers (2-6)")
+    parser.add_argument('--density', type=float, default=2.0, help="pads per cm2")
+    parser.add_argument('--change', type=float, default=0.01, help="part of the features that are moved in revision 2")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--renderers', default=",".join(grbcore.renderers), help="renderers to run, like native,gerbv")
+    parser.add_argument('--diff-modes', default=",".join(grbcore.diff_modes), help="diff modes to run, like ssim,exact")
+    parser.add_argument('--gerbv', default="", help="GerbV to use instead of the stand-in")
+    parser.add_argument('--repeat', type=int, default=3, help="number of times every scenario is run")
+    parser.add_argument('--workers', type=int, default=grbcore.default_workers(), help="workers of the png export")
+    parser.add_argument('--output', default="benchmark-results.json", help="where the results are written")
+    parser.add_argument('--compare', default="", help="results of an earlier run to compare with")
+    options = parser.parse_args(argv)
+
+    sizes = [float(size) for size in options.sizes.split(',')]
+    if options.command == 'generate':
+        if not options.directory:
+            parser.error("generate needs a directory")
+        for size in sizes:
+            board_dir = os.path.join(options.directory, format(size, 'g') + "mm")
+            filelist = generate_board(board_dir, size, options.layers, options.density, options.change, options.seed)
+            print("Generated", len(filelist), "files in", board_dir)
+        return 0
+
+    work_dir = tempfile.mkdtemp(prefix="GrbDiff-Benchmark-")
+    results = []
+    try:
+        gerbv = options.gerbv or write_gerbv_stand_in(work_dir)
+        for size in sizes:
+            board_dir = os.path.join(work_dir, format(size, 'g') + "mm")
+            filelist = generate_board(board_dir, size, options.layers, options.density, options.change, options.seed)
+            print("Board of", format(size, 'g'), "mm with", len(filelist), "files")
+            run_scenarios(board_dir, filelist, size, [int(dpi) for dpi in options.dpis.split(',')],
+                          options.renderers.split(','), options.diff_modes.split(','), gerbv, work_dir,
+                          options.repeat, options.workers, results)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(options.output, 'w') as f:
+        json.dump({'started': time.strftime("%Y-%m-%d %H:%M:%S"), 'python': platform.python_version(),
+                   'platform': platform.platform(), 'cpus': os.cpu_count(), 'options': vars(options),
+                   'results': results}, f, indent=1)
+    print("Results written to", options.output)
+    if options.compare:
+        compare_results(results, options.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,250 @@
+import math
+from collections import Counter
+
+import gerber
+
+# Comparison of the holes of two drill files (see gerber.py) without rendering them.
+# Every hole is a drill hit or a slot. Holes that are exactly the same in both files are removed first, then the holes
+# that are the same within the position and diameter tolerances. The remaining holes are matched with the nearest hole
+# in the other file, so holes that have moved a short distance or changed diameter are reported as moved or resized
+# instead of as one removed and one added hole. Moves that are smaller than a pixel of the png export are found too.
+# The nearest holes are found with a KD-tree if scipy is installed, and with a grid of cells otherwise.
+
+# Default distance in mm that a hole may move and still be the same hole
+default_position_tolerance = 0.005
+
+# Default change of the diameter in mm that a hole may have and still be the same hole
+default_diameter_tolerance = 0.005
+
+# Default distance in mm within which a changed hole is reported as moved or resized rather than removed and added
+default_match_distance = 0.5
+
+# Resolution (in inches) used when comparing coordinates
+_resolution = 1e-6
+
+
+# Get the diameter of a hole from its aperture (see gerber.parse_excellon()). Holes in Gerber drill files may have
+# other apertures than circles, and get the width or height of the aperture, whichever is larger.
+def hole_diameter(aperture):
+    (name, params) = aperture[0]
+    if name == 'C':
+        return params[0]
+    (left, bottom, right, top) = gerber.shape_extents(aperture[1])
+    return max(right - left, top - bottom)
+
+
+# Get the holes of a parsed drill file as (x, y, diameter, slot) in inches. 'slot' is None for a drill hit and the
+# ends (x1, y1, x2, y2) for a slot or a routed path, whose position is the middle of the ends.
+def holes(objects):
+    result = []
+    for obj in objects:
+        kind = obj[0]
+        if kind == 'flash':
+            result.append((obj[1], obj[2], hole_diameter(obj[3]), None))
+        elif kind in ('draw', 'arc'):
+            aperture = obj[5] if kind == 'draw' else obj[8]
+            result.append(((obj[1] + obj[3])/2, (obj[2] + obj[4])/2, hole_diameter(aperture), tuple(obj[1:5])))
+        else:
+            raise gerber.Unsupported("Regions in a drill file")
+    return result
+
+
+# Get a key for a hole, which is the same for holes that are drilled the same
+def hole_key(hole):
+    key = (round(hole[0]/_resolution), round(hole[1]/_resolution), round(hole[2]/_resolution))
+    if hole[3] is None:
+        return key
+    ends = sorted(((round(hole[3][0]/_resolution), round(hole[3][1]/_resolution)),
+                   (round(hole[3][2]/_resolution), round(hole[3][3]/_resolution))))
+    return key + tuple(ends)
+
+
+# Get whether a hole has moved and whether it has been resized in the other file, beyond the tolerances (in inches).
+# A slot has been resized if its length has changed, and moved if its middle has moved or it has been turned.
+def hole_change(hole1, hole2, position_tolerance, diameter_tolerance):
+    moved = math.hypot(hole2[0] - hole1[0], hole2[1] - hole1[1]) > position_tolerance
+    resized = abs(hole2[2] - hole1[2]) > diameter_tolerance
+    if hole1[3] is not None and hole2[3] is not None:
+        (x1, y1, x2, y2) = hole1[3]
+        (x3, y3, x4, y4) = hole2[3]
+        length1 = math.hypot(x2 - x1, y2 - y1)
+        length2 = math.hypot(x4 - x3, y4 - y3)
+        if abs(length2 - length1) > position_tolerance:
+            resized = True
+        else:
+            # The ends of slot 2 moved back to the middle of slot 1, in either order
+            (dx, dy) = (hole2[0] - hole1[0], hole2[1] - hole1[1])
+            turned = min(math.hypot(x3 - dx - x1, y3 - dy - y1) + math.hypot(x4 - dx - x2, y4 - dy - y2),
+                         math.hypot(x4 - dx - x1, y4 - dy - y1) + math.hypot(x3 - dx - x2, y3 - dy - y2))
+            moved = moved or turned > 2*position_tolerance
+    return moved, resized
+
+
+# Get the pairs of holes (distance, index in holes1, index in holes2) whose positions are at most 'radius' (in inches)
+# apart, ordered by the distance and then by the change of the diameter
+def near_pairs(holes1, holes2, radius):
+    if not holes1 or not holes2:
+        return []
+    try:
+        import numpy
+        from scipy.spatial import cKDTree  # scipy
+    except ImportError:
+        cKDTree = None
+
+    if cKDTree is not None:
+        tree1 = cKDTree(numpy.array([hole[:2] for hole in holes1], dtype=numpy.float64))
+        tree2 = cKDTree(numpy.array([hole[:2] for hole in holes2], dtype=numpy.float64))
+        pairs = tree1.sparse_distance_matrix(tree2, radius, output_type='ndarray')
+        diameters1 = numpy.array([hole[2] for hole in holes1])
+        diameters2 = numpy.array([hole[2] for hole in holes2])
+        resized = numpy.abs(diameters1[pairs['i']] - diameters2[pairs['j']])
+        order = numpy.lexsort((resized, pairs['v']))
+        return list(zip(pairs['v'][order].tolist(), pairs['i'][order].tolist(), pairs['j'][order].tolist()))
+
+    cell = max(radius, _resolution)
+    grid = {}
+    for index, hole in enumerate(holes2):
+        grid.setdefault((int(math.floor(hole[0]/cell)), int(math.floor(hole[1]/cell))), []).append(index)
+    pairs = []
+    for index1, (x, y, diameter, slot) in enumerate(holes1):
+        cx, cy = int(math.floor(x/cell)), int(math.floor(y/cell))
+        for gx in (cx - 1, cx, cx + 1):
+            for gy in (cy - 1, cy, cy + 1):
+                for index2 in grid.get((gx, gy), ()):
+                    other = holes2[index2]
+                    distance = math.hypot(other[0] - x, other[1] - y)
+                    if distance <= radius:
+                        pairs.append((distance, abs(other[2] - diameter), index1, index2))
+    pairs.sort()
+    return [(distance, index1, index2) for (distance, resized, index1, index2) in pairs]
+
+
+# Match the holes of two lists with each other, the nearest holes first. Only holes whose positions are at most
+# 'radius' (in inches) apart and for which accept(hole1, hole2) is True are matched, and every hole at most once.
+# Returns the pairs of matched holes and the holes of both lists that are left.
+def match_holes(holes1, holes2, radius, accept):
+    taken1 = set()
+    taken2 = set()
+    pairs = []
+    for distance, index1, index2 in near_pairs(holes1, holes2, radius):
+        if index1 in taken1 or index2 in taken2 or not accept(holes1[index1], holes2[index2]):
+            continue
+        taken1.add(index1)
+        taken2.add(index2)
+        pairs.append((holes1[index1], holes2[index2]))
+    return (pairs, [hole for index, hole in enumerate(holes1) if index not in taken1],
+            [hole for index, hole in enumerate(holes2) if index not in taken2])
+
+
+# Compare the holes of two drill files (see holes()). The tolerances and the match distance are in mm.
+# Returns a dict with the lists of 'added' and 'removed' holes, the pairs of holes that have 'moved' and that have been
+# 'resized' (and maybe moved as well) and the number of 'unchanged' holes.
+def compare(holes1, holes2, position_tolerance=default_position_tolerance,
+            diameter_tolerance=default_diameter_tolerance, match_distance=default_match_distance):
+    position_tolerance = max(position_tolerance/25.4, _resolution)
+    diameter_tolerance = max(diameter_tolerance/25.4, _resolution)
+    match_distance = max(match_distance/25.4, position_tolerance)
+
+    # Holes that are exactly the same in both files. The same hole may be drilled more than once in a file, so only
+    # the keys that appear a different number of times in the files have holes that are added or removed.
+    keys1 = [hole_key(hole) for hole in holes1]
+    keys2 = [hole_key(hole) for hole in holes2]
+    counts1 = Counter(keys1)
+    counts2 = Counter(keys2)
+    unchanged = sum(min(count, counts2.get(key, 0)) for key, count in counts1.items())
+
+    def unmatched(holes_of_file, keys, other_counts):
+        left = dict(other_counts)
+        result = []
+        for hole, key in zip(holes_of_file, keys):
+            if left.get(key, 0) > 0:
+                left[key] = left[key] - 1
+            else:
+                result.append(hole)
+        return result
+
+    removed = unmatched(holes1, keys1, counts2)
+    added = unmatched(holes2, keys2, counts1)
+
+    def same_kind(hole1, hole2):
+        return (hole1[3] is None) == (hole2[3] is None)
+
+    # Holes that are the same within the tolerances
+    (same, removed, added) = match_holes(removed, added, position_tolerance,
+                                         lambda hole1, hole2: same_kind(hole1, hole2) and not any(
+                                             hole_change(hole1, hole2, position_tolerance, diameter_tolerance)))
+    unchanged = unchanged + len(same)
+
+    # Holes that have moved or have been resized
+    (pairs, removed, added) = match_holes(removed, added, match_distance, same_kind)
+    moved = []
+    resized = []
+    for hole1, hole2 in pairs:
+        (hole_moved, hole_resized) = hole_change(hole1, hole2, position_tolerance, diameter_tolerance)
+        if hole_resized:
+            resized.append((hole1, hole2))
+        elif hole_moved:
+            moved.append((hole1, hole2))
+        else:
+            unchanged = unchanged + 1
+
+    return {
+        'unchanged': unchanged,
+        'removed': removed,
+        'added': added,
+        'moved': moved,
+        'resized': resized,
+    }
+
+
+# Describe a hole as a dict with its position and diameter in mm
+def describe(hole):
+    description = {'type': 'hit' if hole[3] is None else 'slot',
+                   'position': [round(hole[0]*25.4, 4), round(hole[1]*25.4, 4)], 'diameter': round(hole[2]*25.4, 4)}
+    if hole[3] is not None:
+        description['ends'] = [round(value*25.4, 4) for value in hole[3]]
+    return description
+
+
+# Describe what has changed between two matched holes
+def change_text(hole1, hole2):
+    changes = []
+    if hole_key(hole1)[:2] != hole_key(hole2)[:2]:
+        changes.append("moved " + format((hole2[0] - hole1[0])*25.4, '.4f') + ", " +
+                       format((hole2[1] - hole1[1])*25.4, '.4f') + " mm")
+    if hole_key(hole1)[2] != hole_key(hole2)[2]:
+        changes.append("diameter changed from " + format(hole1[2]*25.4, '.4g') + " to " +
+                       format(hole2[2]*25.4, '.4g') + " mm")
+    if hole1[3] is not None and hole_key(hole1)[3:] != hole_key(hole2)[3:]:
+        changes.append("ends changed")
+    return ", ".join(changes)
+
+
+# Convert the result of compare() to a dict that can be written as JSON
+def report(result):
+    return {
+        'unchanged': result['unchanged'],
+        'added': [describe(hole) for hole in result['added']],
+        'removed': [describe(hole) for hole in result['removed']],
+        'moved': [{'from': describe(hole1), 'to': describe(hole2), 'change': change_text(hole1, hole2),
+                   'distance_mm': round(math.hypot(hole2[0] - hole1[0], hole2[1] - hole1[1])*25.4, 4)}
+                  for (hole1, hole2) in result['moved']],
+        'resized': [{'from': describe(hole1), 'to': describe(hole2), 'change': change_text(hole1, hole2)}
+                    for (hole1, hole2) in result['resized']],
+    }
+
+
+# Get a one line summary of the result of compare()
+def summary(result):
+    if not (result['added'] or result['removed'] or result['moved'] or result['resized']):
+        return "Identical. " + str(result['unchanged']) + " holes."
+    return (str(len(result['added'])) + " added, " + str(len(result['removed'])) + " removed, " +
+            str(len(result['moved'])) + " moved, " + str(len(result['resized'])) + " resized, " +
+            str(result['unchanged']) + " unchanged holes.")
+
+
+# Compare the holes of two drill files. The tolerances and the match distance are in mm (see compare()).
+def compare_files(filepath1, filepath2, position_tolerance=default_position_tolerance,
+                  diameter_tolerance=default_diameter_tolerance, match_distance=default_match_distance):
+    return compare(holes(gerber.parse_file(filepath1)), holes(gerber.parse_file(filepath2)), position_tolerance,
+                   diameter_tolerance, match_distance)
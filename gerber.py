@@ -0,0 +1,1269 @@
+import math
+import re
+
+# Parser and renderer for RS-274X Gerber files and Excellon drill files. Used to render layers to images without
+# starting GerbV. Only the commonly used parts of the formats are supported. Anything else raises Unsupported, and the
+# caller is expected to use GerbV instead.
+#
+# A parsed file is a list of objects. All coordinates are in inches, like in GerbV:
+#   ('flash', x, y, aperture, dark)
+#   ('draw', x1, y1, x2, y2, aperture, dark)
+#   ('arc', x1, y1, x2, y2, cx, cy, sweep, aperture, dark)     sweep in radians, positive is counterclockwise
+#   ('region', contour, dark)
+# An aperture is a tuple of a description and a shape. The description is the aperture template name and parameters
+# (in inches), which can be compared between files. The shape is a list of primitives relative to the flash position:
+#   ('circle', cx, cy, diameter, exposure)
+#   ('poly', [(x, y), ...], exposure)
+# A contour is a list of (x, y) points and arcs (cx, cy, sweep, x, y) where (x, y) is the end point of the arc.
+# dark is False for objects with clear polarity.
+
+
+class Unsupported(Exception):
+    pass
+
+
+# Number of fractional bits used for the coordinates when drawing with OpenCV
+SHIFT = 4
+
+# Version of the rendered images. Increase it when a change makes the images different, so that renders in the render
+# cache (see grbcore.py) from earlier versions are not used.
+RENDER_VERSION = 1
+
+
+# Parse a Gerber or Excellon file. Returns the list of objects.
+def parse_file(filepath):
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    return parse_data(data)
+
+
+# Parse the content of a Gerber or Excellon file
+def parse_data(data):
+    if isinstance(data, bytes):
+        data = data.decode('latin-1')
+    try:
+        if '%FS' in data:
+            return parse_gerber(data)
+        if re.search(r'^\s*(M48|T\d+\S*C[\d.]+)', data, re.M):
+            return parse_excellon(data)
+    except (ValueError, IndexError, KeyError, AttributeError, ZeroDivisionError) as e:
+        raise Unsupported("Unable to parse file: "+str(e))
+    raise Unsupported("Unknown file format")
+
+
+# -------------------------------------------------------------------------------------------------------------------
+# Apertures
+
+
+def _rotate(x, y, degrees):
+    if degrees == 0:
+        return x, y
+    a = math.radians(degrees)
+    return x*math.cos(a) - y*math.sin(a), x*math.sin(a) + y*math.cos(a)
+
+
+def _rect_points(x0, y0, x1, y1):
+    return [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+
+
+def _circle_points(cx, cy, radius, count, start=0.0, sweep=2*math.pi):
+    return [(cx + radius*math.cos(start + sweep*i/count), cy + radius*math.sin(start + sweep*i/count))
+            for i in range(count + (0 if sweep == 2*math.pi else 1))]
+
+
+# Points of an obround (a rectangle with half circles at the short ends)
+def _obround_points(width, height):
+    if width == height:
+        return _circle_points(0, 0, width/2, 64)
+    if width > height:
+        r = height/2
+        d = width/2 - r
+        return (_circle_points(d, 0, r, 32, -math.pi/2, math.pi) + _circle_points(-d, 0, r, 32, math.pi/2, math.pi))
+    r = width/2
+    d = height/2 - r
+    return (_circle_points(0, d, r, 32, 0, math.pi) + _circle_points(0, -d, r, 32, math.pi, math.pi))
+
+
+# Build the shape of one of the standard apertures
+def _standard_aperture(name, params, scale):
+    p = [v*scale for v in params]
+    shape = []
+    if name == 'C' and len(p) >= 1:
+        shape.append(('circle', 0.0, 0.0, p[0], 1))
+        hole = p[1:]
+    elif name == 'R' and len(p) >= 2:
+        shape.append(('poly', _rect_points(-p[0]/2, -p[1]/2, p[0]/2, p[1]/2), 1))
+        hole = p[2:]
+    elif name == 'O' and len(p) >= 2:
+        shape.append(('poly', _obround_points(p[0], p[1]), 1))
+        hole = p[2:]
+    elif name == 'P' and len(p) >= 2:
+        vertices = int(round(params[1]))
+        rotation = params[2] if len(params) > 2 else 0.0
+        points = _circle_points(0, 0, p[0]/2, vertices)
+        shape.append(('poly', [_rotate(x, y, rotation) for (x, y) in points], 1))
+        hole = p[3:]
+    else:
+        raise Unsupported("Aperture "+name+" with parameters "+str(params))
+    if len(hole) == 1 and hole[0] > 0:
+        shape.append(('circle', 0.0, 0.0, hole[0], 0))
+    elif len(hole) >= 2:
+        raise Unsupported("Rectangular aperture holes")
+    return shape
+
+
+_expression_tokens = re.compile(r'\s*(?:(\d+\.?\d*|\.\d+)|\$(\d+)|([-+xX/()]))')
+
+
+# Evaluate an arithmetic expression of an aperture macro. Only numbers, the variables $n, + - x / and parentheses are
+# allowed, so nothing in a gerber file can run code or take long to evaluate.
+def _evaluate(expression, variables):
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        m = _expression_tokens.match(expression, position)
+        if not m:
+            raise Unsupported("Aperture macro expression "+expression)
+        if m.group(1) is not None:
+            tokens.append(('number', float(m.group(1))))
+        elif m.group(2) is not None:
+            tokens.append(('number', float(variables.get(int(m.group(2)), 0.0))))
+        else:
+            tokens.append((m.group(3).replace('X', 'x'), None))
+        position = m.end()
+    tokens.append(('end', None))
+    index = [0]
+
+    def take(*kinds):
+        if tokens[index[0]][0] in kinds:
+            index[0] += 1
+            return tokens[index[0] - 1]
+        return None
+
+    # expression: term (('+' | '-') term)*, term: factor (('x' | '/') factor)*,
+    # factor: ('+' | '-') factor | number | '(' expression ')'
+    def parse_expression():
+        value = parse_term()
+        while True:
+            token = take('+', '-')
+            if token is None:
+                return value
+            value = value + parse_term() if token[0] == '+' else value - parse_term()
+
+    def parse_term():
+        value = parse_factor()
+        while True:
+            token = take('x', '/')
+            if token is None:
+                return value
+            value = value*parse_factor() if token[0] == 'x' else value/parse_factor()
+
+    def parse_factor():
+        token = take('+', '-', 'number', '(')
+        if token is None:
+            raise Unsupported("Aperture macro expression "+expression)
+        if token[0] == '+':
+            return parse_factor()
+        if token[0] == '-':
+            return -parse_factor()
+        if token[0] == 'number':
+            return token[1]
+        value = parse_expression()
+        if take(')') is None:
+            raise Unsupported("Aperture macro expression "+expression)
+        return value
+
+    try:
+        value = parse_expression()
+    except (ZeroDivisionError, RecursionError):
+        raise Unsupported("Aperture macro expression "+expression)
+    if take('end') is None:
+        raise Unsupported("Aperture macro expression "+expression)
+    return value
+
+
+# Build the shape of an aperture defined by an aperture macro
+def _macro_aperture(macro, params, scale):
+    variables = {}
+    for index, value in enumerate(params):
+        variables[index + 1] = value
+    shape = []
+    for statement in macro:
+        if statement.startswith('$'):
+            name, expression = statement.split('=', 1)
+            variables[int(name[1:])] = _evaluate(expression, variables)
+            continue
+        fields = statement.split(',')
+        code = int(fields[0])
+        if code == 0:
+            continue  # Comment
+        v = [_evaluate(f, variables) for f in fields[1:]]
+        if code == 1:  # Circle
+            rotation = v[4] if len(v) > 4 else 0.0
+            cx, cy = _rotate(v[2]*scale, v[3]*scale, rotation)
+            shape.append(('circle', cx, cy, v[1]*scale, int(v[0])))
+        elif code == 20 or code == 2:  # Vector line
+            w = v[1]*scale
+            sx, sy, ex, ey = v[2]*scale, v[3]*scale, v[4]*scale, v[5]*scale
+            length = math.hypot(ex - sx, ey - sy)
+            if length == 0:
+                continue
+            nx, ny = -(ey - sy)/length*w/2, (ex - sx)/length*w/2
+            points = [(sx + nx, sy + ny), (ex + nx, ey + ny), (ex - nx, ey - ny), (sx - nx, sy - ny)]
+            shape.append(('poly', [_rotate(x, y, v[6]) for (x, y) in points], int(v[0])))
+        elif code == 21:  # Center line
+            w, h, cx, cy = v[1]*scale, v[2]*scale, v[3]*scale, v[4]*scale
+            points = _rect_points(cx - w/2, cy - h/2, cx + w/2, cy + h/2)
+            shape.append(('poly', [_rotate(x, y, v[5]) for (x, y) in points], int(v[0])))
+        elif code == 22:  # Lower left line
+            w, h, x0, y0 = v[1]*scale, v[2]*scale, v[3]*scale, v[4]*scale
+            points = _rect_points(x0, y0, x0 + w, y0 + h)
+            shape.append(('poly', [_rotate(x, y, v[5]) for (x, y) in points], int(v[0])))
+        elif code == 4:  # Outline
+            count = int(v[1])
+            points = [(v[2 + 2*i]*scale, v[3 + 2*i]*scale) for i in range(count + 1)]
+            rotation = v[4 + 2*count] if len(v) > 4 + 2*count else 0.0
+            shape.append(('poly', [_rotate(x, y, rotation) for (x, y) in points], int(v[0])))
+        elif code == 5:  # Polygon
+            count = int(v[1])
+            cx, cy, d = v[2]*scale, v[3]*scale, v[4]*scale
+            rotation = v[5] if len(v) > 5 else 0.0
+            points = _circle_points(cx, cy, d/2, count)
+            shape.append(('poly', [_rotate(x, y, rotation) for (x, y) in points], int(v[0])))
+        elif code == 7:  # Thermal
+            cx, cy, outer, inner, gap = v[0]*scale, v[1]*scale, v[2]*scale, v[3]*scale, v[4]*scale
+            rotation = v[5] if len(v) > 5 else 0.0
+            rx, ry = _rotate(cx, cy, rotation)
+            shape.append(('circle', rx, ry, outer, 1))
+            shape.append(('circle', rx, ry, inner, 0))
+            for points in (_rect_points(cx - outer, cy - gap/2, cx + outer, cy + gap/2),
+                           _rect_points(cx - gap/2, cy - outer, cx + gap/2, cy + outer)):
+                shape.append(('poly', [_rotate(x, y, rotation) for (x, y) in points], 0))
+        else:
+            raise Unsupported("Aperture macro primitive "+str(code))
+        if shape and shape[-1][-1] not in (0, 1):
+            raise Unsupported("Aperture macro exposure "+str(shape[-1][-1]))
+    return shape
+
+
+# Get the extents of a shape as (left, bottom, right, top)
+def shape_extents(shape):
+    xs = []
+    ys = []
+    for primitive in shape:
+        if primitive[-1] == 0:
+            continue
+        if primitive[0] == 'circle':
+            r = primitive[3]/2
+            xs.extend((primitive[1] - r, primitive[1] + r))
+            ys.extend((primitive[2] - r, primitive[2] + r))
+        else:
+            xs.extend(p[0] for p in primitive[1])
+            ys.extend(p[1] for p in primitive[1])
+    if not xs:
+        return (0.0, 0.0, 0.0, 0.0)
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+# -------------------------------------------------------------------------------------------------------------------
+# Arcs
+
+
+# Find the center and the sweep of an arc. i and j are the offsets to the center from the start point.
+def _arc(x1, y1, x2, y2, i, j, ccw, multi_quadrant):
+    def sweep_of(cx, cy):
+        a1 = math.atan2(y1 - cy, x1 - cx)
+        a2 = math.atan2(y2 - cy, x2 - cx)
+        if ccw:
+            sweep = (a2 - a1) % (2*math.pi)
+        else:
+            sweep = -((a1 - a2) % (2*math.pi))
+        return sweep
+
+    if multi_quadrant:
+        cx, cy = x1 + i, y1 + j
+        if abs(x1 - x2) < 1e-9 and abs(y1 - y2) < 1e-9:
+            return cx, cy, (2*math.pi if ccw else -2*math.pi)
+        return cx, cy, sweep_of(cx, cy)
+
+    best = None
+    for (si, sj) in ((1, 1), (1, -1), (-1, 1), (-1, -1)):
+        cx, cy = x1 + si*abs(i), y1 + sj*abs(j)
+        sweep = sweep_of(cx, cy)
+        if abs(sweep) > math.pi/2 + 1e-6:
+            continue
+        error = abs(math.hypot(x1 - cx, y1 - cy) - math.hypot(x2 - cx, y2 - cy))
+        if best is None or error < best[0]:
+            best = (error, cx, cy, sweep)
+    if best is None:
+        return x1 + i, y1 + j, 0.0
+    return best[1], best[2], best[3]
+
+
+# Get the points along an arc, not including the start point
+def arc_points(x1, y1, cx, cy, sweep, segment_length):
+    r = math.hypot(x1 - cx, y1 - cy)
+    start = math.atan2(y1 - cy, x1 - cx)
+    count = max(1, int(math.ceil(abs(sweep)*r/max(segment_length, 1e-9))))
+    count = min(count, 3600)
+    return [(cx + r*math.cos(start + sweep*k/count), cy + r*math.sin(start + sweep*k/count)) for k in range(1, count + 1)]
+
+
+# Get the points of a contour. Arcs are split in segments of at most segment_length.
+def contour_points(contour, segment_length):
+    points = [contour[0]]
+    for segment in contour[1:]:
+        if len(segment) == 2:
+            points.append(segment)
+        else:
+            (cx, cy, sweep, x, y) = segment
+            arc = arc_points(points[-1][0], points[-1][1], cx, cy, sweep, segment_length)
+            arc[-1] = (x, y)
+            points.extend(arc)
+    return points
+
+
+# -------------------------------------------------------------------------------------------------------------------
+# Gerber
+
+
+_gerber_blocks = re.compile(r'%([^%]*)%|([^%*]*)\*')
+_coordinate_words = re.compile(r'([XYIJ])([+-]?\d+)')
+_operation = re.compile(r'(?:X([+-]?\d+))?(?:Y([+-]?\d+))?(?:I([+-]?\d+))?(?:J([+-]?\d+))?(?:D(\d+))?$')
+_dcode = re.compile(r'D(\d+)$')
+
+
+def parse_gerber(data):
+    objects = []
+    apertures = {}
+    macros = {}
+    state = {
+        'format': None,   # (zero omission, integer digits, decimal digits) for X and Y
+        'scale': None,    # Factor to convert the units of the file to inches
+        'x': 0.0, 'y': 0.0,
+        'aperture': None,
+        'interpolation': 1,     # 1 linear, 2 clockwise arc, 3 counterclockwise arc
+        'multi_quadrant': False,
+        'dark': True,
+        'region': None,   # List of contours while in region mode
+        'dcode': None,    # Deprecated modal D-code
+    }
+
+    def unit_scale():
+        if state['scale'] is None:
+            # Gerber files without units are inches in GerbV
+            state['scale'] = 1.0
+        return state['scale']
+
+    def coordinate(text, axis):
+        fmt = state['format']
+        if fmt is None:
+            raise Unsupported("Coordinates before the format specification")
+        zeros, integer, decimal = fmt[axis]
+        if zeros == 'T':
+            negative = text.startswith('-')
+            value = int(text.lstrip('+-').ljust(integer + decimal, '0'))
+            if negative:
+                value = -value
+        else:
+            value = int(text)
+        return value*unit_scale()/10.0**decimal
+
+    def close_contour():
+        contour = state['region_contour']
+        if contour is not None and len(contour) > 1:
+            state['region'].append(contour)
+        state['region_contour'] = None
+
+    state['region_contour'] = None
+
+    for match in _gerber_blocks.finditer(data):
+        extended, block = match.group(1), match.group(2)
+        if extended is not None:
+            commands = [c.strip() for c in extended.split('*')]
+            commands = [c for c in commands if c]
+            if not commands:
+                continue
+            command = re.sub(r'\s+', '', commands[0])
+            code = command[:2]
+            if code == 'FS':
+                m = re.match(r'FS([LTD]?)([AI])(?:N\d+)?(?:G\d+)?X(\d)(\d)Y(\d)(\d)', command)
+                if not m:
+                    raise Unsupported("Format specification "+command)
+                if m.group(2) == 'I':
+                    raise Unsupported("Incremental coordinates")
+                zeros = m.group(1) or 'L'
+                state['format'] = {'X': (zeros, int(m.group(3)), int(m.group(4))),
+                                   'Y': (zeros, int(m.group(5)), int(m.group(6))),
+                                   'I': (zeros, int(m.group(3)), int(m.group(4))),
+                                   'J': (zeros, int(m.group(5)), int(m.group(6)))}
+            elif code == 'MO':
+                state['scale'] = 1/25.4 if command[2:4] == 'MM' else 1.0
+            elif code == 'AD':
+                m = re.match(r'ADD(\d+)([A-Za-z_.$][^,]*)(?:,(.*))?$', command)
+                if not m:
+                    raise Unsupported("Aperture definition "+command)
+                name = m.group(2)
+                params = [float(p) for p in m.group(3).split('X')] if m.group(3) else []
+                scale = unit_scale()
+                if name in ('C', 'R', 'O', 'P'):
+                    shape = _standard_aperture(name, params, scale)
+                elif name in macros:
+                    shape = _macro_aperture(macros[name], params, scale)
+                else:
+                    raise Unsupported("Undefined aperture macro "+name)
+                description = (name, tuple(round(p*scale, 7) for p in params))
+                if name == 'P':
+                    description = (name, (round(params[0]*scale, 7),) + tuple(params[1:]))
+                apertures[int(m.group(1))] = (description, shape)
+            elif code == 'AM':
+                # Comments (primitive 0) are removed before the whitespace
+                macros[command[2:].strip()] = [re.sub(r'\s+', '', c) for c in commands[1:] if not re.match(r'0(\s|$)', c)]
+            elif code == 'LP':
+                state['dark'] = command[2:3] != 'C'
+            elif code == 'SR':
+                m = re.match(r'SR(?:X(\d+))?(?:Y(\d+))?', command)
+                if m and (int(m.group(1) or 1) > 1 or int(m.group(2) or 1) > 1):
+                    raise Unsupported("Step and repeat")
+            elif code == 'IP':
+                if command.startswith('IPNEG'):
+                    raise Unsupported("Negative image polarity")
+            elif code in ('OF', 'IR', 'MI', 'SF', 'AS', 'LM', 'LR', 'LS'):
+                values = [float(v) for v in re.findall(r'[-+]?\d*\.?\d+', command[2:])]
+                neutral = {'SF': 1.0, 'LS': 1.0}.get(code, 0.0)
+                if command not in ('ASAXBY', 'LMN', 'MIA0B0') and any(v != neutral for v in values):
+                    raise Unsupported("Image transformation "+command)
+                if code == 'LM' and command != 'LMN':
+                    raise Unsupported("Mirroring "+command)
+            elif code == 'AB':
+                raise Unsupported("Aperture blocks")
+            # Everything else (attributes, image name, layer name, ...) doesn't affect the image
+            continue
+
+        block = block.strip()
+        if not block:
+            continue
+        if block[0] == 'G' and (block.startswith('G04') or block.startswith('G4')):
+            continue
+        if ' ' in block or '\n' in block or '\r' in block or '\t' in block:
+            block = re.sub(r'\s+', '', block)
+        if block[0] == 'M' and block.startswith(('M02', 'M00', 'M01')):
+            break
+
+        # G-codes
+        while block[:1] == 'G':
+            m = re.match(r'G(\d+)', block)
+            g = int(m.group(1))
+            block = block[m.end():]
+            if g in (1, 2, 3):
+                state['interpolation'] = g
+            elif g == 74:
+                state['multi_quadrant'] = False
+            elif g == 75:
+                state['multi_quadrant'] = True
+            elif g == 36:
+                state['region'] = []
+                state['region_contour'] = None
+            elif g == 37:
+                if state['region'] is not None:
+                    close_contour()
+                    for contour in state['region']:
+                        objects.append(('region', contour, state['dark']))
+                state['region'] = None
+            elif g == 70:
+                state['scale'] = 1.0
+            elif g == 71:
+                state['scale'] = 1/25.4
+            elif g == 90:
+                pass
+            elif g == 91:
+                raise Unsupported("Incremental coordinates")
+            elif g in (54, 55):
+                pass
+            elif g == 10 or g == 11 or g == 12:
+                raise Unsupported("Linear interpolation with scaling")
+        if not block:
+            continue
+
+        m = _operation.match(block)
+        if m:
+            # The usual block with coordinates and a D-code
+            words = {}
+            for axis, value in zip('XYIJ', m.groups()):
+                if value is not None:
+                    words[axis] = value
+            dcode = int(m.group(5)) if m.group(5) is not None else None
+        else:
+            words = dict(_coordinate_words.findall(block))
+            m = _dcode.search(block)
+            dcode = int(m.group(1)) if m else None
+        if dcode is None:
+            if not words:
+                continue
+            dcode = state['dcode']
+        if dcode is None:
+            continue
+
+        if dcode >= 10:
+            if dcode not in apertures:
+                raise Unsupported("Undefined aperture D"+str(dcode))
+            state['aperture'] = apertures[dcode]
+            continue
+
+        state['dcode'] = dcode
+        x1, y1 = state['x'], state['y']
+        x2 = coordinate(words['X'], 'X') if 'X' in words else x1
+        y2 = coordinate(words['Y'], 'Y') if 'Y' in words else y1
+        i = coordinate(words['I'], 'I') if 'I' in words else 0.0
+        j = coordinate(words['J'], 'J') if 'J' in words else 0.0
+        state['x'], state['y'] = x2, y2
+
+        if state['region'] is not None:
+            if dcode == 2:
+                close_contour()
+                state['region_contour'] = [(x2, y2)]
+            elif dcode == 1:
+                if state['region_contour'] is None:
+                    state['region_contour'] = [(x1, y1)]
+                if state['interpolation'] == 1:
+                    state['region_contour'].append((x2, y2))
+                else:
+                    cx, cy, sweep = _arc(x1, y1, x2, y2, i, j, state['interpolation'] == 3, state['multi_quadrant'])
+                    state['region_contour'].append((cx, cy, sweep, x2, y2))
+            else:
+                raise Unsupported("Flash in region")
+            continue
+
+        if dcode == 1:
+            aperture = state['aperture']
+            if aperture is None:
+                raise Unsupported("Draw without aperture")
+            if state['interpolation'] == 1:
+                objects.append(('draw', x1, y1, x2, y2, aperture, state['dark']))
+            else:
+                cx, cy, sweep = _arc(x1, y1, x2, y2, i, j, state['interpolation'] == 3, state['multi_quadrant'])
+                objects.append(('arc', x1, y1, x2, y2, cx, cy, sweep, aperture, state['dark']))
+        elif dcode == 3:
+            if state['aperture'] is None:
+                raise Unsupported("Flash without aperture")
+            objects.append(('flash', x2, y2, state['aperture'], state['dark']))
+        elif dcode != 2:
+            raise Unsupported("D-code D"+str(dcode))
+    return objects
+
+
+# -------------------------------------------------------------------------------------------------------------------
+# Excellon
+
+
+# A drill hit with both coordinates and nothing else, which is most of the lines of a drill file
+_plain_hit = re.compile(r'^X([+-]?[\d.]+)Y([+-]?[\d.]+)$')
+
+
+def parse_excellon(data):
+    objects = []
+    tools = {}
+    scale = 1.0
+    zeros = 'TZ'
+    digits = (2, 4)
+    tool = None
+    hit_aperture = None
+    x = y = 0.0
+    route_mode = False
+    tool_down = False
+    header = True
+
+    def number(text):
+        if '.' in text:
+            return float(text)*scale
+        negative = text.startswith('-')
+        text = text.lstrip('+-')
+        if zeros == 'LZ':
+            text = text.ljust(digits[0] + digits[1], '0')
+        value = int(text)/10.0**digits[1]
+        return (-value if negative else value)*scale
+
+    def aperture(diameter):
+        return (('C', (round(diameter, 7),)), [('circle', 0.0, 0.0, diameter, 1)])
+
+    for line in data.splitlines():
+        line = line.split(';')[0].strip().upper()
+        if not line:
+            continue
+        if not route_mode and tool in tools:
+            m = _plain_hit.match(line)
+            if m:
+                x = number(m.group(1))
+                y = number(m.group(2))
+                objects.append(('flash', x, y, hit_aperture, True))
+                continue
+        if line.startswith(('METRIC', 'INCH')) or line in ('M71', 'M72'):
+            if line.startswith('METRIC') or line == 'M71':
+                scale = 1/25.4
+                digits = (3, 3)
+            else:
+                scale = 1.0
+                digits = (2, 4)
+            fields = line.split(',')
+            for field in fields[1:]:
+                if field in ('LZ', 'TZ'):
+                    zeros = field
+                elif re.match(r'^0*\.0*$', field):
+                    integer, decimal = field.split('.')
+                    digits = (len(integer), len(decimal))
+            continue
+        if line.startswith('ICI') and 'ON' in line:
+            raise Unsupported("Incremental coordinates")
+        if line in ('%', 'M95'):
+            header = False
+            continue
+        if line.startswith(('M48', 'FMAT', 'VER', 'DETECT', 'ATC', 'BLKD', 'SBK', 'TCST', 'R,', 'AFS', 'G90', 'M30', 'M00')):
+            continue
+        m = re.match(r'^T(\d+)(.*)$', line)
+        if m:
+            number_of_tool = int(m.group(1))
+            diameter = re.search(r'C([\d.]+)', m.group(2))
+            if diameter:
+                tools[number_of_tool] = float(diameter.group(1))*scale
+            if not header:
+                tool = number_of_tool if number_of_tool != 0 else None
+                if tool in tools:
+                    hit_aperture = aperture(tools[tool])
+            continue
+        if line == 'G05' or line == 'G81':
+            route_mode = False
+            continue
+        if line == 'M15':
+            tool_down = True
+            continue
+        if line in ('M16', 'M17'):
+            tool_down = False
+            continue
+        if line.startswith(('G02', 'G03')):
+            raise Unsupported("Routed arcs")
+
+        g = re.match(r'^G(\d+)', line)
+        if g and int(g.group(1)) in (0, 1):
+            route_mode = True
+            if int(g.group(1)) == 0:
+                tool_down = False
+            line = line[g.end():]
+        elif g and int(g.group(1)) != 85:
+            if int(g.group(1)) in (90, 5, 81):
+                continue
+            raise Unsupported("Excellon command "+line)
+
+        slot = line.split('G85')
+        m = re.match(r'^(?:X([+-]?[\d.]+))?(?:Y([+-]?[\d.]+))?$', slot[0])
+        if not m or not (m.group(1) or m.group(2)):
+            continue
+        if tool is None or tool not in tools:
+            raise Unsupported("Drill hit without a tool")
+        x1, y1 = x, y
+        x = number(m.group(1)) if m.group(1) else x
+        y = number(m.group(2)) if m.group(2) else y
+        if len(slot) > 1:
+            m2 = re.match(r'^(?:X([+-]?[\d.]+))?(?:Y([+-]?[\d.]+))?$', slot[1])
+            sx, sy = x, y
+            x = number(m2.group(1)) if m2.group(1) else x
+            y = number(m2.group(2)) if m2.group(2) else y
+            objects.append(('draw', sx, sy, x, y, aperture(tools[tool]), True))
+        elif route_mode:
+            if tool_down:
+                objects.append(('draw', x1, y1, x, y, aperture(tools[tool]), True))
+        else:
+            objects.append(('flash', x, y, aperture(tools[tool]), True))
+    return objects
+
+
+# -------------------------------------------------------------------------------------------------------------------
+# Rendering
+
+
+# Get the extents of an object as (left, bottom, right, top)
+def object_extents(obj):
+    kind = obj[0]
+    if kind == 'flash':
+        (l, b, r, t) = shape_extents(obj[3][1])
+        return (obj[1] + l, obj[2] + b, obj[1] + r, obj[2] + t)
+    if kind == 'draw':
+        (l, b, r, t) = shape_extents(obj[5][1])
+        return (min(obj[1], obj[3]) + l, min(obj[2], obj[4]) + b, max(obj[1], obj[3]) + r, max(obj[2], obj[4]) + t)
+    if kind == 'arc':
+        (l, b, r, t) = shape_extents(obj[8][1])
+        points = [(obj[1], obj[2])] + arc_points(obj[1], obj[2], obj[5], obj[6], obj[7], 0.001)
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        return (min(xs) + l, min(ys) + b, max(xs) + r, max(ys) + t)
+    points = contour_points(obj[1], 0.001)
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+# Get the extents of a number of parsed files
+def extents(files):
+    bbox = None
+    for objects in files:
+        for obj in objects:
+            e = object_extents(obj)
+            if bbox is None:
+                bbox = list(e)
+            else:
+                bbox = [min(bbox[0], e[0]), min(bbox[1], e[1]), max(bbox[2], e[2]), max(bbox[3], e[3])]
+    return bbox
+
+
+# Find the extents (left, bottom, right, top) of the coordinates in a Gerber or Excellon file without parsing it, which
+# is much faster. The size of the apertures and the bulge of the arcs are left out, so the extents may be a bit smaller
+# than the extents of the parsed file (see extents()). Returns None if the file doesn't have any coordinates, or if it
+# isn't a Gerber or Excellon file.
+def scan_extents(filepath):
+    with open(filepath, 'rb') as f:
+        data = f.read().decode('latin-1')
+
+    def values(texts, zeros, digits, decimal, scale):
+        if not texts:
+            return None
+        if zeros == 'T':
+            numbers = [(-1 if text.startswith('-') else 1)*int(text.lstrip('+-').ljust(digits, '0')) for text in texts]
+        elif decimal is None:
+            numbers = [float(text) for text in texts]
+        else:
+            numbers = [int(text) for text in texts]
+        factor = scale if decimal is None else scale/10.0**decimal
+        return min(numbers)*factor, max(numbers)*factor
+
+    if '%FS' in data:
+        m = re.search(r'%FS([LTD]?)[AI](?:N\d+)?(?:G\d+)?X(\d)(\d)Y(\d)(\d)', data)
+        if not m:
+            return None
+        scale = 1/25.4 if re.search(r'%\s*MOMM|G71\*', data) else 1.0
+        zeros = m.group(1) or 'L'
+        # Leave out the extended commands, like the aperture definitions, and the comments
+        body = re.sub(r'%[^%]*%|G0?4[^*]*\*', '', data)
+        xs = values(re.findall(r'X([+-]?\d+)', body), zeros, int(m.group(2)) + int(m.group(3)), int(m.group(3)), scale)
+        ys = values(re.findall(r'Y([+-]?\d+)', body), zeros, int(m.group(4)) + int(m.group(5)), int(m.group(5)), scale)
+    elif re.search(r'^\s*(M48|T\d+\S*C[\d.]+)', data, re.M):
+        (scale, digits, zeros) = (1.0, (2, 4), 'TZ')
+        m = re.search(r'^\s*(METRIC|INCH|M71|M72)(.*)$', data, re.M)
+        if m:
+            if m.group(1) in ('METRIC', 'M71'):
+                (scale, digits) = (1/25.4, (3, 3))
+            for field in m.group(2).split(','):
+                field = field.strip()
+                if field in ('LZ', 'TZ'):
+                    zeros = field
+                elif re.match(r'^0*\.0*$', field):
+                    digits = tuple(len(part) for part in field.split('.'))
+        body = re.sub(r';[^\r\n]*', '', data)
+        texts = re.findall(r'X([+-]?[\d.]+)', body), re.findall(r'Y([+-]?[\d.]+)', body)
+        decimal = None if any('.' in text for text in texts[0][:1] + texts[1][:1]) else digits[1]
+        # Leading zeros are kept with LZ, so the trailing zeros are left out
+        zeros = 'T' if zeros == 'LZ' and decimal is not None else 'L'
+        xs = values(texts[0], zeros, sum(digits), decimal, scale)
+        ys = values(texts[1], zeros, sum(digits), decimal, scale)
+    else:
+        return None
+    if xs is None or ys is None:
+        return None
+    return (xs[0], ys[0], xs[1], ys[1])
+
+
+# Get the frame of an image in the same way as GerbV does when exporting to png without an origin or a window:
+# the bounding box of all files plus a border of 5%.
+# The frame is (left, bottom, width in pixels, height in pixels).
+def image_frame(files, dpi):
+    bbox = extents(files)
+    if bbox is None:
+        raise Unsupported("Nothing to render")
+    return bbox_frame(bbox, dpi)
+
+
+# Get the frame of an image (see image_frame()) from the bounding box (left, bottom, right, top) of the files
+def bbox_frame(bbox, dpi):
+    width = bbox[2] - bbox[0] + 0.001
+    height = bbox[3] - bbox[1] + 0.001
+    border = 0.05
+    left = bbox[0] - width*border/2
+    bottom = bbox[1] - height*border/2
+    width = width + width*border
+    height = height + height*border
+    return (left, bottom, int(width*dpi), int(height*dpi))
+
+
+# Render the objects of a file to a coverage mask (0-255) in the given frame
+def render_mask(objects, frame, dpi):
+    import numpy as np
+    import cv2  # opencv-python
+
+    (left, bottom, width, height) = frame
+    top = bottom + height/dpi
+    mask = np.zeros((height, width), dtype=np.uint8)
+    one = 1 << SHIFT
+    factor = dpi*one
+    segment_length = 2.0/dpi
+
+    # Convert points in inches to fixed point pixel coordinates in an image with its upper left corner at pixel
+    # (x0, y0). OpenCV has the center of the pixels on whole coordinates, so half a pixel is subtracted.
+    def to_pixel(x, y, x0=0, y0=0):
+        return (int(round((x - left)*factor - (x0 + 0.5)*one)), int(round((top - y)*factor - (y0 + 0.5)*one)))
+
+    def points_to_pixels(points, dx=0.0, dy=0.0, x0=0, y0=0):
+        if len(points) < 32:
+            return np.array([to_pixel(x + dx, y + dy, x0, y0) for (x, y) in points], dtype=np.int32)
+        p = np.asarray(points, dtype=np.float64)
+        pixels = np.empty(p.shape, dtype=np.int32)
+        pixels[:, 0] = np.rint((p[:, 0] + dx - left)*factor - (x0 + 0.5)*one)
+        pixels[:, 1] = np.rint((top - p[:, 1] - dy)*factor - (y0 + 0.5)*one)
+        return pixels
+
+    def draw_circle(image, cx, cy, diameter, value, x0=0, y0=0):
+        radius = max(int(round(diameter/2*factor)), one // 2)  # Make sure very small circles are visible
+        cv2.circle(image, to_pixel(cx, cy, x0, y0), radius, value, -1, cv2.LINE_AA, SHIFT)
+
+    def draw_polygon(image, pixels, value):
+        cv2.fillPoly(image, [pixels], value, cv2.LINE_AA, SHIFT)
+
+    def draw_shape(image, shape, x, y, value, x0=0, y0=0):
+        for primitive in shape:
+            v = value if primitive[-1] == 1 else 255 - value
+            if primitive[0] == 'circle':
+                draw_circle(image, x + primitive[1], y + primitive[2], primitive[3], v, x0, y0)
+            else:
+                draw_polygon(image, points_to_pixels(primitive[1], x, y, x0, y0), v)
+
+    def draw_flash(shape, x, y, dark):
+        if all(primitive[-1] == 1 for primitive in shape):
+            draw_shape(mask, shape, x, y, 255 if dark else 0)
+            return
+        # Shapes with holes or clear primitives are drawn on a separate patch, so the holes don't erase what's
+        # already drawn under the flash.
+        (l, b, r, t) = shape_extents(shape)
+        x0 = max(int(math.floor((x + l - left)*dpi)) - 2, 0)
+        x1 = min(int(math.ceil((x + r - left)*dpi)) + 2, width)
+        y0 = max(int(math.floor((top - y - t)*dpi)) - 2, 0)
+        y1 = min(int(math.ceil((top - y - b)*dpi)) + 2, height)
+        if x1 <= x0 or y1 <= y0:
+            return
+        patch = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        draw_shape(patch, shape, x, y, 255, x0, y0)
+        roi = mask[y0:y1, x0:x1]
+        if dark:
+            np.maximum(roi, patch, out=roi)
+        else:
+            np.minimum(roi, 255 - patch, out=roi)
+
+    def draw_line(points, aperture, value):
+        shape = aperture[1]
+        if len(shape) == 1 and shape[0][0] == 'circle' and shape[0][1] == 0 and shape[0][2] == 0:
+            d = shape[0][3]
+            if d*dpi < 1.0:
+                # Hairline
+                cv2.polylines(mask, [points_to_pixels(points)], False, value, 1, cv2.LINE_AA, SHIFT)
+                return
+            for k in range(1, len(points)):
+                (xa, ya), (xb, yb) = points[k - 1], points[k]
+                length = math.hypot(xb - xa, yb - ya)
+                if length > 0:
+                    nx, ny = -(yb - ya)/length*d/2, (xb - xa)/length*d/2
+                    draw_polygon(mask, points_to_pixels([(xa + nx, ya + ny), (xb + nx, yb + ny),
+                                                         (xb - nx, yb - ny), (xa - nx, ya - ny)]), value)
+                draw_circle(mask, xa, ya, d, value)
+            draw_circle(mask, points[-1][0], points[-1][1], d, value)
+        elif len(shape) == 1 and shape[0][0] == 'poly' and shape[0][2] == 1 and len(points) == 2:
+            # Draw with a rectangular aperture: the convex hull of the aperture at the start and end points
+            corners = [(x + px, y + py) for (x, y) in points for (px, py) in shape[0][1]]
+            hull = cv2.convexHull(points_to_pixels(corners))
+            cv2.fillConvexPoly(mask, hull, value, cv2.LINE_AA, SHIFT)
+        else:
+            raise Unsupported("Draw with aperture "+str(aperture[0]))
+
+    for obj in objects:
+        kind = obj[0]
+        dark = obj[-1]
+        value = 255 if dark else 0
+        if kind == 'flash':
+            draw_flash(obj[3][1], obj[1], obj[2], dark)
+        elif kind == 'draw':
+            draw_line([(obj[1], obj[2]), (obj[3], obj[4])], obj[5], value)
+        elif kind == 'arc':
+            points = [(obj[1], obj[2])] + arc_points(obj[1], obj[2], obj[5], obj[6], obj[7], segment_length*4)
+            points[-1] = (obj[3], obj[4])
+            if obj[8][1][0][0] != 'circle':
+                raise Unsupported("Arc with aperture "+str(obj[8][0]))
+            draw_line(points, obj[8], value)
+        elif kind == 'region':
+            draw_polygon(mask, points_to_pixels(contour_points(obj[1], segment_length)), value)
+    return mask
+
+
+# Convert a color like "#RRGGBB" or "#RRGGBBAA" to (r, g, b, alpha). GerbV uses the alpha 177 when no alpha is given.
+def parse_color(color):
+    color = color.lstrip('#')
+    r, g, b = int(color[0:2], 16), int(color[2:4], 16), int(color[4:6], 16)
+    alpha = int(color[6:8], 16) if len(color) >= 8 else 177
+    return (r, g, b, alpha)
+
+
+# Composite coverage masks to a BGR image. The first mask is drawn on top, like the first layer in GerbV.
+def composite(masks, colors, bg_color, rows_per_strip=1024):
+    import numpy as np
+
+    height, width = masks[0].shape
+    (r, g, b, a) = parse_color(bg_color)
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    layers = list(zip(masks, [parse_color(c) for c in colors]))
+    layers.reverse()
+    for y0 in range(0, height, rows_per_strip):
+        y1 = min(y0 + rows_per_strip, height)
+        strip = np.empty((y1 - y0, width, 3), dtype=np.float32)
+        strip[:, :] = (b, g, r)
+        for mask, (lr, lg, lb, la) in layers:
+            coverage = mask[y0:y1].astype(np.float32)*(la/(255.0*255.0))
+            for channel, value in enumerate((lb, lg, lr)):
+                strip[:, :, channel] += (value - strip[:, :, channel])*coverage
+        image[y0:y1] = np.rint(strip)
+    return image
+
+
+# Render a number of files to a BGR image in the same way as GerbV exports them to png. Returns the image and the
+# frame that was used.
+def render_image(files, colors, bg_color, dpi, frame=None):
+    if frame is None:
+        frame = image_frame(files, dpi)
+    if frame[2] <= 0 or frame[3] <= 0:
+        raise Unsupported("Empty image")
+    masks = [render_mask(objects, frame, dpi) for objects in files]
+    return composite(masks, colors, bg_color), frame
+
+
+# -------------------------------------------------------------------------------------------------------------------
+# Fingerprints
+
+
+# Size of the chunks that a file is read in when it's fingerprinted
+_fingerprint_chunk_size = 1024*1024
+
+# Extended commands of Gerber files that don't change the image: the attributes, which have things like the creation
+# date and the version of the CAD tool, the image name and the layer name
+_volatile_commands = ('TF', 'TA', 'TO', 'TD', 'IN', 'LN')
+
+# Coordinates are converted to whole units of 0.1 nm in the fingerprints. This is the number of them in a mm and in an
+# inch.
+_fingerprint_units = {'MM': 10**7, 'IN': 254*10**6}
+
+
+# Split the chunks of a Gerber file into blocks, like _gerber_blocks. Only the complete blocks of the data that has been
+# read are split, so a block or an extended command can be split between chunks.
+def _stream_gerber_blocks(chunks):
+    rest = ''
+    for chunk in chunks:
+        data = rest + chunk
+        end = len(data)
+        # An extended command isn't complete until its closing % has been read
+        if data.count('%') % 2:
+            end = data.rfind('%')
+        end = max(data.rfind('*', 0, end), data.rfind('%', 0, end)) + 1
+        for match in _gerber_blocks.finditer(data, 0, end):
+            yield match.group(1), match.group(2)
+        rest = data[end:]
+    for match in _gerber_blocks.finditer(rest):
+        yield match.group(1), match.group(2)
+
+
+# Blocks with an operation (D01, D02 or D03) and the blocks that select an aperture, which are most of the blocks of a
+# Gerber file. They are handled without the general parsing of a block when the file is fingerprinted.
+_plain_operation = re.compile(r'\s*(?:G0?([123]))?(?:X([+-]?\d+))?(?:Y([+-]?\d+))?(?:I([+-]?\d+))?(?:J([+-]?\d+))?'
+                              r'D0*([123])\s*$')
+_plain_aperture = re.compile(r'\s*(?:G54)?D(\d\d+)\s*$')
+
+
+# Write the canonical form of a Gerber file to 'emit', one command at a time: the commands that change the image, with
+# the comments and attributes left out. The coordinates are written in whole units of 0.1 nm, and every coordinate
+# and mode is written out even if it's the same as before. The apertures are written by their definition instead of
+# their number, when they are used.
+def _canonical_gerber(blocks, emit):
+    state = {'format': None, 'unit': 'IN', 'x': 0, 'y': 0, 'interpolation': 1, 'multi_quadrant': False,
+             'dcode': None, 'aperture': None, 'emitted': None, 'region': False}
+    apertures = {}
+    macros = {}
+    # The zero omission, the number of digits, and the factor and divisor that convert the coordinates of every axis
+    factors = {}
+
+    def set_factors():
+        unit = _fingerprint_units[state['unit']]
+        for axis, (zeros, integer, decimal) in (state['format'] or {}).items():
+            if unit % 10**decimal == 0:
+                factors[axis] = (zeros, integer + decimal, unit//10**decimal, 1)
+            else:
+                factors[axis] = (zeros, integer + decimal, unit, 10**decimal)
+
+    def coordinate(text, axis):
+        if not factors:
+            raise Unsupported("Coordinates before the format specification")
+        zeros, digits, factor, divisor = factors[axis]
+        if zeros == 'T':
+            negative = text.startswith('-')
+            text = text.lstrip('+-').ljust(digits, '0')
+            if negative:
+                text = '-' + text
+        if divisor == 1:
+            return int(text)*factor
+        value = int(text)*factor
+        return (2*value + divisor)//(2*divisor)
+
+    def length(text):
+        return str(int(round(float(text)*_fingerprint_units[state['unit']])))
+
+    def aperture(name, params):
+        # The sizes of the standard apertures are converted like the coordinates. The parameters of aperture macros
+        # can be anything, so they are only written in the same format.
+        sizes = {'C': (0, 1), 'R': (0, 1, 2), 'O': (0, 1, 2), 'P': (0, 3)}
+        if name in sizes:
+            return name + "," + "X".join(length(p) if i in sizes[name] else format(float(p), '.10g')
+                                         for i, p in enumerate(params))
+        return ("AM" + macros.get(name, name) + "," + state['unit'] + "," +
+                "X".join(format(float(p), '.10g') for p in params))
+
+    def operation(x, y, i, j, dcode):
+        if dcode >= 10:
+            state['aperture'] = apertures.get(dcode, "D" + str(dcode))
+            return
+        state['dcode'] = dcode
+        if x is not None:
+            state['x'] = coordinate(x, 'X')
+        if y is not None:
+            state['y'] = coordinate(y, 'Y')
+        if dcode != 2 and not state['region'] and state['aperture'] != state['emitted']:
+            emit("aperture " + str(state['aperture']))
+            state['emitted'] = state['aperture']
+        if dcode == 1 and state['interpolation'] != 1:
+            emit("D1G%dX%dY%dI%dJ%d%s" % (state['interpolation'], state['x'], state['y'],
+                                          coordinate(i, 'I') if i is not None else 0,
+                                          coordinate(j, 'J') if j is not None else 0,
+                                          "G75" if state['multi_quadrant'] else "G74"))
+        else:
+            emit("D%dX%dY%d" % (dcode, state['x'], state['y']))
+
+    for extended, block in blocks:
+        if extended is None:
+            m = _plain_operation.match(block)
+            if m:
+                if m.group(1):
+                    state['interpolation'] = int(m.group(1))
+                operation(m.group(2), m.group(3), m.group(4), m.group(5), int(m.group(6)))
+                continue
+            m = _plain_aperture.match(block)
+            if m:
+                operation(None, None, None, None, int(m.group(1)))
+                continue
+        else:
+            commands = [re.sub(r'\s+', '', c) for c in extended.split('*')]
+            commands = [c for c in commands if c]
+            if not commands:
+                continue
+            if commands[0][:2] == 'AM':
+                # Comments (primitive 0, like "0 Thermal relief", without the spaces) are removed
+                macros[commands[0][2:]] = "*".join(c for c in commands[1:] if not re.match(r'0(?![\d.])', c))
+                continue
+            for command in commands:
+                code = command[:2]
+                if code == 'FS':
+                    m = re.match(r'FS([LTD]?)([AI])(?:N\d+)?(?:G\d+)?X(\d)(\d)Y(\d)(\d)', command)
+                    if not m:
+                        raise Unsupported("Format specification "+command)
+                    zeros = m.group(1) or 'L'
+                    state['format'] = {'X': (zeros, int(m.group(3)), int(m.group(4))),
+                                       'Y': (zeros, int(m.group(5)), int(m.group(6))),
+                                       'I': (zeros, int(m.group(3)), int(m.group(4))),
+                                       'J': (zeros, int(m.group(5)), int(m.group(6)))}
+                    set_factors()
+                    if m.group(2) == 'I':
+                        emit("incremental")
+                elif code == 'MO':
+                    state['unit'] = 'MM' if command[2:4] == 'MM' else 'IN'
+                    set_factors()
+                elif code == 'AD':
+                    m = re.match(r'ADD(\d+)([A-Za-z_.$][^,]*)(?:,(.*))?$', command)
+                    if not m:
+                        raise Unsupported("Aperture definition "+command)
+                    apertures[int(m.group(1))] = aperture(m.group(2), m.group(3).split('X') if m.group(3) else [])
+                elif code not in _volatile_commands:
+                    emit("%" + command)
+            continue
+
+        block = block.strip()
+        if not block or block.startswith(('G04', 'G4')):
+            continue
+        block = re.sub(r'\s+', '', block)
+        if block.startswith(('M02', 'M00', 'M01', 'M2', 'M0', 'M1')):
+            break
+
+        while block[:1] == 'G':
+            m = re.match(r'G(\d+)', block)
+            if not m:
+                break
+            g = int(m.group(1))
+            block = block[m.end():]
+            if g in (1, 2, 3):
+                state['interpolation'] = g
+            elif g in (74, 75):
+                state['multi_quadrant'] = g == 75
+            elif g in (70, 71):
+                state['unit'] = 'IN' if g == 70 else 'MM'
+                set_factors()
+            elif g in (36, 37):
+                state['region'] = g == 36
+                emit("G" + str(g))
+            elif g not in (54, 55, 90):
+                emit("G" + str(g))
+        if not block:
+            continue
+
+        m = _operation.match(block)
+        if m:
+            words = {axis: value for axis, value in zip('XYIJ', m.groups()) if value is not None}
+            dcode = int(m.group(5)) if m.group(5) is not None else None
+        else:
+            words = dict(_coordinate_words.findall(block))
+            m = _dcode.search(block)
+            dcode = int(m.group(1)) if m else None
+            if not words and dcode is None:
+                emit(block)
+                continue
+        if dcode is None:
+            if not words or state['dcode'] is None:
+                continue
+            dcode = state['dcode']
+        operation(words.get('X'), words.get('Y'), words.get('I'), words.get('J'), dcode)
+
+
+# Write the canonical form of an Excellon file to 'emit', one command at a time, like _canonical_gerber(). The tools
+# are written by their diameter when they are used, instead of their number.
+def _canonical_excellon(lines, emit):
+    state = {'unit': 'IN', 'zeros': 'TZ', 'digits': (2, 4), 'x': 0, 'y': 0, 'tool': None, 'emitted': None}
+    tools = {}
+    header = True
+
+    def number(text):
+        unit = _fingerprint_units[state['unit']]
+        if '.' in text:
+            return int(round(float(text)*unit))
+        negative = text.startswith('-')
+        text = text.lstrip('+-')
+        integer, decimal = state['digits']
+        if state['zeros'] == 'LZ':
+            text = text.ljust(integer + decimal, '0')
+        value = (int(text)*unit*2 + 10**decimal)//(2*10**decimal)
+        return -value if negative else value
+
+    def position(text):
+        m = re.match(r'^(?:X([+-]?[\d.]+))?(?:Y([+-]?[\d.]+))?$', text)
+        if m.group(1):
+            state['x'] = number(m.group(1))
+        if m.group(2):
+            state['y'] = number(m.group(2))
+        return "X" + str(state['x']) + "Y" + str(state['y'])
+
+    for line in lines:
+        line = line.split(';')[0].strip().upper()
+        if not line:
+            continue
+        if line.startswith(('METRIC', 'INCH')) or line in ('M71', 'M72'):
+            metric = line.startswith('METRIC') or line == 'M71'
+            state['unit'] = 'MM' if metric else 'IN'
+            state['digits'] = (3, 3) if metric else (2, 4)
+            for field in line.split(',')[1:]:
+                if field in ('LZ', 'TZ'):
+                    state['zeros'] = field
+                elif re.match(r'^0*\.0*$', field):
+                    integer, decimal = field.split('.')
+                    state['digits'] = (len(integer), len(decimal))
+            continue
+        if line in ('%', 'M95'):
+            header = False
+            continue
+        if line.startswith(('M48', 'FMAT', 'VER', 'DETECT', 'ATC', 'BLKD', 'SBK', 'TCST', 'R,', 'AFS', 'G90', 'M00')):
+            continue
+        if line == 'M30':
+            break
+        m = re.match(r'^T(\d+)(.*)$', line)
+        if m:
+            diameter = re.search(r'C([\d.]+)', m.group(2))
+            if diameter:
+                tools[int(m.group(1))] = "C" + str(int(round(float(diameter.group(1)) *
+                                                             _fingerprint_units[state['unit']])))
+            if not header:
+                state['tool'] = tools.get(int(m.group(1)), "T" + m.group(1))
+            continue
+        if re.match(r'^(?:X[+-]?[\d.]+)?(?:Y[+-]?[\d.]+)?(?:G85(?:X[+-]?[\d.]+)?(?:Y[+-]?[\d.]+)?)?$', line):
+            if state['tool'] != state['emitted']:
+                emit("tool " + str(state['tool']))
+                state['emitted'] = state['tool']
+            emit(" G85 ".join(position(part) for part in line.split('G85')))
+            continue
+        g = re.match(r'^G0?([01])((?:[XY][+-]?[\d.]+)*)$', line)
+        if g:
+            emit("G" + g.group(1) + (position(g.group(2)) if g.group(2) else ""))
+            continue
+        emit(line)
+
+
+# Get a fingerprint of the contents of a Gerber or Excellon file, which only changes when something that changes the
+# image of the file changes. Comments, attributes (like %TF.CreationDate), the numbering of the apertures and tools,
+# the format of the coordinates and the units are left out, so files that are exported again by the CAD tool, or by
+# another version of it, have the same fingerprint if nothing on the board has changed.
+# The file is read in chunks, so it's never in memory all at once. Files in other formats are fingerprinted by their
+# bytes. Returns the fingerprint as a hex string.
+def fingerprint_file(filepath):
+    import hashlib
+
+    sha = hashlib.sha256()
+    # The commands are hashed in batches, since there are many short ones
+    pending = []
+
+    def emit(command):
+        pending.append(command)
+        if len(pending) >= 4096:
+            flush()
+
+    def flush():
+        sha.update(("\n".join(pending) + "\n").encode('latin-1'))
+        del pending[:]
+
+    with open(filepath, 'rb') as f:
+        def chunks(first):
+            yield first
+            for chunk in iter(lambda: f.read(_fingerprint_chunk_size), b''):
+                yield chunk.decode('latin-1')
+
+        def lines(first):
+            rest = ''
+            for chunk in chunks(first):
+                data = rest + chunk
+                end = max(data.rfind('\n'), data.rfind('\r')) + 1
+                yield from data[:end].splitlines()
+                rest = data[end:]
+            yield from rest.splitlines()
+
+        first = f.read(_fingerprint_chunk_size).decode('latin-1')
+        try:
+            if '%FS' in first:
+                emit("gerber")
+                _canonical_gerber(_stream_gerber_blocks(chunks(first)), emit)
+                flush()
+                return sha.hexdigest()
+            if re.search(r'^\s*(M48|T\d+\S*C[\d.]+)', first, re.M):
+                emit("excellon")
+                _canonical_excellon(lines(first), emit)
+                flush()
+                return sha.hexdigest()
+        except (ValueError, IndexError, KeyError, AttributeError, Unsupported) as e:
+            print("Unable to make the canonical form of", filepath, "(", e, "). Using its bytes instead.")
+        f.seek(0)
+        sha = hashlib.sha256(b"bytes\n")
+        for chunk in iter(lambda: f.read(_fingerprint_chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
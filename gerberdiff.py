@@ -0,0 +1,231 @@
+import math
+from collections import Counter
+
+import gerber
+
+# Comparison of two parsed gerber files (see gerber.py) without rendering them.
+# Objects that are exactly the same in both files are removed first. The remaining objects are matched by position
+# with a grid of cells, so objects that have moved a short distance or changed aperture are reported as modified
+# instead of as one removed and one added object.
+
+# Default distance in mm within which a changed object is reported as modified rather than removed and added
+default_match_distance = 0.5
+
+# Resolution (in inches) used when comparing coordinates
+_resolution = 1e-6
+
+
+def _point(x, y):
+    return (round(x/_resolution), round(y/_resolution))
+
+
+# Get the polarity layer of every object, which is the number of times the polarity has changed before the object.
+# The order of the objects within a polarity layer doesn't change the image, but a clear object only erases the dark
+# objects of the layers before it.
+def polarity_layers(objects):
+    layers = []
+    layer = 0
+    for index, obj in enumerate(objects):
+        if index > 0 and obj[-1] != objects[index - 1][-1]:
+            layer = layer + 1
+        layers.append(layer)
+    return layers
+
+
+# Get a key for an object, which is the same for objects that render the same.
+# The apertures are replaced by a number from 'apertures', so the keys are quick to compare. 'layer' is the polarity
+# layer of the object (see polarity_layers()), so that an object that is drawn before instead of after an object of the
+# other polarity doesn't have the same key.
+def object_key(obj, apertures, layer=0):
+    kind = obj[0]
+    if kind == 'flash':
+        return ('flash', round(obj[1]/_resolution), round(obj[2]/_resolution),
+                apertures.setdefault(obj[3][0], len(apertures)), obj[-1], layer)
+    if kind == 'draw':
+        ends = sorted((_point(obj[1], obj[2]), _point(obj[3], obj[4])))
+        return ('draw', ends[0], ends[1], apertures.setdefault(obj[5][0], len(apertures)), obj[-1], layer)
+    if kind == 'arc':
+        start, end = _point(obj[1], obj[2]), _point(obj[3], obj[4])
+        sweep = round(obj[7]/_resolution)
+        if end < start:
+            start, end, sweep = end, start, -sweep
+        return ('arc', start, end, _point(obj[5], obj[6]), sweep, apertures.setdefault(obj[8][0], len(apertures)),
+                obj[-1], layer)
+    # Regions are compared by their points, regardless of where the contour starts and its direction
+    points = [_point(x, y) for (x, y) in gerber.contour_points(obj[1], 0.001)]
+    if len(points) > 1 and points[0] == points[-1]:
+        points.pop()
+    first = points.index(min(points))
+    forward = points[first:] + points[:first]
+    backward = [forward[0]] + forward[:0:-1]
+    return ('region', tuple(min(forward, backward)), obj[-1], layer)
+
+
+# Get the position used to match an object with objects in the other file
+def object_position(obj):
+    kind = obj[0]
+    if kind == 'flash':
+        return (obj[1], obj[2])
+    if kind in ('draw', 'arc'):
+        return ((obj[1] + obj[3])/2, (obj[2] + obj[4])/2)
+    (left, bottom, right, top) = gerber.object_extents(obj)
+    return ((left + right)/2, (bottom + top)/2)
+
+
+# Get a readable description of an aperture
+def aperture_text(aperture):
+    (name, params) = aperture[0]
+    if name in ('C', 'R', 'O', 'P'):
+        values = [format(p*25.4, '.4g') for p in params[:1 if name == 'P' else 2]]
+        return name + " " + "x".join(values) + " mm"
+    return name
+
+
+# Describe an object as a dict with its kind and coordinates in mm
+def describe(obj):
+    kind = obj[0]
+    description = {'type': kind, 'polarity': 'dark' if obj[-1] else 'clear'}
+    if kind == 'flash':
+        description['position'] = [round(obj[1]*25.4, 4), round(obj[2]*25.4, 4)]
+        description['aperture'] = aperture_text(obj[3])
+    elif kind in ('draw', 'arc'):
+        description['start'] = [round(obj[1]*25.4, 4), round(obj[2]*25.4, 4)]
+        description['end'] = [round(obj[3]*25.4, 4), round(obj[4]*25.4, 4)]
+        description['aperture'] = aperture_text(obj[5] if kind == 'draw' else obj[8])
+        if kind == 'arc':
+            description['center'] = [round(obj[5]*25.4, 4), round(obj[6]*25.4, 4)]
+    else:
+        (left, bottom, right, top) = gerber.object_extents(obj)
+        description['bounds'] = [round(left*25.4, 4), round(bottom*25.4, 4), round(right*25.4, 4), round(top*25.4, 4)]
+    return description
+
+
+# Describe what has changed between two matched objects. 'layers' are the polarity layers of the objects (see
+# polarity_layers()).
+def change_text(obj1, obj2, layers=(0, 0)):
+    (x1, y1), (x2, y2) = object_position(obj1), object_position(obj2)
+    changes = []
+    if obj1[0] == 'flash':
+        if _point(x1, y1) != _point(x2, y2):
+            changes.append("moved " + format((x2 - x1)*25.4, '.4f') + ", " + format((y2 - y1)*25.4, '.4f') + " mm")
+        if obj1[3][0] != obj2[3][0]:
+            changes.append("aperture changed from " + aperture_text(obj1[3]) + " to " + aperture_text(obj2[3]))
+    elif obj1[0] in ('draw', 'arc'):
+        aperture1 = obj1[5] if obj1[0] == 'draw' else obj1[8]
+        aperture2 = obj2[5] if obj2[0] == 'draw' else obj2[8]
+        if object_key(obj1, {})[1:-3] != object_key(obj2, {})[1:-3]:
+            changes.append("moved or resized")
+        if aperture1[0] != aperture2[0]:
+            changes.append("aperture changed from " + aperture_text(aperture1) + " to " + aperture_text(aperture2))
+    elif object_key(obj1, {})[1] != object_key(obj2, {})[1]:
+        changes.append("shape changed")
+    if obj1[-1] != obj2[-1]:
+        changes.append("polarity changed")
+    elif layers[0] != layers[1]:
+        changes.append("drawn in polarity layer " + str(layers[1]) + " instead of " + str(layers[0]))
+    return ", ".join(changes)
+
+
+# Compare the objects of two parsed files. Objects are the same if they have the same key (see object_key()), so they
+# may be in another order within a polarity layer.
+# Returns a dict with the lists of 'added', 'removed' and 'modified' objects and the number of 'unchanged' objects.
+# The modified objects are (object 1, object 2, (polarity layer 1, polarity layer 2)).
+def compare(objects1, objects2, match_distance=default_match_distance):
+    apertures = {}
+    (layers1, layers2) = (polarity_layers(objects1), polarity_layers(objects2))
+    keys1 = [object_key(obj, apertures, layer) for obj, layer in zip(objects1, layers1)]
+    keys2 = [object_key(obj, apertures, layer) for obj, layer in zip(objects2, layers2)]
+    counts1 = Counter(keys1)
+    counts2 = Counter(keys2)
+
+    # Objects that are the same in both files. The same object may appear more than once in a file, so only the
+    # keys that appear a different number of times in the files have objects that are added or removed.
+    unchanged = 0
+    changed = set()
+    for key, count in counts1.items():
+        other = counts2.get(key, 0)
+        unchanged = unchanged + min(count, other)
+        if other != count:
+            changed.add(key)
+    for key in counts2.keys() - counts1.keys():
+        changed.add(key)
+
+    # Get the objects that are left over, with their polarity layers
+    def unmatched(objects, keys, layers, other_counts):
+        left = {}
+        result = []
+        for obj, key, layer in zip(objects, keys, layers):
+            if key in changed:
+                count = left.get(key, other_counts.get(key, 0))
+                if count > 0:
+                    left[key] = count - 1
+                else:
+                    left[key] = 0
+                    result.append((obj, layer))
+        return result
+
+    removed = unmatched(objects1, keys1, layers1, counts2)
+    added = unmatched(objects2, keys2, layers2, counts1)
+
+    # Match the remaining objects by position
+    cell = max(match_distance/25.4, 1e-6)
+    grid = {}
+    for index, (obj, layer) in enumerate(added):
+        (x, y) = object_position(obj)
+        grid.setdefault((int(math.floor(x/cell)), int(math.floor(y/cell))), []).append(index)
+
+    modified = []
+    still_removed = []
+    taken = set()
+    for (obj, layer) in removed:
+        (x, y) = object_position(obj)
+        cx, cy = int(math.floor(x/cell)), int(math.floor(y/cell))
+        best = None
+        for gx in (cx - 1, cx, cx + 1):
+            for gy in (cy - 1, cy, cy + 1):
+                for index in grid.get((gx, gy), ()):
+                    other = added[index][0]
+                    if index in taken or other[0] != obj[0]:
+                        continue
+                    (ox, oy) = object_position(other)
+                    distance = math.hypot(ox - x, oy - y)
+                    # The nearest object of the same polarity is preferred, like for a pad with a hole in it
+                    candidate = (distance, other[-1] != obj[-1], index)
+                    if distance <= cell and (best is None or candidate < best):
+                        best = candidate
+        if best is None:
+            still_removed.append(obj)
+        else:
+            taken.add(best[2])
+            modified.append((obj, added[best[2]][0], (layer, added[best[2]][1])))
+
+    return {
+        'unchanged': unchanged,
+        'removed': still_removed,
+        'added': [obj for index, (obj, layer) in enumerate(added) if index not in taken],
+        'modified': modified,
+    }
+
+
+# Convert the result of compare() to a dict that can be written as JSON
+def report(result):
+    return {
+        'unchanged': result['unchanged'],
+        'added': [describe(obj) for obj in result['added']],
+        'removed': [describe(obj) for obj in result['removed']],
+        'modified': [{'from': describe(obj1), 'to': describe(obj2), 'change': change_text(obj1, obj2, layers)}
+                     for (obj1, obj2, layers) in result['modified']],
+    }
+
+
+# Get a one line summary of the result of compare()
+def summary(result):
+    if not (result['added'] or result['removed'] or result['modified']):
+        return "Identical. " + str(result['unchanged']) + " objects."
+    return (str(len(result['added'])) + " added, " + str(len(result['removed'])) + " removed, " +
+            str(len(result['modified'])) + " modified, " + str(result['unchanged']) + " unchanged objects.")
+
+
+# Compare two gerber or drill files
+def compare_files(filepath1, filepath2, match_distance=default_match_distance):
+    return compare(gerber.parse_file(filepath1), gerber.parse_file(filepath2), match_distance)
@@ -0,0 +1,211 @@
+import json
+import os
+
+# A diff artifact keeps the images of a layer in one file instead of the full size images, for when the results of
+# many exports are stored, like in CI. It's a zip archive with a low resolution overview of every image, scaled down to
+# fit in artifact_overview_size pixels, and the tiles of artifact_tile_size pixels of the images at full size around
+# the change regions of the diff. The images of the windows of a coarse to fine diff are kept in the archive as they
+# are. artifact.json in the archive has the name, size, overview and tiles of every image, the tile size and the
+# windows. The full size images are made again from the archive by reconstruct_artifact_image(), with the parts
+# outside the tiles scaled up from the overview.
+
+
+# Size in pixels of the tiles and the largest size of the overview of a diff artifact
+artifact_tile_size = 512
+artifact_overview_size = 2048
+
+# Margin in pixels around a change region that is kept in the tiles of a diff artifact, for the box that is drawn around
+# the region
+artifact_region_margin = 3
+
+# PNG compression level of the overviews and tiles of a diff artifact. An artifact is written once and kept, so it's
+# worth a slower compression than the png export, which makes sparse images about half as large. Levels above 6 are
+# much slower on layers with many changes.
+artifact_png_compression = 6
+
+
+# Get the path of a tile of an image in a diff artifact
+def artifact_tile_name(name, row, column):
+    return "tiles/" + name + "/" + str(row) + "_" + str(column) + ".png"
+
+
+# Get the name of an image in a diff artifact from its path, like "1", "2" or "combined"
+def artifact_image_name(img):
+    return os.path.splitext(os.path.basename(img))[0].rsplit("-", 1)[-1]
+
+
+# Get the tiles of an image of 'size' (height, width) that the change 'regions' (see change_regions()) are in
+def region_tiles(regions, size, tile_size):
+    (height, width) = size
+    tiles = set()
+    for (x, y, w, h, pixels) in regions:
+        (x0, y0) = (max(0, x - artifact_region_margin), max(0, y - artifact_region_margin))
+        (x1, y1) = (min(width - 1, x + w + artifact_region_margin), min(height - 1, y + h + artifact_region_margin))
+        if x0 > x1 or y0 > y1:
+            continue
+        for row in range(y0 // tile_size, y1 // tile_size + 1):
+            for column in range(x0 // tile_size, x1 // tile_size + 1):
+                tiles.add((row, column))
+    return tiles
+
+
+# Get the tiles of an image that have pixels of another color than the 'background' (BGR)
+def foreground_tiles(image, background, tile_size):
+    import numpy as np
+
+    (height, width) = image.shape[:2]
+    background = np.asarray(background, dtype=image.dtype)
+    tiles = set()
+    for y in range(0, height, tile_size):
+        columns = (image[y:y + tile_size] != background).reshape(min(tile_size, height - y), width, -1).any(axis=2).any(
+            axis=0)
+        for column in np.flatnonzero(np.logical_or.reduceat(columns, np.arange(0, width, tile_size))):
+            tiles.add((y // tile_size, int(column)))
+    return tiles
+
+
+# Start writing the diff artifact of a layer to 'filepath' (see artifact_tile_size). 'info' is written to artifact.json
+# as well. The archive is written to a temporary file until it's finished, so an artifact of an earlier export is only
+# replaced by a complete artifact.
+# Returns the artifact, to which the images are added with add_artifact_image(). It's finished with
+# close_diff_artifact(), or removed with discard_diff_artifact().
+def open_diff_artifact(filepath, info=None, tile_size=artifact_tile_size, overview_size=artifact_overview_size):
+    from zipfile import ZipFile, ZIP_STORED
+
+    temp_filepath = filepath + ".tmp"
+    return {'filepath': filepath, 'temp_filepath': temp_filepath, 'archive': ZipFile(temp_filepath, 'w', ZIP_STORED),
+            'overview_size': overview_size, 'content': dict(info or {}, tile_size=tile_size, images=[], windows=[])}
+
+
+# Add an image with the differences marked to a diff artifact (see open_diff_artifact()). 'name' is the name of the
+# image (see artifact_image_name()). The tiles that the change 'regions' of the diff are in are kept (see
+# change_regions(), in the frame of the image). Without 'regions', like when the images have different sizes and
+# couldn't be compared, every tile with pixels of another color than the 'background' (BGR) is kept.
+def add_artifact_image(artifact, name, image, regions=None, background=None):
+    import math
+    import cv2  # opencv-python
+
+    def encode(image):
+        return cv2.imencode(".png", image, [cv2.IMWRITE_PNG_COMPRESSION, artifact_png_compression])[1].tobytes()
+
+    archive = artifact['archive']
+    tile_size = artifact['content']['tile_size']
+    (height, width) = image.shape[:2]
+    scale = max(1, int(math.ceil(max(height, width)/float(artifact['overview_size']))))
+    entry = {'name': name, 'width': width, 'height': height, 'scale': scale, 'overview': "overview-" + name + ".png",
+             'tiles': []}
+    (rows, columns) = ((height + tile_size - 1) // tile_size, (width + tile_size - 1) // tile_size)
+    if scale == 1:
+        # The overview is the full size image, so no tiles are needed
+        tiles = set()
+    else:
+        if regions is not None:
+            tiles = region_tiles(regions, (height, width), tile_size)
+        else:
+            tiles = foreground_tiles(image, image[0, 0] if background is None else background, tile_size)
+        if len(tiles) >= rows*columns*(1 - 1.0/(scale*scale)):
+            # The overview would be as large as the tiles that it saves, so every tile is kept instead
+            entry['overview'] = None
+            tiles = set((row, column) for row in range(rows) for column in range(columns))
+    if entry['overview'] is not None:
+        overview = cv2.resize(image, ((width + scale - 1) // scale, (height + scale - 1) // scale),
+                              interpolation=cv2.INTER_AREA)
+        archive.writestr(entry['overview'], encode(overview))
+        del overview
+    for (row, column) in sorted(tiles):
+        tile = image[row*tile_size:(row + 1)*tile_size, column*tile_size:(column + 1)*tile_size]
+        archive.writestr(artifact_tile_name(name, row, column), encode(tile))
+        entry['tiles'].append([row, column])
+    artifact['content']['images'].append(entry)
+
+
+# Finish a diff artifact (see open_diff_artifact()) and replace the artifact of an earlier export with it. 'windows'
+# are the paths of the images of the windows of a coarse to fine diff, which are kept in the artifact as they are.
+# Returns the contents of artifact.json.
+def close_diff_artifact(artifact, windows=()):
+    archive = artifact['archive']
+    content = artifact['content']
+    for window in windows:
+        if os.path.exists(window):
+            archive.write(window, "windows/" + os.path.basename(window))
+            content['windows'].append("windows/" + os.path.basename(window))
+    archive.writestr("artifact.json", json.dumps(content, indent=1))
+    archive.close()
+    os.replace(artifact['temp_filepath'], artifact['filepath'])
+    return content
+
+
+# Remove a diff artifact that hasn't been finished (see open_diff_artifact()). An artifact of an earlier export is kept.
+def discard_diff_artifact(artifact):
+    if artifact is None:
+        return
+    artifact['archive'].close()
+    if os.path.exists(artifact['temp_filepath']):
+        os.remove(artifact['temp_filepath'])
+
+
+# Write the diff artifact of a layer to 'filepath' at once (see open_diff_artifact()). 'imgs' are the paths of the
+# images of the layer, which are read from the files unless they're given in 'images' (with the differences marked,
+# like the images of diff_layer_images()). 'regions' are the change regions of every image (see add_artifact_image()),
+# or None to keep the tiles that aren't 'background'. 'windows' are the paths of the images of the windows of a coarse
+# to fine diff, and 'info' is written to artifact.json as well.
+def write_diff_artifact(filepath, imgs, images=None, windows=(), info=None, regions=None, background=None,
+                        tile_size=artifact_tile_size, overview_size=artifact_overview_size):
+    import cv2  # opencv-python
+
+    artifact = open_diff_artifact(filepath, info, tile_size, overview_size)
+    try:
+        for index, img in enumerate(imgs):
+            if img is None:
+                continue
+            image = cv2.imread(img) if images is None else images[index]
+            if image is None:
+                raise OSError("Unable to read " + img)
+            add_artifact_image(artifact, artifact_image_name(img), image, None if regions is None else regions[index],
+                               background)
+            del image
+        return close_diff_artifact(artifact, windows)
+    except Exception:
+        discard_diff_artifact(artifact)
+        raise
+
+
+# Read artifact.json of a diff artifact (see write_diff_artifact())
+def read_diff_artifact(filepath):
+    from zipfile import ZipFile
+
+    with ZipFile(filepath) as archive:
+        return json.loads(archive.read("artifact.json").decode('utf-8'))
+
+
+# Make a full size image of a diff artifact (see write_diff_artifact()) again. 'name' is the name of the image, like
+# "1", "2" or "combined". The parts of the image where image 1 and 2 are the same are scaled up from the overview, and
+# the rest is the tiles at full size.
+# Returns the image. Raises ValueError if the artifact doesn't have the image.
+def reconstruct_artifact_image(filepath, name):
+    from zipfile import ZipFile
+    import cv2  # opencv-python
+    import numpy as np
+
+    with ZipFile(filepath) as archive:
+        content = json.loads(archive.read("artifact.json").decode('utf-8'))
+        entry = next((image for image in content['images'] if image['name'] == name), None)
+        if entry is None:
+            raise ValueError("No image " + str(name) + " in " + filepath)
+
+        def read(member):
+            image = cv2.imdecode(np.frombuffer(archive.read(member), dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                raise ValueError("Unable to read " + member + " in " + filepath)
+            return image
+
+        if entry['overview'] is None:
+            image = np.zeros((entry['height'], entry['width'], 3), dtype=np.uint8)
+        else:
+            image = cv2.resize(read(entry['overview']), (entry['width'], entry['height']),
+                               interpolation=cv2.INTER_NEAREST if entry['scale'] == 1 else cv2.INTER_LINEAR)
+        tile_size = content['tile_size']
+        for (row, column) in entry['tiles']:
+            tile = read(artifact_tile_name(name, row, column))
+            image[row*tile_size:row*tile_size + tile.shape[0], column*tile_size:column*tile_size + tile.shape[1]] = tile
+    return image
@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import grbcore
+
+# Compare many pairs of gerbers without the GUI, like in a CI job, on a pool of processes.
+#
+# python grbbatch.py MANIFEST [--settings settings.ini] [--output DIR] [--processes N] [--workers N]
+#                             [--memory-cache MB] [--fail-on-change]
+#
+# The manifest is a JSON file with a list of pairs, or an object with the list of "pairs" and "defaults" for every
+# pair:
+#     {"defaults": {"dpi": 300, "png": false},
+#      "pairs": [{"name": "rev-b", "gerber1": "rev-a.zip", "gerber2": "rev-b.zip"}, ...]}
+# A pair has the same keys as a request to the diff service (see grbservice.py), like "dpi", "coarse_dpi",
+# "renderer", "diff_mode" and "output", and optionally a "name". Paths that aren't absolute are relative to the
+# directory of the manifest. The settings that aren't given are taken from settings.ini, like in GrbDiff.
+# The images and change reports of a pair are written to its "output", or to a directory named by the name or the
+# number of the pair in the output dir, with the result of the pair as result.json, so a name can't be a path (or "."
+# or ".."). The results of all pairs are written to batch.json in the output dir.
+# The exit code is 1 if a pair couldn't be compared, and with --fail-on-change 2 if a layer of a pair has changed.
+
+# The state of a process of the batch: the settings and the memory cache
+batch = {'settings': None, 'memory': None}
+
+
+# Set up a process of the batch. Every process plans its exports for its part of the available memory (see
+# grbcore.plan_export_jobs()).
+def init_process(settings, memory_cache_size, processes):
+    batch['settings'] = settings
+    batch['memory'] = grbcore.new_memory_cache(memory_cache_size) if memory_cache_size > 0 else None
+    grbcore.export_memory_fraction = grbcore.export_memory_fraction/processes
+
+
+# Read the pairs of a manifest. Returns the pairs with their defaults applied and their paths made absolute.
+# Raises ValueError if the manifest isn't a list of pairs with "gerber1" and "gerber2", or if the name of a pair isn't
+# the name of a directory in the output dir.
+def read_manifest(filepath):
+    with open(filepath) as f:
+        manifest = json.load(f)
+    defaults = {}
+    if isinstance(manifest, dict):
+        defaults = manifest.get('defaults', {})
+        manifest = manifest.get('pairs')
+    if not isinstance(manifest, list) or not isinstance(defaults, dict):
+        raise ValueError("The manifest must be a list of pairs, or an object with a list of \"pairs\"")
+    directory = os.path.dirname(os.path.abspath(filepath))
+    pairs = []
+    for number, pair in enumerate(manifest, 1):
+        if not isinstance(pair, dict) or not pair.get('gerber1') or not pair.get('gerber2'):
+            raise ValueError("Pair " + str(number) + " of the manifest needs \"gerber1\" and \"gerber2\"")
+        pair = dict(defaults, **pair)
+        for name in ('gerber1', 'gerber2', 'output'):
+            if pair.get(name):
+                pair[name] = os.path.join(directory, pair[name])
+        pair.setdefault('name', "pair-" + str(number))
+        name = pair['name']
+        # A drive (like C:) is a path as well on Windows
+        if not isinstance(name, str) or name in ("", ".", "..") or any(c in name for c in "/\\:"):
+            raise ValueError("The name of pair " + str(number) + " of the manifest must be a directory name without "
+                             "path separators: " + json.dumps(name))
+        if any(other['name'] == pair['name'] for other in pairs):
+            raise ValueError("More than one pair is named " + str(pair['name']))
+        pairs.append(pair)
+    return pairs
+
+
+# Compare the gerbers of a pair (see read_manifest()) in a process of the batch, with 'workers' workers for the png
+# export (see grbcore.run_export_jobs()). The result is written as result.json to the output dir of the pair.
+# Returns the result of the pair as a dict that can be written as JSON.
+def run_pair(pair, workers):
+    started = time.perf_counter()
+    result = {'name': pair['name'], 'gerber1': pair['gerber1'], 'gerber2': pair['gerber2'],
+              'output': os.path.abspath(pair['output']), 'status': 'failed'}
+    sets = []
+    try:
+        options = grbcore.request_export_options(batch['settings'], pair, batch['memory'])
+        for name in ('gerber1', 'gerber2'):
+            if not os.path.exists(pair[name]):
+                raise ValueError("No such gerber file or directory: " + pair[name])
+            sets.append(grbcore.open_gerber_set(pair[name], grbcore.filetypes))
+        os.makedirs(result['output'], exist_ok=True)
+        (jobs, job_layers) = grbcore.export_jobs(sets[0], sets[1], result['output'], options)
+        print("Pair", pair['name'], "exports", len(jobs), "layers to", result['output'])
+        results = grbcore.run_export_jobs(jobs, workers)
+        result.update(grbcore.export_results(jobs, job_layers, results))
+        result['changed'] = changed_layers(result)
+        result['status'] = 'done'
+    except Exception as e:
+        print("Pair", pair['name'], "failed. Error:", e)
+        result['error'] = str(e)
+    finally:
+        for gerber_set in sets:
+            if gerber_set['temp_dir']:
+                shutil.rmtree(gerber_set['temp_dir'], ignore_errors=True)
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    if os.path.isdir(result['output']):
+        with open(os.path.join(result['output'], "result.json"), 'w') as f:
+            json.dump(result, f, indent=1)
+    return result
+
+
+# Get the layers of the result of a pair that have changed: the layers whose change report has change regions, and
+# the layers that couldn't be compared
+def changed_layers(result):
+    return [layer['layer'] for layer in result.get('layers', [])
+            if layer['diff'] is None or layer['diff'].get('regions') or not layer['diff'].get('compared', True)]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Compare many pairs of gerbers without the GUI of GrbDiff")
+    parser.add_argument('manifest', help="JSON file with the pairs of gerbers to compare")
+    parser.add_argument('--settings', default="settings.ini", help="settings of GrbDiff to use")
+    parser.add_argument('--output', default="", help="where the images and results of the pairs are written "
+                                                     "(default: the export png dir of the settings)")
+    parser.add_argument('--processes', type=int, default=0,
+                        help="number of pairs that are compared at the same time (default: one per CPU core, at most "
+                             "one per pair)")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="number of workers of the png export of every pair (default: the workers of the settings "
+                             "shared by the processes)")
+    parser.add_argument('--memory-cache', type=float, default=grbcore.default_memory_cache_size,
+                        help="size in MB of the cache of parsed files and rendered images, shared by the processes")
+    parser.add_argument('--fail-on-change', action='store_true', help="exit with 2 if a layer of a pair has changed")
+    options = parser.parse_args(argv)
+
+    try:
+        pairs = read_manifest(options.manifest)
+    except (OSError, ValueError) as e:
+        print("Unable to read the manifest", options.manifest, "Error:", e)
+        return 1
+    settings = grbcore.read_settings(options.settings)
+    settings = {section: dict(settings[section]) for section in settings.sections()}
+    output = options.output or settings['PATHS'].get('png_export_path') or "GrbDiff-batch"
+    for pair in pairs:
+        pair.setdefault('output', os.path.join(output, pair['name']))
+    processes = max(1, min(options.processes or grbcore.default_workers(), len(pairs)))
+    workers = options.workers or max(1, int(settings['OTHER'].get('png_export_workers'))//processes)
+    memory_cache_size = options.memory_cache/processes
+    print("Comparing", len(pairs), "pairs with", processes, "processes and", workers, "workers each")
+
+    started = time.perf_counter()
+    results = []
+    if processes == 1:
+        init_process(settings, memory_cache_size, processes)
+        for pair in pairs:
+            results.append(run_pair(pair, workers))
+            print("Pair", pair['name'], results[-1]['status'], "in", results[-1]['seconds'], "s")
+    else:
+        with ProcessPoolExecutor(max_workers=processes, initializer=init_process,
+                                 initargs=(settings, memory_cache_size, processes)) as executor:
+            futures = {executor.submit(run_pair, pair, workers): pair for pair in pairs}
+            for future in as_completed(futures):
+                pair = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # The process of the pair has died, like when it ran out of memory
+                    print("Pair", pair['name'], "failed. Error:", e)
+                    result = {'name': pair['name'], 'gerber1': pair['gerber1'], 'gerber2': pair['gerber2'],
+                              'output': os.path.abspath(pair['output']), 'status': 'failed', 'error': str(e)}
+                print("Pair", pair['name'], result['status'], "in", result.get('seconds'), "s")
+                results.append(result)
+        order = dict((pair['name'], index) for index, pair in enumerate(pairs))
+        results.sort(key=lambda result: order[result['name']])
+
+    os.makedirs(output, exist_ok=True)
+    summary = {'seconds': round(time.perf_counter() - started, 3), 'processes': processes, 'workers': workers,
+               'pairs': [{key: result.get(key) for key in ('name', 'status', 'output', 'changed', 'seconds', 'error')}
+                         for result in results]}
+    with open(os.path.join(output, "batch.json"), 'w') as f:
+        json.dump(summary, f, indent=1)
+    failed = [result['name'] for result in results if result['status'] != 'done']
+    changed = [result['name'] for result in results if result.get('changed')]
+    print("Compared", len(pairs) - len(failed), "of", len(pairs), "pairs in", summary['seconds'], "s.",
+          len(changed), "pairs have changes. Results written to", os.path.abspath(os.path.join(output, "batch.json")))
+    if failed:
+        return 1
+    if options.fail_on_change and changed:
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,106 @@
+# 1-bit bitplanes of the images of a layer, for the exact diff of the png export (see grbcore.diff_layer_images()). A
+# bitplane has one bit for every pixel of an image, set where the pixel isn't the background color. The bitplanes are
+# converted a strip at a time, so an image is never unpacked at full size.
+
+
+# Number of rows of an image that are converted to or from a bitplane at a time
+bitplane_strip_rows = 256
+
+
+# Pack an image to a bitplane: one bit for every pixel, set where the pixel isn't the background color, with 8 pixels
+# in every byte of a row (see numpy.packbits()). A layer only has copper or no copper, so the bitplane has everything
+# that is in the image in 1/24 of the memory of a color image. The image may be a color or a grayscale image, and may
+# be memory mapped (see read_raw_image()), since it's read a strip at a time. 'background' is the background color
+# (BGR for a color image) of the color template. Without it, the color of the upper left corner is used, which is only
+# right for images of a whole board, since the corner of a window of a board may be copper.
+def pack_bitplane(image, background=None):
+    import numpy as np
+
+    height, width = image.shape[:2]
+    if background is None:
+        background = image[0, 0]
+    background = np.array(background, dtype=image.dtype)
+    plane = np.empty((height, (width + 7)//8), dtype=np.uint8)
+    for y0 in range(0, height, bitplane_strip_rows):
+        strip = image[y0:y0 + bitplane_strip_rows] != background
+        if strip.ndim == 3:
+            strip = strip.any(axis=2)
+        plane[y0:y0 + bitplane_strip_rows] = np.packbits(strip, axis=1)
+    return plane
+
+
+# Unpack a bitplane (see pack_bitplane()) of an image that is 'width' pixels wide to a grayscale image, which is 255
+# where the bit is set and 0 elsewhere
+def unpack_bitplane(plane, width):
+    import numpy as np
+
+    image = np.unpackbits(plane, axis=1, count=width)
+    image *= 255
+    return image
+
+
+# Number of set bits in every value of a byte
+_popcount_table = None
+
+
+# Count the set bits in every row of a bitplane. Returns an array with the count of every row.
+def popcount_rows(plane):
+    import numpy as np
+    global _popcount_table
+
+    if _popcount_table is None:
+        _popcount_table = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1, dtype=np.uint8)
+    counts = np.empty(plane.shape[0], dtype=np.int64)
+    for y0 in range(0, plane.shape[0], bitplane_strip_rows):
+        counts[y0:y0 + bitplane_strip_rows] = _popcount_table[plane[y0:y0 + bitplane_strip_rows]].sum(axis=1,
+                                                                                                      dtype=np.int64)
+    return counts
+
+
+# Scale the image of a bitplane (see pack_bitplane()) that is 'width' pixels wide down by a whole 'factor' to a
+# grayscale image, where every pixel is the part of the bits under it that are set (0-255). The bitplane is unpacked a
+# strip at a time, so the image is never unpacked at full size.
+def bitplane_thumbnail(plane, width, factor):
+    import numpy as np
+    import cv2  # opencv-python
+
+    height = plane.shape[0]
+    columns = (width + factor - 1)//factor
+    thumbnail = np.empty(((height + factor - 1)//factor, columns), dtype=np.uint8)
+    strip_rows = factor*max(1, bitplane_strip_rows//factor)
+    for y0 in range(0, height, strip_rows):
+        rows = (min(strip_rows, height - y0) + factor - 1)//factor
+        # The strip is padded with no bits set to a whole number of pixels of the thumbnail, which are the averages of
+        # the pixels under them with INTER_AREA
+        strip = np.zeros((rows*factor, columns*factor), dtype=np.uint8)
+        strip[:min(strip_rows, height - y0), :width] = np.unpackbits(plane[y0:y0 + strip_rows], axis=1, count=width)
+        strip *= 255
+        thumbnail[y0//factor:y0//factor + rows] = cv2.resize(strip, (columns, rows), interpolation=cv2.INTER_AREA)
+    return thumbnail
+
+
+# Unpack the part of a bitplane from row y0 to y1 and column x0 to x1 to a grayscale image (see unpack_bitplane())
+def unpack_bitplane_window(plane, x0, y0, x1, y1):
+    import numpy as np
+
+    start = x0 - x0 % 8
+    image = np.unpackbits(plane[y0:y1, start//8:(x1 + 7)//8], axis=1)[:, x0 - start:x1 - start]
+    image = np.ascontiguousarray(image)
+    image *= 255
+    return image
+
+
+# Place the image of a bitplane that is 'width' pixels wide at a whole pixel offset (x, y) in a larger frame of
+# (height, width) pixels, like grbregistration.place_image(), with no bits set in the rest of the frame. The bitplane
+# is unpacked a strip at a time.
+def place_bitplane(plane, width, offset, size):
+    import numpy as np
+
+    (height, frame_width) = size
+    placed = np.zeros((height, (frame_width + 7)//8), dtype=np.uint8)
+    for y0 in range(0, plane.shape[0], bitplane_strip_rows):
+        strip = np.unpackbits(plane[y0:y0 + bitplane_strip_rows], axis=1, count=width)
+        row = np.zeros((strip.shape[0], frame_width), dtype=np.uint8)
+        row[:, offset[0]:offset[0] + width] = strip
+        placed[offset[1] + y0:offset[1] + y0 + strip.shape[0]] = np.packbits(row, axis=1)
+    return placed
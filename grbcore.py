@@ -0,0 +1,2334 @@
+import contextlib
+import hashlib
+import json
+import os
+import queue
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import grbartifact
+import grbbitplane
+import grbpyramid
+import grbregistration
+
+# Functions used by GrbDiff that don't touch the GUI. Everything in here may be called from worker threads, so all
+# values from the tkinter widgets must be read on the main thread and passed in as arguments.
+
+
+# Definition of all layers to be recognized.
+# https://www.pcbway.com/helpcenter/technical_support/Gerber_File_Extention_from_Different_Software.html
+# Specify layer name, an array of patterns to look for, one pattern to dismiss and an array of patterns for the
+# Gerber X2 file function (%TF.FileFunction) of the layer.
+# When opening gerber files, the application will begin to look for the first pattern in the first layer. Then the
+# second pattern of the first layer and so on. As soon as a layer has been found, that file will not be tagged for
+# another layer even if it happens to match a filter on a sequent layer.
+# Files with a file function attribute are tagged by the attribute instead of the filename.
+# It's important that the last layer is the outline of the pcb, since this is included in all layers when exporting
+# to png.
+filetypes = [
+               ['Top Solder Paste', ['*.gtp', '*-F?Paste.*', '*.crc', '*.tsp', '*.stp', '*.toppaste.gbr', '*.creammask_top.gbr', '*.tcream.ger'], '', ['Paste,Top*']],
+               ['Top Silk Screen', ['*.gto', '*-F?SilkS.*', '*.plc', '*.tsk', '*.sst', '*.silkscreen_top.gbr', '*.topsilk.gbr', '*.topsilkscreen.ger', 'to'], '', ['Legend,Top*']],
+               ['Top Solder Mask', ['*.gts', '*-F?Mask.*', '*.stc', '*.tsm', '*.smt', '*.topmask.gbr', '*.soldermask_top.gbr', '*.topsoldermask.ger', 'ts'], '', ['Soldermask,Top*']],
+               ['Copper Layer L1', ['*.gtl', '*-L1.*', '*.g1', '*-F?Cu*', '*.cmp', '*.top', '*.top.gbr', '*.copper_l1.gbr', '*.toplayer.ger', 'tl'], '*.pos', ['Copper,L1,*']],
+               ['Copper Layer L2', ['*.g1', '*.g2', '*-L2.*', '*-In1?Cu*', '*-Inner1?Cu*', '*.ly1', '*.ly2', '*.in1', '*.internalplane1.ger', '*.copper_l2.gbr', 'l2', '*.gbl', '*-B?Cu*', '*.sol', '*.bot', '*.bottom.gbr', '*.bottomlayer.ger', 'bl'], '*.pos', ['Copper,L2,*']],
+               ['Copper Layer L3', ['*.g2', '*.g3', '*-L3.*', '*-In2?Cu*', '*-Inner2?Cu*', '*.ly2', '*.ly3', '*.in2', '*.internalplane2.ger', '*.copper_l3.gbr', 'l3', '*.gbl', '*-B?Cu*', '*.sol', '*.bot', '*.bottom.gbr', '*.bottomlayer.ger', 'bl'], '*.pos', ['Copper,L3,*']],
+               ['Copper Layer L4', ['*.g3', '*.g4', '*-L4.*', '*-In3?Cu*', '*-Inner3?Cu*', '*.ly3', '*.ly4', '*.in3', '*.internalplane3.ger', '*.copper_l4.gbr', 'l4', '*.gbl', '*-B?Cu*', '*.sol', '*.bot', '*.bottom.gbr', '*.bottomlayer.ger', 'bl'], '*.pos', ['Copper,L4,*']],
+               ['Copper Layer L5', ['*.g4', '*.g5', '*-L5.*', '*-In4?Cu*', '*-Inner4?Cu*', '*.ly4', '*.ly5', '*.in4', '*.internalplane4.ger', '*.copper_l5.gbr', 'l5', '*.gbl', '*-B?Cu*', '*.sol', '*.bot', '*.bottom.gbr', '*.bottomlayer.ger', 'bl'], '*.pos', ['Copper,L5,*']],
+               ['Copper Layer L6', ['*.g5', '*.g6', '*-L6.*', '*.gbl', '*-B?Cu*', '*.sol', '*.bot', '*.bottom.gbr', '*.copper_l6.gbr', '*.bottomlayer.ger', 'bl'], '*.pos', ['Copper,L6,*']],
+               ['Bottom Solder Mask', ['*.gbs', '*-B?Mask.*', '*.sts', '*.bsm', '*.smb', '*.bottommask.gbr', '*.soldermask_bottom.gbr', '*.bottomsoldermask.ger', 'bs'], '', ['Soldermask,Bot*']],
+               ['Bottom Silk Screen', ['*.gbo', '*-B?SilkS.*', '*.pls', '*.bsk', '*.ssb', '*.silkscreen_bottom.gbr', '*.bottomsilk.gbr', '*.bottomsilkscreen.ger'], '', ['Legend,Bot*']],
+               ['Bottom Solder Paste', ['*.gbp', '*-B?Paste.*', '*.crs', '*.bsp', '*.spb', '*.bottompaste.gbr', '*.creammask_bottom.gbr', '*.bcream.ger'], '', ['Paste,Bot*']],
+               ['Plated Drill File', ['*-PTH.drl', '*.drl', '*.txt', '*.xln', '*.exc', '*.drd', '*.tap', '*.fab.gbr', '*.plated-drill.cnc', 'drl'], '*NPTH*', ['Plated,*']],
+               ['Non-Plated Drill File', ['*NPTH.drl', '*.holes_npth.xln'], '', ['NonPlated,*']],
+               ['Eco1 Layer', ['*-User?Eco1.*', '*-Eco1?User.*', 'vcut'], '', []],
+               ['Outline of PCB', ['*.gm1', '*-Edge?Cuts.*', '*.gko', '*.gm3', '*.dim', '*.gml', '*.fab', '*.out.gbr', '*.board_outline.gbr', '*.boardout.ger', 'ko'], '', ['Profile,*']],
+            ]
+
+# Layers whose files are compared hole by hole by the vector diff (see vector_diff_layer())
+drill_filetypes = ['Plated Drill File', 'Non-Plated Drill File']
+
+# Color templates for exporting the gerbers to png.
+png_color_template = [
+                       ['Green Copper Layers on White background',  # Template Name
+                        '#FFFFFF',    # Background
+                        '#00690B',    # Gerber 1 color
+                        '#00690B',    # Gerber 2 color
+                        '#00FF0880',  # Gerber 1 color on the combined picture
+                        '#0000A7FF',  # Gerber 2 color on the combined picture
+                       ],
+                       ['Green and Blue Copper Layers on White background',  # Template Name
+                        '#FFFFFF',    # Background
+                        '#00690B',    # Gerber 1 color
+                        '#000080',    # Gerber 2 color
+                        '#00FF0880',  # Gerber 1 color on the combined picture
+                        '#0000A7FF',  # Gerber 2 color on the combined picture
+                       ],
+                     ]
+
+
+# Number of bytes at the start of a file that are searched for a Gerber X2 file function attribute
+file_head_size = 4096
+
+# Extensions of files that are searched for a file function attribute even if their name doesn't match any layer
+x2_extensions = ('.gbr', '.gbx')
+
+_file_function = re.compile(rb'TF\.FileFunction,([^*%\r\n]*)')
+
+
+# Get the value of the Gerber X2 file function attribute (%TF.FileFunction) in the start of a file, like
+# "Copper,L1,Top". Excellon files from KiCad have it in a comment. Returns None if the file doesn't have it.
+def file_function(head):
+    match = _file_function.search(head)
+    if match is None:
+        return None
+    return match.group(1).decode('ascii', 'replace').strip()
+
+
+# Read the start of a file. Returns None if the file can't be read.
+def read_file_head(filepath):
+    try:
+        with open(filepath, 'rb') as f:
+            return f.read(file_head_size)
+    except OSError:
+        return None
+
+
+# Find the file of every layer in a list of filenames. 'filetypes' is the definition of the layers in GrbDiff.py.
+# The patterns are tried in the order of the layers and for every layer in the order of its patterns. A file that has
+# been found for one layer is not used for any of the following layers.
+# If 'read_head' is given, it's called with a filename to get the start of the file. Files with a Gerber X2 file
+# function attribute that matches a layer are then used for that layer, and are not matched by filename.
+# Returns a list with the filename of every layer, or None for the layers that weren't found.
+def classify_files(filelist, filetypes, read_head=None):
+    import fnmatch
+
+    normcase = os.path.normcase  # Like fnmatch.fnmatch()
+
+    # Compile the patterns once. Patterns like "*.gtl" are looked up by the extensions of the filename, and all
+    # other patterns are compiled to regular expressions.
+    suffix_patterns = {}
+    other_patterns = []
+    other_regexes = []
+    for layer, value in enumerate(filetypes):
+        for pattern_index, pattern in enumerate(value[1]):
+            pattern = normcase(pattern)
+            if (pattern.startswith('*.') and not any(c in pattern[1:] for c in '*?[')):
+                suffix_patterns.setdefault(pattern[1:], []).append((layer, pattern_index))
+            else:
+                other_regexes.append(fnmatch.translate(pattern))
+                other_patterns.append((re.compile(other_regexes[-1]).match, layer, pattern_index))
+    # Most files don't match any of the other patterns, which is checked with a single regular expression first
+    any_other_pattern = re.compile('|'.join(other_regexes) or '(?!)').match
+    dismiss_patterns = [re.compile(fnmatch.translate(normcase(value[2]))).match for value in filetypes]
+
+    # Find the files that match every pattern of every layer, in one pass over the files
+    candidates = {}
+    for file_index, f in enumerate(filelist):
+        name = normcase(f)
+        position = name.find('.')
+        while position >= 0:
+            for key in suffix_patterns.get(name[position:], ()):
+                candidates.setdefault(key, []).append(file_index)
+            position = name.find('.', position + 1)
+        if any_other_pattern(name):
+            for (match, layer, pattern_index) in other_patterns:
+                if match(name):
+                    candidates.setdefault((layer, pattern_index), []).append(file_index)
+
+    layer_files = [None] * len(filetypes)
+    taken = set()
+
+    # Use the file function attributes of the files that may be gerber files
+    if read_head is not None:
+        sniff = set(file_index for files in candidates.values() for file_index in files)
+        sniff.update(file_index for file_index, f in enumerate(filelist) if normcase(f).endswith(x2_extensions))
+        for file_index in sorted(sniff):
+            try:
+                head = read_head(filelist[file_index])
+            except Exception as e:
+                print("Unable to read", filelist[file_index], "Error:", e)
+                head = None
+            function = file_function(head) if head else None
+            if function is None:
+                continue
+            for layer, value in enumerate(filetypes):
+                if (len(value) > 3 and any(fnmatch.fnmatchcase(function, pattern) for pattern in value[3])):
+                    print("File function of", filelist[file_index], "is", function)
+                    taken.add(file_index)
+                    if layer_files[layer] is None:
+                        layer_files[layer] = filelist[file_index]
+                    break
+
+    for layer, value in enumerate(filetypes):
+        if layer_files[layer] is not None:
+            continue
+        for pattern_index in range(len(value[1])):
+            for file_index in candidates.get((layer, pattern_index), ()):
+                if (file_index not in taken and not dismiss_patterns[layer](normcase(filelist[file_index]))):
+                    # Remove file from the files left so it won't be found again on other layers.
+                    taken.add(file_index)
+                    layer_files[layer] = filelist[file_index]
+                    break
+            if layer_files[layer] is not None:
+                break
+    return layer_files
+
+
+# Find the file of every layer in a zip archive (see classify_files()). 'members' is the list of files in the archive
+# (see zip_members()). The archive is only opened once to read the start of the files.
+def classify_zip_files(zip_filepath, members, filetypes):
+    from zipfile import ZipFile
+
+    with ZipFile(zip_filepath) as zipObj:
+        def read_head(filename):
+            with zipObj.open(members[filename]) as f:
+                return f.read(file_head_size)
+
+        return classify_files(list(members), filetypes, read_head)
+
+
+# Lock for extracting files from zip archives
+zip_lock = threading.Lock()
+
+
+# Read the list of files in a zip archive without extracting anything. Files in folders in the archive are used as if
+# they were in the root of the archive. Files with the same name in different folders are named by their path in the
+# archive instead, with the folders joined by "_", so that none of them is hidden by another.
+# Returns a dict with the name of the member in the archive for every filename.
+def zip_members(zip_filepath):
+    from zipfile import ZipFile
+
+    with ZipFile(zip_filepath) as zipObj:
+        paths = [zip_info.filename for zip_info in zipObj.infolist() if not zip_info.is_dir()]
+    count = {}
+    for member in paths:
+        count[os.path.basename(member)] = count.get(os.path.basename(member), 0) + 1
+    members = {}
+    for member in paths:
+        filename = os.path.basename(member)
+        if count[filename] > 1:
+            filename = member.strip("/").replace("/", "_")
+            while filename in count or filename in members:
+                filename = "_" + filename
+            print("More than one file is named", os.path.basename(member), "in", zip_filepath + ".", member,
+                  "is named", filename)
+        members[filename] = member
+    return members
+
+
+# Read the lists of files of several zip archives at the same time. Returns the list of files of every zip archive
+# (see zip_members()), or None for the paths that aren't zip archives.
+def read_zip_members(filepaths):
+    def read(filepath):
+        if filepath.endswith(".zip"):
+            return zip_members(filepath)
+        return None
+
+    with ThreadPoolExecutor(max_workers=max(1, len(filepaths))) as executor:
+        return list(executor.map(read, filepaths))
+
+
+# Extract one file from a zip archive to target_dir, unless it has already been extracted. The file is named
+# 'filename' (its name in zip_members()), or the name of the member if it isn't given. Returns the path of the
+# extracted file.
+def extract_zip_member(zip_filepath, member, target_dir, filename=None):
+    from zipfile import ZipFile
+
+    filepath = os.path.join(target_dir, filename or os.path.basename(member))
+    with zip_lock:
+        if not os.path.exists(filepath):
+            print("Extracting", member, "from", zip_filepath)
+            with ZipFile(zip_filepath) as zipObj:
+                with zipObj.open(member) as source, open(filepath + ".tmp", 'wb') as f:
+                    shutil.copyfileobj(source, f)
+            os.replace(filepath + ".tmp", filepath)
+    return filepath
+
+
+# Open the gerber files of a board without the GUI, the same way as GrbDiff does when a gerber file or a zip archive
+# is selected. 'path' is a zip archive, a directory or a gerber file in a directory. Only the files of a zip archive
+# that are used by a layer are extracted, to a new temporary directory.
+# Returns a dict with the 'path', the path of the file of every layer in 'filetypes' ('filepaths', None for layers that
+# don't have a file) and the temporary directory ('temp_dir', or None), which should be removed when the files aren't
+# used anymore.
+def open_gerber_set(path, filetypes):
+    import tempfile
+
+    if path.endswith(".zip"):
+        members = zip_members(path)
+        layer_files = classify_zip_files(path, members, filetypes)
+        temp_dir = tempfile.mkdtemp(prefix="GrbDiff-Zip-")
+        try:
+            filepaths = [None if filename is None else extract_zip_member(path, members[filename], temp_dir, filename)
+                         for filename in layer_files]
+        except Exception:
+            remove_dir_later(temp_dir)
+            raise
+        return {'path': path, 'filepaths': filepaths, 'temp_dir': temp_dir}
+    directory = path if os.path.isdir(path) else os.path.dirname(path)
+    filelist = [f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f))]
+    layer_files = classify_files(filelist, filetypes, lambda f: read_file_head(os.path.join(directory, f)))
+    filepaths = [None if filename is None else os.path.join(directory, filename) for filename in layer_files]
+    return {'path': path, 'filepaths': filepaths, 'temp_dir': None}
+
+
+# Get a signature of a file, or of the files in a directory, which changes when any of the files is written, added or
+# removed. It's made from the size and modification time of the files, so the files don't have to be read.
+def path_signature(path):
+    if not os.path.isdir(path):
+        stat = os.stat(path)
+        return (stat.st_size, stat.st_mtime_ns)
+    files = []
+    for entry in sorted(os.scandir(path), key=lambda entry: entry.name):
+        if entry.is_file():
+            stat = entry.stat()
+            files.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    return tuple(files)
+
+
+# Remove a directory on a background thread, so that nothing has to wait for it.
+def remove_dir_later(path):
+    threading.Thread(target=shutil.rmtree, args=(path, True), daemon=True).start()
+
+
+# Default number of workers used for the png export.
+def default_workers():
+    return os.cpu_count() or 1
+
+
+# Get the memory used by this process as (resident set size, peak resident set size) in bytes. Either may be None if
+# it isn't known on this platform.
+def memory_usage():
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize, counters.PeakWorkingSetSize
+        return None, None
+    try:
+        values = {}
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    values[line[:5]] = int(line.split()[1])*1024
+        return values.get('VmRSS'), values.get('VmHWM')
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return None, peak if sys.platform == 'darwin' else peak*1024
+    except (ImportError, OSError):
+        return None, None
+
+
+# Get the memory that can be used without swapping in bytes, or None if it isn't known on this platform
+def available_memory():
+    if sys.platform == 'win32':
+        import ctypes
+
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(status)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullAvailPhys
+        return None
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1])*1024
+    except (OSError, ValueError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES')*os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+# Time in seconds between the samples of the memory usage while an export is profiled
+profile_sample_interval = 0.01
+
+
+# Start profiling an export. Every stage of every layer (see profile_stage()) is written as a line of JSON to
+# 'filepath' as soon as it's done, so the file is useful even if the export crashes or runs out of memory.
+# The memory usage is sampled on a background thread, to find the peak while every stage runs. The memory usage is
+# that of the whole process, so with more than one worker the stages that run at the same time share their peaks.
+# Returns the profile, which is passed to the functions of the export. Use layer_profile() to tell which layer the
+# stages belong to, and finish_profile() when the export is done.
+def new_profile(filepath):
+    profile = {'filepath': filepath, 'file': open(filepath, 'w'), 'lock': threading.Lock(), 'records': [],
+               'active': {}, 'stop': threading.Event(), 'started': time.perf_counter(), 'layer': None}
+
+    def sample():
+        while not profile['stop'].wait(profile_sample_interval):
+            rss = memory_usage()[0]
+            if rss is None:
+                return
+            with profile['lock']:
+                for peak in profile['active'].values():
+                    peak[0] = max(peak[0], rss)
+
+    threading.Thread(target=sample, daemon=True).start()
+    print("Profiling the export to", filepath)
+    return profile
+
+
+# Get a profile for the stages of a layer. 'profile' may be None when the export isn't profiled.
+def layer_profile(profile, layer):
+    if profile is None:
+        return None
+    return dict(profile, layer=layer)
+
+
+# Measure the wall time and the peak memory usage of a stage of a layer, like a GerbV render or the SSIM, and write it
+# to the profile. 'info' is written with it, and more can be added to the dict that is returned, like the size of an
+# image. Nothing is measured if 'profile' is None.
+@contextlib.contextmanager
+def profile_stage(profile, stage, **info):
+    if profile is None:
+        yield info
+        return
+    rss = memory_usage()[0]
+    peak = [rss or 0]
+    with profile['lock']:
+        profile['active'][id(peak)] = peak
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        seconds = time.perf_counter() - start
+        rss = memory_usage()[0]
+        with profile['lock']:
+            del profile['active'][id(peak)]
+            record = {'layer': profile['layer'], 'stage': stage, 'seconds': round(seconds, 6),
+                      'start': round(start - profile['started'], 6), 'thread': threading.current_thread().name,
+                      'rss_mb': None if rss is None else round(rss/1048576.0, 1),
+                      'peak_rss_mb': None if rss is None else round(max(peak[0], rss)/1048576.0, 1)}
+            record.update(info)
+            profile['records'].append(record)
+            profile['file'].write(json.dumps(record) + "\n")
+            profile['file'].flush()
+
+
+# Make a table of the time spent in every stage of every layer of a profile, with the peak memory usage of every
+# layer, so it's easy to see which layer and which stage dominates.
+def profile_summary(records, wall_seconds):
+    layers = []
+    stages = []
+    times = {}
+    peaks = {}
+    for record in records:
+        layer = str(record['layer'])
+        if layer not in layers:
+            layers.append(layer)
+        if record['stage'] not in stages:
+            stages.append(record['stage'])
+        key = (layer, record['stage'])
+        times[key] = times.get(key, 0.0) + record['seconds']
+        if record['peak_rss_mb'] is not None:
+            peaks[layer] = max(peaks.get(layer, 0.0), record['peak_rss_mb'])
+    width = max([len("Total")] + [len(layer) for layer in layers])
+    columns = [max(len(stage), 8) for stage in stages]
+    lines = [" ".join([format("Layer", str(width))] + [format(stage, '>' + str(column))
+                                                       for stage, column in zip(stages, columns)] +
+                      [format("Sum", '>9'), format("Peak MB", '>9')])]
+    for layer in layers + ["Total"]:
+        row = []
+        for stage, column in zip(stages, columns):
+            if layer == "Total":
+                value = sum(times.get((name, stage), 0.0) for name in layers)
+            else:
+                value = times.get((layer, stage))
+            row.append(format("" if value is None else format(value, '.3f'), '>' + str(column)))
+        layer_sum = sum(value for (name, stage), value in times.items() if layer in (name, "Total"))
+        peak = max(peaks.values()) if layer == "Total" and peaks else peaks.get(layer)
+        lines.append(" ".join([format(layer, str(width))] + row + [format(layer_sum, '>9.3f'),
+                                                                   format("" if peak is None else format(peak, '.1f'),
+                                                                          '>9')]))
+    lines.append("Wall time of the export: " + format(wall_seconds, '.3f') + " s. The sums include stages that ran at "
+                 "the same time on different workers.")
+    return "\n".join(lines)
+
+
+# Stop profiling an export, write the summary to the profile as the last line and print it
+def finish_profile(profile):
+    if profile is None:
+        return
+    profile['stop'].set()
+    wall_seconds = time.perf_counter() - profile['started']
+    (rss, peak) = memory_usage()
+    with profile['lock']:
+        summary = profile_summary(profile['records'], wall_seconds)
+        layers = {}
+        for record in profile['records']:
+            stages = layers.setdefault(str(record['layer']), {})
+            stages[record['stage']] = round(stages.get(record['stage'], 0.0) + record['seconds'], 6)
+        profile['file'].write(json.dumps({'summary': layers, 'wall_seconds': round(wall_seconds, 6),
+                                          'process_peak_rss_mb': None if peak is None else round(peak/1048576.0, 1)})
+                              + "\n")
+        profile['file'].close()
+    print("Profile of the export:")
+    print(summary)
+
+
+# Build the list of arguments for GerbV to export some gerber files to a png image.
+# The colors are given in the same order as the files. If a frame (left, bottom, width, height) is given, only that
+# part of the board is exported (see gerber.image_frame()).
+def gerbv_export_args(gerbv, files, colors, bg_color, dpi, export_filepath, frame=None):
+    process_args = [gerbv, "-a", "--background="+bg_color]
+    for color in colors:
+        process_args.append("--foreground="+color)
+    for filepath in files:
+        process_args.append(filepath)
+    process_args.append("--export=png")
+    process_args.append("--dpi="+str(dpi))
+    if frame is not None:
+        (left, bottom, width, height) = frame
+        process_args.append("--origin="+format(left, '.6f')+"x"+format(bottom, '.6f'))
+        process_args.append("--window_inch="+format(width/float(dpi), '.6f')+"x"+format(height/float(dpi), '.6f'))
+    process_args.append("-o" + export_filepath)
+    return process_args
+
+
+# Raised when an export is cancelled
+class Cancelled(Exception):
+    pass
+
+
+# Raise Cancelled if 'cancel' (a threading.Event or None) is set
+def check_cancelled(cancel):
+    if cancel is not None and cancel.is_set():
+        raise Cancelled("Cancelled")
+
+
+# Run GerbV and wait for it to finish. If 'cancel' (a threading.Event) is set while GerbV is running, GerbV is killed
+# and Cancelled is raised.
+def run_gerbv(process_args, cancel=None):
+    check_cancelled(cancel)
+    print("Starting GerbV with these args:", process_args)
+    process = subprocess.Popen(process_args, stdin=None, stdout=None, stderr=None)
+    while True:
+        try:
+            returncode = process.wait(timeout=0.1)
+            break
+        except subprocess.TimeoutExpired:
+            if cancel is not None and cancel.is_set():
+                print("Killing GerbV, since the export is cancelled")
+                process.kill()
+                process.wait()
+                raise Cancelled("Cancelled")
+    print("GerbV process exited with code:", returncode)
+    return returncode
+
+
+# Default size in MB of the render cache
+default_render_cache_size = 1024
+
+# Lock for changing the files in the render cache
+render_cache_lock = threading.Lock()
+
+
+# Get the SHA-256 of the contents of a file. 'digests' is a dict of already computed digests by path, so that files
+# that are used in several renders of the same export are only read once.
+def file_digest(filepath, digests):
+    digest = digests.get(filepath)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024*1024), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        digests[filepath] = digest
+    return digest
+
+
+# Number of fingerprints of files (see gerber.fingerprint_file()) that are kept by the digest of the file, so that
+# files that are compared again, like in watch mode, don't have to be read again
+fingerprint_cache_size = 4096
+
+# Fingerprints by the digest of the file, and the lock for changing them
+fingerprint_cache = OrderedDict()
+fingerprint_cache_lock = threading.Lock()
+
+
+# Get the fingerprint of a file (see gerber.fingerprint_file()). 'digests' is a dict of already computed digests by
+# path (see file_digest()).
+def file_fingerprint(filepath, digests):
+    import gerber
+
+    digest = file_digest(filepath, digests)
+    with fingerprint_cache_lock:
+        fingerprint = fingerprint_cache.get(digest)
+        if fingerprint is not None:
+            fingerprint_cache.move_to_end(digest)
+            return fingerprint
+    fingerprint = gerber.fingerprint_file(filepath)
+    with fingerprint_cache_lock:
+        fingerprint_cache[digest] = fingerprint
+        while len(fingerprint_cache) > fingerprint_cache_size:
+            fingerprint_cache.popitem(last=False)
+    return fingerprint
+
+
+# Find out if two renders (see render_images()) would have the same image, apart from the colors, without rendering
+# them: every file must have the same contents or the same fingerprint (see file_fingerprint()) as the file in the
+# same place of the other render. The digests of all files are compared first, since they take milliseconds and a
+# fingerprint takes about 0.6 s per 2 MB. Only the files that differ byte by byte are fingerprinted, the smallest
+# first, so that a change in a small file is found before a large file is read.
+# Raises OSError if a file can't be read.
+def identical_renders(render1, render2, digests):
+    if len(render1['files']) != len(render2['files']) or str(render1['dpi']) != str(render2['dpi']):
+        return False
+    changed = [(file1, file2) for file1, file2 in zip(render1['files'], render2['files'])
+               if file_digest(file1, digests) != file_digest(file2, digests)]
+    changed.sort(key=lambda files: os.path.getsize(files[0]) + os.path.getsize(files[1]))
+    for file1, file2 in changed:
+        if file_fingerprint(file1, digests) != file_fingerprint(file2, digests):
+            return False
+    return True
+
+
+# Get the key of a render in the render cache. The key is made from the contents of the files (the layer and the
+# outline), the colors, the background color, the dpi and the renderer, so renders are reused even if the files have
+# been moved or renamed. Renders of a part of the board also have their frame in the key.
+# Raises OSError if a file can't be read.
+def render_cache_key(renderer, render, digests):
+    contents = [renderer, render['bg_color'], list(render['colors']), str(render['dpi']),
+                [file_digest(filepath, digests) for filepath in render['files']]]
+    if render.get('frame') is not None:
+        contents.append([round(value, 6) for value in render['frame']])
+    return hashlib.sha256(json.dumps(contents).encode('utf-8')).hexdigest()
+
+
+# Get the path of a render in the render cache. 'cache' is a tuple of the cache directory and its maximum size in MB.
+def render_cache_path(cache, key):
+    return os.path.join(cache[0], key + ".png")
+
+
+# Copy a render from the render cache to export_filepath. Returns False if the render isn't in the cache.
+def render_cache_fetch(cache, key, export_filepath):
+    cache_filepath = render_cache_path(cache, key)
+    with render_cache_lock:
+        try:
+            shutil.copyfile(cache_filepath, export_filepath)
+            # The modification time tells when the render was last used
+            os.utime(cache_filepath)
+        except OSError:
+            return False
+    print("Using cached render of", export_filepath)
+    return True
+
+
+# Load a render from the render cache as an image. Returns None if the render isn't in the cache.
+def render_cache_load(cache, key):
+    import cv2  # opencv-python
+
+    cache_filepath = render_cache_path(cache, key)
+    with render_cache_lock:
+        if not os.path.isfile(cache_filepath):
+            return None
+        image = cv2.imread(cache_filepath)
+        if image is not None:
+            os.utime(cache_filepath)
+    return image
+
+
+# Add a render to the render cache, either from the png file at filepath or from an image. The least recently used
+# renders are then removed until the cache is not larger than its maximum size.
+def render_cache_store(cache, key, filepath=None, image=None):
+    import cv2  # opencv-python
+
+    (cache_dir, max_size) = cache
+    cache_filepath = render_cache_path(cache, key)
+    # Write to a temporary file first, so that other workers and processes never see a partly written render
+    temp_filepath = cache_filepath + "." + str(os.getpid()) + "-" + str(threading.get_ident()) + ".tmp.png"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        if image is None:
+            shutil.copyfile(filepath, temp_filepath)
+        elif not cv2.imwrite(temp_filepath, image):
+            raise OSError("Unable to write " + temp_filepath)
+        with render_cache_lock:
+            os.replace(temp_filepath, cache_filepath)
+            entries = [entry for entry in os.scandir(cache_dir) if entry.name.endswith(".png")
+                       and not entry.name.endswith(".tmp.png") and entry.is_file()]
+            entries = sorted(((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries),
+                             reverse=True)
+            size = 0
+            for (mtime, entry_size, path) in entries:
+                size = size + entry_size
+                if size > max_size*1024*1024 and path != cache_filepath:
+                    print("Removing", path, "from the render cache")
+                    os.remove(path)
+    except OSError as e:
+        print("Unable to add", cache_filepath, "to the render cache. Error:", e)
+        if os.path.exists(temp_filepath):
+            os.remove(temp_filepath)
+
+
+# Default size in MB of the memory cache (see new_memory_cache())
+default_memory_cache_size = 512
+
+# Estimated size in bytes of a parsed object in the memory cache
+parsed_object_size = 256
+
+
+# Create a cache in memory of rendered images and parsed files, for when many exports are run by the same process, like
+# in the diff service (see grbservice.py). Images are kept by the same key as in the render cache, and parsed files by
+# the digest of their contents. When the cache grows larger than 'max_size' MB the least recently used entries are
+# removed. The cache may be used by several exports at the same time.
+def new_memory_cache(max_size=default_memory_cache_size):
+    return {'entries': OrderedDict(), 'size': 0, 'max_size': int(float(max_size)*1024*1024), 'lock': threading.Lock(),
+            'hits': 0, 'misses': 0}
+
+
+# Get an entry from the memory cache, or None if it isn't there
+def memory_cache_load(memory, key):
+    with memory['lock']:
+        entry = memory['entries'].get(key)
+        if entry is None:
+            memory['misses'] += 1
+            return None
+        memory['entries'].move_to_end(key)
+        memory['hits'] += 1
+        return entry[0]
+
+
+# Add an entry of 'size' bytes to the memory cache. The value must not be changed after it has been added.
+def memory_cache_store(memory, key, value, size):
+    with memory['lock']:
+        old = memory['entries'].pop(key, None)
+        if old is not None:
+            memory['size'] -= old[1]
+        if size > memory['max_size']:
+            return
+        memory['entries'][key] = (value, size)
+        memory['size'] += size
+        while memory['size'] > memory['max_size']:
+            (old_key, old) = memory['entries'].popitem(last=False)
+            memory['size'] -= old[1]
+
+
+# Get the number of entries, the size in MB, the number of hits and misses of the memory cache
+def memory_cache_stats(memory):
+    with memory['lock']:
+        return {'entries': len(memory['entries']), 'size_mb': round(memory['size']/1048576.0, 1),
+                'max_size_mb': round(memory['max_size']/1048576.0, 1), 'hits': memory['hits'],
+                'misses': memory['misses']}
+
+
+# Default size in pixels of the tiles used when computing the SSIM
+default_ssim_tile_size = 1024
+
+
+# Compute the Structural Similarity Index (SSIM) between two grayscale images one tile at a time.
+# structural_similarity() allocates a number of float64 arrays of the same size as the images, which is what makes
+# the export run out of memory at high DPI. Here these arrays are never larger than one tile. The tiles overlap by
+# half the SSIM window, so every pixel sees the same window as when the whole image is computed at once, but the sums
+# are rounded differently. The cast to uint8 truncates, so a pixel of the difference image can come out 1 lower (like
+# 254 instead of 255) than when the whole image is computed at once.
+# Returns the mean SSIM and the SSIM image scaled to 0-255 as uint8.
+def tiled_structural_similarity(grayA, grayB, tile_size=default_ssim_tile_size):
+    from skimage.metrics import structural_similarity  # scikit-image
+    import numpy as np
+
+    win_size = 7  # Default window size of structural_similarity()
+    pad = (win_size - 1) // 2
+    height, width = grayA.shape
+    tile_size = max(int(tile_size), win_size)
+
+    diff = np.empty((height, width), dtype=np.uint8)
+    ssim_sum = 0.0
+    for y0 in range(0, height, tile_size):
+        y1 = min(y0 + tile_size, height)
+        ty1 = min(y1 + pad, height)
+        ty0 = max(0, min(y0 - pad, ty1 - win_size))
+        for x0 in range(0, width, tile_size):
+            x1 = min(x0 + tile_size, width)
+            tx1 = min(x1 + pad, width)
+            tx0 = max(0, min(x0 - pad, tx1 - win_size))
+
+            S = structural_similarity(grayA[ty0:ty1, tx0:tx1], grayB[ty0:ty1, tx0:tx1], full=True)[1]
+            # Negative values wrap around when cast to uint8, the same way as when the whole image is cast at once
+            diff[y0:y1, x0:x1] = (S[y0-ty0:y1-ty0, x0-tx0:x1-tx0] * 255).astype(np.int64).astype("uint8")
+
+            # The mean SSIM doesn't include the border of the image
+            sy0, sy1 = max(y0, pad), min(y1, height - pad)
+            sx0, sx1 = max(x0, pad), min(x1, width - pad)
+            if (sy1 > sy0 and sx1 > sx0):
+                ssim_sum = ssim_sum + S[sy0-ty0:sy1-ty0, sx0-tx0:sx1-tx0].sum(dtype=np.float64)
+
+    score = ssim_sum / ((height - 2*pad) * (width - 2*pad))
+    return score, diff
+
+
+# Load an image as grayscale, converted the same way as a color image would be with cv2.cvtColor().
+# The reading and the conversion are measured as stages of 'profile' (see profile_stage()).
+def read_gray_image(img, profile=None):
+    import cv2  # opencv-python
+
+    with profile_stage(profile, 'imread', image=img) as info:
+        image = cv2.imread(img)
+        if image is not None:
+            info['height'], info['width'] = image.shape[:2]
+    with profile_stage(profile, 'gray'):
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+# Ways of finding the differences between the images of a layer: the SSIM of the grayscale images, which tolerates
+# small differences in how the edges are rendered, or an exact comparison of every pixel of 1-bit bitplanes (see
+# grbbitplane.pack_bitplane()), which is much faster and needs much less memory
+diff_modes = ['ssim', 'exact']
+
+
+# Read an image, or use the image that is given, and pack it to a bitplane with the 'background' color (see
+# grbbitplane.pack_bitplane()). Returns the bitplane and the width of the image.
+def read_bitplane(img, image=None, profile=None, background=None):
+    import cv2  # opencv-python
+
+    if image is None:
+        with profile_stage(profile, 'imread', image=img) as info:
+            image = cv2.imread(img)
+            if image is None:
+                raise ValueError("Unable to read " + img)
+            info['height'], info['width'] = image.shape[:2]
+    with profile_stage(profile, 'pack', width=image.shape[1], height=image.shape[0]):
+        return grbbitplane.pack_bitplane(image, background), image.shape[1]
+
+
+# Find the change regions (see change_regions()) of the XOR of two bitplanes, where the set bits are the pixels that
+# differ. Only the rows that have changed pixels are unpacked, a strip at a time (see strip_change_regions()), in bands
+# that are so far apart that no region can reach from one band to the next.
+# Returns the regions and the number of changed pixels.
+def bitplane_regions(xor, width, distance):
+    import math
+    import numpy as np
+
+    counts = grbbitplane.popcount_rows(xor)
+    rows = np.flatnonzero(counts)
+    if len(rows) == 0:
+        return [], 0
+    # Changed pixels that are more than 2*radius + 1 rows apart are never merged by change_regions()
+    radius = max(0, int(math.ceil(distance/2.0)))
+    breaks = np.flatnonzero(np.diff(rows) > 2*radius + 1)
+    regions = []
+    for start, end in zip(np.concatenate(([0], breaks + 1)), np.append(breaks, len(rows) - 1)):
+        (y0, y1) = (int(rows[start]), int(rows[end]) + 1)
+        band = strip_change_regions(lambda a, b: grbbitplane.unpack_bitplane(xor[y0 + a:y0 + b], width), y1 - y0,
+                                    width, distance)
+        regions.extend((x, y + y0, w, h, pixels) for (x, y, w, h, pixels) in band)
+    return regions, int(counts.sum())
+
+
+# Threshold of a grayscale image with Otsu's method from the histogram of the image (256 counts), computed the same way
+# as cv2.threshold() does with THRESH_OTSU, so that the histogram can be counted a strip at a time
+def otsu_threshold(histogram):
+    total = float(sum(histogram))
+    mu = sum(i*float(count) for i, count in enumerate(histogram))/total
+    epsilon = 1.1920928955078125e-07  # FLT_EPSILON
+    (mu1, q1, max_sigma, level) = (0.0, 0.0, 0.0, 0)
+    for i, count in enumerate(histogram):
+        p_i = float(count)/total
+        mu1 *= q1
+        q1 += p_i
+        q2 = 1.0 - q1
+        if min(q1, q2) < epsilon or max(q1, q2) > 1.0 - epsilon:
+            continue
+        mu1 = (mu1 + i*p_i)/q1
+        mu2 = (mu - q1*mu1)/q2
+        sigma = q1*q2*(mu1 - mu2)*(mu1 - mu2)
+        if sigma > max_sigma:
+            (max_sigma, level) = (sigma, i)
+    return level
+
+
+# Count the pixels of every gray value of a grayscale image, a strip at a time
+def image_histogram(gray):
+    import numpy as np
+
+    histogram = np.zeros(256, dtype=np.int64)
+    rows = max(1, change_strip_pixels // max(1, gray.shape[1]))
+    for y0 in range(0, gray.shape[0], rows):
+        histogram += np.bincount(gray[y0:y0 + rows].ravel(), minlength=256)
+    return [int(count) for count in histogram]
+
+
+# Default distance in mm within which changed pixels are merged into the same change region
+default_change_merge_distance = 0.5
+
+
+# Largest number of pixels in a strip of rows when finding the change regions (see strip_change_regions())
+change_strip_pixels = 1 << 22
+
+
+# Merge the changed pixels of a thresholded difference image (non-zero where the images differ) into change regions,
+# so that pixels that are at most 'distance' pixels apart end up in the same region. The changed pixels are dilated by
+# half the distance and the regions are the connected components of the result.
+# Returns a list of regions as (x, y, width, height, number of changed pixels), where the box is tight around the
+# changed pixels of the region. The regions are in the order of their first changed pixel, row by row.
+def change_regions(thresh, distance):
+    return strip_change_regions(lambda y0, y1: thresh[y0:y1], thresh.shape[0], thresh.shape[1], distance)
+
+
+# Find the change regions (see change_regions()) of a thresholded difference image of (height, width) a strip of rows
+# at a time, so that the dilated image and the labels of the connected components are never larger than a strip.
+# read_rows(y0, y1) returns rows y0 to y1 of the thresholded image. Every strip is read with the rows above and below
+# it that the dilation reaches, and the components that touch at the seams between the strips are merged.
+def strip_change_regions(read_rows, height, width, distance, strip_pixels=None):
+    import math
+    import numpy as np
+    import cv2  # opencv-python
+
+    radius = max(0, int(math.ceil(distance/2.0)))
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2*radius + 1, 2*radius + 1))
+    strip_rows = max(1, (strip_pixels or change_strip_pixels) // max(1, width))
+    parent = [0]  # Union-find of the labels of all strips, where label 0 is the background
+    stats = []  # (label, left, top, right, bottom, pixels, first) of the changed pixels of a label in a strip
+    last_row = None
+    for y0 in range(0, height, strip_rows):
+        y1 = min(y0 + strip_rows, height)
+        (r0, r1) = (max(0, y0 - radius), min(height, y1 + radius))
+        rows = np.ascontiguousarray(read_rows(r0, r1), dtype=np.uint8)
+        merged = cv2.dilate(rows, kernel)[y0 - r0:y1 - r0] if radius > 0 else rows
+        (count, labels) = cv2.connectedComponents(merged, connectivity=8, ltype=cv2.CV_32S)
+        del merged
+        # The labels of the strip follow the labels of the strips above it
+        offset = len(parent) - 1
+        labels[labels > 0] += offset
+        parent.extend(range(offset + 1, offset + count))
+        if last_row is not None:
+            # Merge the labels that touch across the seam, with 8-connectivity
+            first_row = labels[0]
+            pairs = set()
+            for dx in (-1, 0, 1):
+                (a, b) = (first_row[max(0, dx):width + min(0, dx)], last_row[max(0, -dx):width + min(0, -dx)])
+                touching = (a > 0) & (b > 0)
+                pairs.update(zip(a[touching].tolist(), b[touching].tolist()))
+            for (a, b) in pairs:
+                (a, b) = (find_label(parent, a), find_label(parent, b))
+                if a != b:
+                    parent[max(a, b)] = min(a, b)
+        last_row = labels[-1].copy()
+        ys, xs = np.nonzero(rows[y0 - r0:y1 - r0])
+        del rows
+        if len(xs) > 0:
+            regions = labels[ys, xs]
+            ys = ys + y0
+            order = np.argsort(regions, kind='stable')
+            regions, xs, ys = regions[order], xs[order], ys[order]
+            starts = np.flatnonzero(np.concatenate(([True], regions[1:] != regions[:-1])))
+            stats.append(np.stack([regions[starts], np.minimum.reduceat(xs, starts), np.minimum.reduceat(ys, starts),
+                                   np.maximum.reduceat(xs, starts), np.maximum.reduceat(ys, starts),
+                                   np.diff(np.append(starts, len(regions))),
+                                   ys[starts].astype(np.int64)*width + xs[starts]], axis=1).astype(np.int64))
+        del labels
+    if not stats:
+        return []
+    # Group the changed pixels of every strip by the region their label ends up in
+    stats = np.concatenate(stats)
+    roots = np.array(parent, dtype=np.int64)
+    while True:
+        parents = roots[roots]
+        if np.array_equal(parents, roots):
+            break
+        roots = parents
+    regions = roots[stats[:, 0]]
+    order = np.argsort(regions, kind='stable')
+    (regions, stats) = (regions[order], stats[order])
+    starts = np.flatnonzero(np.concatenate(([True], regions[1:] != regions[:-1])))
+    (left, top) = (np.minimum.reduceat(stats[:, 1], starts), np.minimum.reduceat(stats[:, 2], starts))
+    (right, bottom) = (np.maximum.reduceat(stats[:, 3], starts), np.maximum.reduceat(stats[:, 4], starts))
+    pixels = np.add.reduceat(stats[:, 5], starts)
+    first = np.minimum.reduceat(stats[:, 6], starts)
+    return [(int(left[i]), int(top[i]), int(right[i] - left[i] + 1), int(bottom[i] - top[i] + 1), int(pixels[i]))
+            for i in np.argsort(first, kind='stable')]
+
+
+# Find the label that a label is merged into in the union-find 'parent' of strip_change_regions()
+def find_label(parent, label):
+    root = label
+    while parent[root] != root:
+        root = parent[root]
+    while parent[label] != root:
+        (parent[label], label) = (root, parent[label])
+    return root
+
+
+# Get the change report of a layer. The change regions (see change_regions()) are converted to board coordinates in
+# mm with the frame of image 1 (see gerber.image_frame()), which is moved by offset1 in the images with the
+# differences marked. Without a frame, only the pixel coordinates of the regions are known.
+# 'score' is the SSIM of the images, or None if they couldn't be compared. 'mode' is the diff mode (see diff_modes),
+# and the SSIM isn't known with an exact diff.
+def change_report(report, result, score, regions, offset1=(0, 0), translation=(0.0, 0.0), mode='ssim'):
+    dpi = float(report['dpi'])
+    mm_per_pixel = 25.4/dpi
+    frame = report.get('frame')
+    entries = []
+    for (x, y, w, h, pixels) in regions:
+        entry = {'pixels': [x, y, w, h], 'changed_area_mm2': round(pixels*mm_per_pixel*mm_per_pixel, 4),
+                 'bounds_mm': None}
+        if frame is not None:
+            (left, bottom, width, height) = frame
+            top = bottom + height/dpi
+            entry['bounds_mm'] = [round((left + (x - offset1[0])/dpi)*25.4, 4),
+                                  round((top - (y + h - offset1[1])/dpi)*25.4, 4),
+                                  round((left + (x + w - offset1[0])/dpi)*25.4, 4),
+                                  round((top - (y - offset1[1])/dpi)*25.4, 4)]
+        entries.append(entry)
+    content = {
+        'result': result,
+        'ssim': score if mode == 'ssim' else None,
+        'compared': score is not None,
+        'diff_mode': mode,
+        'dpi': dpi,
+        'merge_distance_mm': report.get('merge_distance', default_change_merge_distance),
+        'translation_px': [round(0.0 - translation[0], 2), round(0.0 - translation[1], 2)],
+        'changed_pixels': sum(pixels for (x, y, w, h, pixels) in regions),
+        'changed_area_mm2': round(sum(entry['changed_area_mm2'] for entry in entries), 4),
+        'regions': entries,
+    }
+    return content
+
+
+# Write a change report (see change_report()) as JSON
+def write_change_report(filepath, content):
+    with open(filepath, 'w') as f:
+        json.dump(content, f, indent=1)
+
+
+# Read a change report that has been written by write_change_report(). Returns None if there is no report.
+def read_change_report(filepath):
+    try:
+        with open(filepath) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Find the differences between image 1 and 2 of a layer and mark them on all three images (img3, the combined image,
+# may be None). The images are read from the files unless they're given in 'images', and the marked images are written
+# back unless 'png' is False. 'report' has the 'dpi', 'merge_distance', 'frame', 'background' and report 'filepath'
+# (see change_report()), and gets the report as 'content'. 'annotated(index, image, regions)' is called as soon as an
+# image is marked. 'mode' is one of diff_modes.
+# Returns the result text for the layer.
+def diff_layer_images(img1, img2, img3, tile_size=default_ssim_tile_size, images=None, report=None, profile=None,
+                      annotated=None, png=True, mode='ssim'):
+    # The code for finding the differences in the images is "borrowed" from Alison Américo:
+    # https://github.com/alisonamerico/image-difference
+    import numpy as np
+    import cv2  # opencv-python
+
+    exact = mode == 'exact'
+    background = None if report is None else report.get('background')
+    # load the two input images as grayscale, or as bitplanes for an exact diff. The color images are only loaded one
+    # at a time when the differences are drawn, to keep the memory usage down.
+    if exact:
+        (planeA, w1) = read_bitplane(img1, None if images is None else images[0], profile, background)
+        (planeB, w2) = read_bitplane(img2, None if images is None else images[1], profile, background)
+        (h1, h2) = (planeA.shape[0], planeB.shape[0])
+    else:
+        if images is None:
+            grayA = read_gray_image(img1, profile)
+            grayB = read_gray_image(img2, profile)
+        else:
+            with profile_stage(profile, 'gray'):
+                grayA = cv2.cvtColor(images[0], cv2.COLOR_BGR2GRAY)
+                grayB = cv2.cvtColor(images[1], cv2.COLOR_BGR2GRAY)
+        h1, w1 = grayA.shape
+        h2, w2 = grayB.shape
+
+    print("Resolution of", img1, "is", w1, "x", h1)
+    print("Resolution of", img2, "is", w2, "x", h2)
+
+    # If the images have different sizes (like when the outline has moved), move them to a common frame
+    registration = None
+    with profile_stage(profile, 'register'):
+        try:
+            if (h1, w1) != (h2, w2) and (report is None or not report.get('aligned')):
+                if exact:
+                    registration = grbregistration.register_bitplanes(planeA, w1, planeB, w2)
+                else:
+                    registration = grbregistration.register_images(grayA, grayB)
+        except Exception as e:
+            print("Unable to line up", img1, "and", img2, "Error:", e)
+    combined_shift = (0, 0)
+    if registration is not None and exact:
+        # Resampling would change the pixels, so the bitplanes are only moved by whole pixels
+        registration = registration[:3] + ((float(round(registration[3][0])), float(round(registration[3][1]))),)
+    if registration is not None:
+        (offset1, offset2, size, (dx, dy)) = registration
+        print("Moving", img2, "by", format(-dx, '.2f'), format(-dy, '.2f'), "pixels to line up with", img1)
+        with profile_stage(profile, 'register'):
+            if exact:
+                planeA = grbbitplane.place_bitplane(planeA, w1, offset1, size)
+                planeB = grbbitplane.place_bitplane(planeB, w2, offset2, size)
+            else:
+                grayA = grbregistration.place_image(grayA, offset1, size)
+                grayB = grbregistration.place_image(grayB, offset2, size, (dx, dy))
+        h1, w1 = h2, w2 = size
+        # The combined image has a frame of its own
+        if img3 is not None:
+            if exact:
+                (planeC, w3) = read_bitplane(img3, None if images is None else images[2], profile, background)
+                with profile_stage(profile, 'register'):
+                    (cx, cy, response) = grbregistration.estimate_bitplane_shift(planeA, w1, planeC, w3)
+                del planeC
+            else:
+                if images is None:
+                    grayC = read_gray_image(img3, profile)
+                else:
+                    with profile_stage(profile, 'gray'):
+                        grayC = cv2.cvtColor(images[2], cv2.COLOR_BGR2GRAY)
+                with profile_stage(profile, 'register'):
+                    (cx, cy, response) = grbregistration.estimate_shift(grayA, grayC)
+                del grayC
+            combined_shift = (int(round(cx)), int(round(cy)))
+
+    if (h1 == h2 and w1 == w2):
+        try:
+            distance = 0
+            if report is not None:
+                distance = float(report.get('merge_distance', default_change_merge_distance))/25.4*float(report['dpi'])
+            if exact:
+                # the pixels that differ are the set bits of the XOR of the bitplanes
+                with profile_stage(profile, 'xor', width=w1, height=h1):
+                    xor = np.bitwise_xor(planeA, planeB)
+                del planeA, planeB
+                with profile_stage(profile, 'regions') as info:
+                    (regions, changed) = bitplane_regions(xor, w1, distance)
+                    info['regions'] = len(regions)
+                del xor
+                score = 1.0 - changed/float(h1*w1)
+                print("Changed pixels:", changed)
+            else:
+                # compute the Structural Similarity Index (SSIM) between the two
+                # images, ensuring that the difference image is returned
+                with profile_stage(profile, 'ssim', width=w1, height=h1):
+                    (score, diff) = tiled_structural_similarity(grayA, grayB, tile_size)
+                del grayA, grayB
+                print("SSIM: {}".format(score))
+
+                # threshold the difference image, followed by merging the changed pixels into regions of the two
+                # input images that differ. The thresholded image is only made a strip at a time.
+                with profile_stage(profile, 'threshold'):
+                    level = otsu_threshold(image_histogram(diff))
+                with profile_stage(profile, 'regions') as info:
+                    regions = strip_change_regions(
+                        lambda y0, y1: cv2.threshold(diff[y0:y1], level, 255, cv2.THRESH_BINARY_INV)[1], h1, w1,
+                        distance)
+                    info['regions'] = len(regions)
+                del diff
+            print("Found", len(regions), "change regions in", img1)
+
+            # draw the bounding box of every region on all images to represent where the two images differ
+            for index, img in enumerate((img1, img2, img3)):
+                if img is None:
+                    continue
+                if images is None:
+                    with profile_stage(profile, 'imread', image=img):
+                        image = cv2.imread(img)
+                else:
+                    image = images[index]
+                with profile_stage(profile, 'draw', image=img, regions=len(regions)):
+                    (sx, sy) = (0, 0)
+                    if registration is not None:
+                        if index == 0:
+                            image = grbregistration.place_image(image, registration[0], registration[2])
+                        elif index == 1:
+                            image = grbregistration.place_image(image, registration[1], registration[2],
+                                                                registration[3])
+                        else:
+                            (sx, sy) = combined_shift
+                    for (x, y, w, h, pixels) in regions:
+                        cv2.rectangle(image, (x + sx, y + sy), (x + sx + w, y + sy + h), (0, 0, 255), 2, cv2.LINE_AA)
+                if png:
+                    with profile_stage(profile, 'imwrite', image=img, width=image.shape[1], height=image.shape[0]):
+                        cv2.imwrite(img, image)
+                if annotated is not None:
+                    annotated(index, image, [(x + sx, y + sy, w, h, pixels) for (x, y, w, h, pixels) in regions])
+                del image
+
+            if exact:
+                result = "OK. " + str(changed) + " pixels differ"
+                if report is not None:
+                    result = result + " (" + format(changed*(25.4/float(report['dpi']))**2, '.4f') + " mm²)"
+            else:
+                result = "OK. Images are "+format(round(score*100,2))+"% equal"
+            if registration is not None:
+                result = (result+" after moving image 2 by "+format(-registration[3][0], '.1f')+", "+
+                          format(-registration[3][1], '.1f')+" pixels.")
+            else:
+                result = result+"."
+            if report is not None:
+                if registration is not None:
+                    report['content'] = change_report(report, result, score, regions, registration[0], registration[3],
+                                                      mode)
+                else:
+                    report['content'] = change_report(report, result, score, regions, mode=mode)
+                if report.get('filepath'):
+                    write_change_report(report['filepath'], report['content'])
+            return result
+        except Exception as e:
+            print("Unable to compare", img1, "and", img2, "Error:", e)
+            result = "Failed to compare images. Error: "+str(e)
+    else:
+        for index, img in enumerate((img1, img2, img3)):
+            if img is None:
+                continue
+            if images is not None and png:
+                with profile_stage(profile, 'imwrite', image=img):
+                    cv2.imwrite(img, images[index])
+            if annotated is not None:
+                image = images[index] if images is not None else cv2.imread(img)
+                if image is not None:
+                    annotated(index, image, None)
+                del image
+        print("Images does not have the same resolution. Not able to compare", img1, "and", img2)
+        result = "Image 1 and 2 has different resolutions."
+    # The report is written even if the images couldn't be compared, so that it's not mistaken for an old report
+    if report is not None:
+        report['content'] = change_report(report, result, None, [], mode=mode)
+        if report.get('filepath'):
+            write_change_report(report['filepath'], report['content'])
+    return result
+
+
+# Raw images are uncompressed images that are used between the render and the diff of the png export instead of png
+# images, since encoding and decoding large png images takes longer than rendering and comparing them. The file starts
+# with raw_image_magic, followed by the height, width and number of channels (1 for grayscale or 3 for BGR) as 32 bit
+# little endian integers and padding up to raw_image_header_size bytes, and then the pixels as uint8.
+raw_image_magic = b"GRBRAW01"
+raw_image_header_size = 32
+
+
+# Write an image as a raw image
+def write_raw_image(filepath, image):
+    import struct
+    import numpy as np
+
+    channels = 1 if image.ndim == 2 else image.shape[2]
+    header = raw_image_magic + struct.pack('<III', image.shape[0], image.shape[1], channels)
+    with open(filepath, 'wb') as f:
+        f.write(header.ljust(raw_image_header_size, b'\0'))
+        f.write(np.ascontiguousarray(image, dtype=np.uint8).data)
+
+
+# Memory map a raw image (see write_raw_image()), so only the parts of the image that are used are read from the file.
+# The image can be changed (like when the differences are drawn on it) without changing the file.
+# Raises OSError if the file isn't a raw image, or if its size doesn't match the size of the image in the header (like
+# when the file was only partly written).
+def read_raw_image(filepath):
+    import struct
+    import numpy as np
+
+    with open(filepath, 'rb') as f:
+        header = f.read(raw_image_header_size)
+        size = os.fstat(f.fileno()).st_size
+    if len(header) < raw_image_header_size or not header.startswith(raw_image_magic):
+        raise OSError(filepath + " is not a raw image")
+    (height, width, channels) = struct.unpack_from('<III', header, len(raw_image_magic))
+    if height == 0 or width == 0 or channels not in (1, 3):
+        raise OSError(filepath + " has a bad header: " + str(height) + " x " + str(width) + " pixels, " +
+                      str(channels) + " channels")
+    if size != raw_image_header_size + height*width*channels:
+        raise OSError(filepath + " has " + str(size - raw_image_header_size) + " bytes of pixels instead of " +
+                      str(height*width*channels))
+    shape = (height, width) if channels == 1 else (height, width, channels)
+    return np.memmap(filepath, dtype=np.uint8, mode='c', offset=raw_image_header_size, shape=shape)
+
+
+# Convert a png image to a raw image, and remove the png image. The png image is only decoded once.
+def convert_to_raw_image(png_filepath, raw_filepath, profile=None):
+    import cv2  # opencv-python
+
+    with profile_stage(profile, 'imread', image=png_filepath) as info:
+        image = cv2.imread(png_filepath)
+        if image is None:
+            raise OSError("Unable to read " + png_filepath)
+        info['height'], info['width'] = image.shape[:2]
+    with profile_stage(profile, 'rawwrite', image=raw_filepath):
+        write_raw_image(raw_filepath, image)
+    os.remove(png_filepath)
+
+
+# Create the context that is shared by all renders of an export (see render_images()). Parsed files and masks of files
+# that are used in more than one layer are kept in it, so that they are only parsed and rendered once per export.
+# 'cache' is the render cache (see run_export_jobs()) or None. The renders are cancelled when 'cancel' (a
+# threading.Event) is set. 'memory' is a memory cache (see new_memory_cache()) that is shared with other exports, or
+# None.
+def new_render_context(cache=None, cancel=None, memory=None):
+    return {'cache': cache, 'digests': {}, 'shared': {}, 'shared_digests': set(), 'lock': threading.Lock(),
+            'mask_dir': None, 'cancel': cancel, 'memory': memory}
+
+
+# Find the files that are used by more than one of the lists of renders, like the outline that is used in every
+# layer, and mark them to be kept in the render context.
+def share_files(context, render_lists):
+    counts = {}
+    for renders in render_lists:
+        layer_digests = set()
+        for render in renders:
+            for filepath in render['files']:
+                try:
+                    layer_digests.add(file_digest(filepath, context['digests']))
+                except OSError:
+                    pass
+        for digest in layer_digests:
+            counts[digest] = counts.get(digest, 0) + 1
+    context['shared_digests'].update(digest for digest, count in counts.items() if count > 1)
+
+
+# Remove the temporary files of a render context
+def finish_render_context(context):
+    if context['mask_dir'] is not None:
+        remove_dir_later(context['mask_dir'])
+
+
+# Get a value from 'store', or compute it if it isn't there. If another worker is already computing the same value,
+# wait for it instead of computing it again.
+def shared_value(store, lock, key, compute):
+    with lock:
+        entry = store.get(key)
+        owner = entry is None
+        if owner:
+            entry = store[key] = {'done': threading.Event()}
+    if owner:
+        try:
+            entry['value'] = compute()
+        except Exception as e:
+            entry['error'] = e
+        entry['done'].set()
+    else:
+        entry['done'].wait()
+    if 'error' in entry:
+        raise entry['error']
+    return entry['value']
+
+
+# Render a file to a coverage mask (0-255) with GerbV, drawn white on black in the given frame. The frame is set with
+# the origin and window options of GerbV, so the mask can be combined with masks of other files.
+def gerbv_mask(gerbv, filepath, frame, dpi, context, profile=None):
+    import numpy as np
+    import cv2  # opencv-python
+    import tempfile
+
+    (left, bottom, width, height) = frame
+    with context['lock']:
+        if context['mask_dir'] is None:
+            context['mask_dir'] = tempfile.mkdtemp(prefix="GrbDiff-Masks-")
+    (handle, mask_filepath) = tempfile.mkstemp(suffix=".png", dir=context['mask_dir'])
+    os.close(handle)
+    process_args = [gerbv, "-a", "--background=#000000", "--foreground=#FFFFFFFF", filepath, "--export=png",
+                    "--dpi="+str(dpi), "--origin="+format(left, '.6f')+"x"+format(bottom, '.6f'),
+                    "--window_inch="+format(width/float(dpi), '.6f')+"x"+format(height/float(dpi), '.6f'),
+                    "-o"+mask_filepath]
+    with profile_stage(profile, 'gerbv', file=filepath, width=width, height=height):
+        run_gerbv(process_args, context['cancel'])
+    with profile_stage(profile, 'imread', file=filepath):
+        image = cv2.imread(mask_filepath, cv2.IMREAD_GRAYSCALE)
+    os.remove(mask_filepath)
+    if image is None:
+        raise OSError("GerbV didn't export " + filepath)
+    # GerbV may round the size of the image differently
+    mask = np.zeros((height, width), dtype=np.uint8)
+    h, w = min(height, image.shape[0]), min(width, image.shape[1])
+    mask[:h, :w] = image[:h, :w]
+    return mask
+
+
+# Render a number of images (dicts with the 'files', 'colors', 'bg_color', 'dpi' and optionally 'frame'), with every
+# distinct file rendered once and the images composited from the masks of the files. The built in renderer is used if
+# 'native' is True, with GerbV for the files it can't render. 'step' is called when an image is done, and the frame of
+# every image is added to 'frames' if it's a list.
+# Raises gerber.Unsupported if any of the files can't be parsed.
+def render_images(renders, native, gerbv, context, step=None, frames=None, profile=None):
+    import gerber
+
+    digests = context['digests']
+    local = {}
+    local_lock = threading.Lock()
+
+    def value(digest, key, compute):
+        if digest in context['shared_digests']:
+            return shared_value(context['shared'], context['lock'], key, compute)
+        return shared_value(local, local_lock, key, compute)
+
+    memory = context.get('memory')
+
+    def parse(filepath, digest):
+        if memory is not None:
+            objects = memory_cache_load(memory, ('parsed', digest))
+            if objects is not None:
+                return objects
+        print("Parsing", filepath)
+        with profile_stage(profile, 'parse', file=filepath) as info:
+            objects = gerber.parse_file(filepath)
+            info['objects'] = len(objects)
+        if memory is not None:
+            memory_cache_store(memory, ('parsed', digest), objects, len(objects)*parsed_object_size)
+        return objects
+
+    def mask(filepath, objects, frame, dpi):
+        if native:
+            try:
+                with profile_stage(profile, 'render', file=filepath, width=frame[2], height=frame[3]):
+                    return gerber.render_mask(objects, frame, float(dpi))
+            except gerber.Unsupported as e:
+                print("The built in renderer can't render", filepath, "(", e, "). Using GerbV instead.")
+        return gerbv_mask(gerbv, filepath, frame, dpi, context, profile)
+
+    renderer = "native " + str(gerber.RENDER_VERSION) if native else "gerbv masks " + gerbv
+    keys = [None] * len(renders)
+    images = [None] * len(renders)
+    # The images in the memory cache are copied, since the differences are drawn on the images
+    if context['cache'] or memory is not None:
+        for index, render in enumerate(renders):
+            try:
+                keys[index] = render_cache_key(renderer, render, digests)
+            except OSError as e:
+                print("Unable to read the files of the render. Error:", e)
+            if keys[index] and memory is not None:
+                images[index] = memory_cache_load(memory, ('image', keys[index]))
+                if images[index] is not None:
+                    print("Using render of", render['files'], "from memory")
+                    images[index] = images[index].copy()
+                    continue
+            if keys[index] and context['cache']:
+                images[index] = render_cache_load(context['cache'], keys[index])
+                if images[index] is not None:
+                    print("Using cached render of", render['files'])
+                    if memory is not None:
+                        memory_cache_store(memory, ('image', keys[index]), images[index].copy(), images[index].nbytes)
+    missing = [index for index, image in enumerate(images) if image is None]
+
+    # Parse all files first, so that nothing is rendered if any of the files can't be parsed
+    parsed = {}
+    image_frames = {}
+    for index in (range(len(renders)) if frames is not None else missing):
+        render = renders[index]
+        for filepath in render['files']:
+            digest = file_digest(filepath, digests)
+            parsed[filepath] = value(digest, ('parsed', digest),
+                                     lambda filepath=filepath, digest=digest: parse(filepath, digest))
+        image_frames[index] = render.get('frame')
+        if image_frames[index] is None:
+            image_frames[index] = gerber.image_frame([parsed[filepath] for filepath in render['files']],
+                                                     float(render['dpi']))
+        if image_frames[index][2] <= 0 or image_frames[index][3] <= 0:
+            raise gerber.Unsupported("Empty image")
+    if frames is not None:
+        frames.extend(image_frames[index] for index in range(len(renders)))
+
+    for index, image in enumerate(images):
+        render = renders[index]
+        if image is None:
+            check_cancelled(context['cancel'])
+            frame = image_frames[index]
+            masks = []
+            for filepath in render['files']:
+                digest = file_digest(filepath, digests)
+                masks.append(value(digest, ('mask', digest, frame, str(render['dpi'])),
+                                   lambda filepath=filepath: mask(filepath, parsed[filepath], frame, render['dpi'])))
+            with profile_stage(profile, 'composite', width=frame[2], height=frame[3]):
+                images[index] = gerber.composite(masks, render['colors'], render['bg_color'])
+            if keys[index] and context['cache']:
+                render_cache_store(context['cache'], keys[index], image=images[index])
+            if keys[index] and memory is not None:
+                memory_cache_store(memory, ('image', keys[index]), images[index].copy(), images[index].nbytes)
+        if step is not None:
+            step()
+    return images
+
+
+# Get the frame of a render (see render_images()) from its parsed files, without rendering it. GerbV uses the same
+# frame when it exports the image. Returns None if the files can't be parsed.
+def render_frame(render):
+    import gerber
+
+    try:
+        return gerber.image_frame([gerber.parse_file(filepath) for filepath in render['files']], float(render['dpi']))
+    except (gerber.Unsupported, OSError, ValueError) as e:
+        print("Unable to find the frame of", render['files'], "Error:", e)
+        return None
+
+
+# Get the background color of the images of a render (see render_images()) as BGR
+def render_background(render):
+    import gerber
+
+    (red, green, blue, alpha) = gerber.parse_color(render['bg_color'])
+    return (blue, green, red)
+
+
+# Get the options for the change regions and the change report of a diff (see diff_layer_images()) from a job, which
+# may have the path of the report ('report') and the merge distance in mm ('merge_distance'). 'source' is the render
+# of image 1 (see render_images()) and 'frame' its frame, if it's already known.
+def diff_report(job, source, frame=None):
+    report = {'dpi': source['dpi'], 'frame': frame, 'filepath': job.get('report'),
+              'merge_distance': job.get('merge_distance', default_change_merge_distance),
+              'background': render_background(source)}
+    if report['filepath'] and frame is None:
+        report['frame'] = render_frame(source)
+    return report
+
+
+# Write the change report of a job or a diff whose images couldn't be compared at all
+def write_failed_report(job, source, result):
+    if job.get('report'):
+        try:
+            report = {'filepath': job['report'], 'dpi': source['dpi'], 'frame': None,
+                      'merge_distance': job.get('merge_distance', default_change_merge_distance)}
+            write_change_report(job['report'], change_report(report, result, None, [],
+                                                             mode=job.get('diff_mode', 'ssim')))
+        except (OSError, ValueError) as e:
+            print("Unable to write", job['report'], "Error:", e)
+
+
+# Write the change report of a job whose files are identical in both gerbers (see identical_renders()), so the layer
+# hasn't been rendered
+def write_identical_report(job, result):
+    if job.get('report'):
+        try:
+            report = {'filepath': job['report'], 'dpi': job.get('fine_dpi') or job['sources'][0]['dpi'], 'frame': None,
+                      'merge_distance': job.get('merge_distance', default_change_merge_distance)}
+            content = change_report(report, result, 1.0, [], mode=job.get('diff_mode', 'ssim'))
+            content['identical'] = True
+            write_change_report(job['report'], content)
+        except (OSError, ValueError) as e:
+            print("Unable to write", job['report'], "Error:", e)
+
+
+# Remove the images of a layer that were written by an earlier export, with their image pyramids and the images of
+# the windows of a coarse to fine diff, so that they aren't taken for the images of this export
+def remove_layer_images(images):
+    import glob
+
+    for img in images:
+        for filepath in [img] + glob.glob(glob.escape(os.path.splitext(img)[0]) + "-w*.png"):
+            if os.path.exists(filepath):
+                os.remove(filepath)
+        shutil.rmtree(grbpyramid.pyramid_dir(img), ignore_errors=True)
+
+
+# Render an image with GerbV and wait for it to finish. If a render cache is given, the image is copied from the
+# cache if it has been rendered before, and added to the cache otherwise. 'cancel' is passed on to run_gerbv().
+# The render is measured if 'profile' is given (see profile_stage()).
+def render_gerbv(process_args, render, export_filepath, cache=None, digests=None, cancel=None, profile=None):
+    key = None
+    if cache:
+        try:
+            key = render_cache_key("gerbv " + process_args[0], render, {} if digests is None else digests)
+        except OSError as e:
+            print("Unable to read the files of the render. Error:", e)
+        if key and render_cache_fetch(cache, key, export_filepath):
+            return 0
+    with profile_stage(profile, 'gerbv', image=export_filepath):
+        returncode = run_gerbv(process_args, cancel)
+    if key and returncode == 0 and os.path.isfile(export_filepath):
+        render_cache_store(cache, key, export_filepath)
+    return returncode
+
+
+# Render an image to export_filepath with the renderer (see run_export_jobs()). GerbV is used for the whole image if
+# any of the files can't be parsed. The render is measured if 'profile' is given (see profile_stage()).
+def render_file(process_args, render, export_filepath, renderer, context, profile=None):
+    import gerber
+    import cv2  # opencv-python
+
+    if renderer == 'gerbv':
+        return render_gerbv(process_args, render, export_filepath, context['cache'], context['digests'],
+                            context['cancel'], profile)
+    try:
+        image = render_images([render], renderer == 'native', process_args[0], context, profile=profile)[0]
+    except gerber.Unsupported as e:
+        print("Unable to parse the files of", export_filepath, "(", e, "). Using GerbV for the whole image.")
+        return render_gerbv(process_args, render, export_filepath, context['cache'], context['digests'],
+                            context['cancel'], profile)
+    with profile_stage(profile, 'imwrite', image=export_filepath, width=image.shape[1], height=image.shape[0]):
+        if not cv2.imwrite(export_filepath, image):
+            raise OSError("Unable to write " + export_filepath)
+    return 0
+
+
+# Renderers for the png export: the built in renderer, GerbV for every image, or GerbV for every file once (see
+# render_images())
+renderers = ['native', 'gerbv', 'gerbv_files']
+
+
+# Margin in pixels of the coarse images that is added around the changes found by the coarse diff, so that the edges
+# of the changes are inside the windows that are rendered again at the fine dpi
+coarse_margin = 4
+
+
+# Get the windows of the board (left, bottom, right, top in inches) to render at the fine dpi from the change regions
+# of a coarse diff (see change_report()). Every region is grown by 'margin' inches, and windows that overlap are merged.
+def change_windows(regions, margin):
+    windows = []
+    for region in regions:
+        (left, bottom, right, top) = [value/25.4 for value in region['bounds_mm']]
+        window = [left - margin, bottom - margin, right + margin, top + margin]
+        merged = True
+        while merged:
+            merged = False
+            for other in windows:
+                if other[0] <= window[2] and window[0] <= other[2] and other[1] <= window[3] and window[1] <= other[3]:
+                    windows.remove(other)
+                    window = [min(window[0], other[0]), min(window[1], other[1]), max(window[2], other[2]),
+                              max(window[3], other[3])]
+                    merged = True
+                    break
+        windows.append(window)
+    return windows
+
+
+# Render the three images of a layer at the fine dpi of a job (see coarse_to_fine_diff()) to 'filepaths'. Only the
+# part of the board in the frame of every image is rendered, or the whole images if 'frames' is None.
+def render_layer_fine(job, filepaths, frames, context, profile=None):
+    gerbv = job['renders'][0][0]
+    for index, (source, filepath) in enumerate(zip(job['sources'], filepaths)):
+        frame = None if frames is None else frames[index]
+        render = dict(source, dpi=job['fine_dpi'], frame=frame)
+        process_args = gerbv_export_args(gerbv, render['files'], render['colors'], render['bg_color'], render['dpi'],
+                                         filepath, frame)
+        if render_file(process_args, render, filepath, job['renderer'], context, profile) != 0:
+            raise OSError("Unable to render " + filepath)
+
+
+# Compare the images of a layer in two passes: the whole images at the dpi of the job, and then only windows around
+# the changes, rendered again at 'fine_dpi'. The images of window n are written with "-wn" added to their names.
+# Returns the result text for the layer.
+def coarse_to_fine_diff(job, images, frames, context, profile=None, annotated=None, png=True):
+    import math
+
+    tile_size = job.get('tile_size', default_ssim_tile_size)
+    mode = job.get('diff_mode', 'ssim')
+    merge_distance = job.get('merge_distance', default_change_merge_distance)
+    coarse_dpi = float(job['sources'][0]['dpi'])
+    fine_dpi = float(job['fine_dpi'])
+    if frames is None:
+        frames = [render_frame(source) for source in job['sources']]
+    background = render_background(job['sources'][0])
+    coarse = {'dpi': coarse_dpi, 'frame': frames[0], 'filepath': None, 'merge_distance': merge_distance,
+              'background': background}
+    result = diff_layer_images(*job['images'], tile_size, images, coarse, profile, annotated, png, mode)
+    images = None
+    content = coarse['content']
+    if not content['compared']:
+        if job.get('report'):
+            write_change_report(job['report'], content)
+        return result
+    if frames[0] is None or frames[1] is None:
+        print("Unable to find the changed parts of", job['images'][0], "Rendering the whole images at",
+              job['fine_dpi'], "DPI.")
+        # The image pyramids are made from the images at the fine dpi instead
+        render_layer_fine(job, job['images'], None, context, profile)
+        return diff_layer_images(*job['images'], tile_size, None,
+                                 {'dpi': fine_dpi, 'frame': None, 'filepath': job.get('report'),
+                                  'merge_distance': merge_distance, 'background': background}, profile, annotated, png,
+                                 mode)
+
+    # The windows are in the board coordinates of gerber 1. If image 2 had to be moved to line up with image 1, the
+    # windows of gerber 2 are moved by the same distance.
+    (left1, bottom1, width1, height1) = frames[0]
+    (left2, bottom2, width2, height2) = frames[1]
+    (dx, dy) = (-content['translation_px'][0], -content['translation_px'][1])
+    shift_x = left2 - left1 + dx/coarse_dpi
+    shift_y = (bottom2 + height2/coarse_dpi) - (bottom1 + height1/coarse_dpi) - dy/coarse_dpi
+
+    windows = change_windows(content['regions'], coarse_margin/coarse_dpi + merge_distance/25.4)
+    print("Comparing", len(windows), "windows of", job['images'][0], "at", job['fine_dpi'], "DPI")
+    regions = []
+    window_entries = []
+    changed = 0
+    changed_pixels = 0
+    for number, (left, bottom, right, top) in enumerate(windows, 1):
+        check_cancelled(context['cancel'])
+        width = int(math.ceil((right - left)*fine_dpi))
+        height = int(math.ceil((top - bottom)*fine_dpi))
+        window_frames = [(left, bottom, width, height), (left + shift_x, bottom + shift_y, width, height),
+                         (left, bottom, width, height)]
+        filepaths = [os.path.splitext(img)[0] + "-w" + str(number) + ".png" for img in job['images']]
+        render_layer_fine(job, filepaths, window_frames, context, profile)
+        fine = {'dpi': fine_dpi, 'frame': window_frames[0], 'filepath': None, 'merge_distance': merge_distance,
+                'aligned': True, 'background': background}
+        window_result = diff_layer_images(*filepaths, tile_size, None, fine, profile, mode=mode)
+        regions.extend(dict(region, window=number) for region in fine['content']['regions'])
+        if fine['content']['regions'] or not fine['content']['compared']:
+            changed = changed + 1
+        changed_pixels = changed_pixels + fine['content']['changed_pixels']
+        window_entries.append({'bounds_mm': [round(value*25.4, 4) for value in (left, bottom, right, top)],
+                               'images': filepaths, 'ssim': fine['content']['ssim'], 'result': window_result})
+
+    result = result.rstrip('.') + " at " + str(job['sources'][0]['dpi']) + " DPI. "
+    if windows:
+        result = (result + "Changes found in " + str(changed) + " of " + str(len(windows)) + " windows at " +
+                  str(job['fine_dpi']) + " DPI.")
+    else:
+        result = result + "No changes to check at " + str(job['fine_dpi']) + " DPI."
+    if job.get('report'):
+        scale = fine_dpi/coarse_dpi
+        content = dict(content, result=result, dpi=fine_dpi, coarse_dpi=coarse_dpi, regions=regions,
+                       changed_pixels=changed_pixels,
+                       changed_area_mm2=round(sum(region['changed_area_mm2'] for region in regions), 4),
+                       translation_px=[round(value*scale, 2) for value in content['translation_px']],
+                       windows=window_entries)
+        write_change_report(job['report'], content)
+    return result
+
+
+# Memory in bytes that the png export of a layer uses at its peak for every pixel of its images, with every diff mode
+# (see diff_modes): the three images, the images of the diff and the images with the differences marked. Measured on
+# a 300 mm board at 300 DPI.
+export_bytes_per_pixel = {'ssim': 32, 'exact': 30}
+
+# Part of the available memory (see available_memory()) that the png export plans to use
+export_memory_fraction = 0.8
+
+# Extents of the files that have been scanned (see gerber.scan_extents()) by path, size and time of modification
+extents_cache = OrderedDict()
+extents_cache_lock = threading.Lock()
+
+
+# Get the extents of a file (see gerber.scan_extents()), from the cache if the file hasn't changed since it was scanned
+def file_extents(filepath):
+    import gerber
+
+    stat = os.stat(filepath)
+    key = (os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns)
+    with extents_cache_lock:
+        if key in extents_cache:
+            extents_cache.move_to_end(key)
+            return extents_cache[key]
+    bbox = gerber.scan_extents(filepath)
+    with extents_cache_lock:
+        extents_cache[key] = bbox
+        while len(extents_cache) > fingerprint_cache_size:
+            extents_cache.popitem(last=False)
+    return bbox
+
+
+# Estimate the memory in bytes that the png export of a job (see run_export_jobs()) uses at its peak, from the size of
+# the largest image of the job at the dpi of its sources. The size of the images is found from the extents of the
+# files (see file_extents()), without parsing or rendering them. Returns None if the size of the images isn't known.
+def estimate_job_memory(job):
+    import gerber
+
+    pixels = 0
+    for source in job['sources']:
+        try:
+            boxes = [file_extents(filepath) for filepath in source['files']]
+        except (OSError, ValueError) as e:
+            print("Unable to find the extents of", source['files'], "Error:", e)
+            return None
+        boxes = [bbox for bbox in boxes if bbox is not None]
+        if not boxes:
+            return None
+        bbox = (min(bbox[0] for bbox in boxes), min(bbox[1] for bbox in boxes), max(bbox[2] for bbox in boxes),
+                max(bbox[3] for bbox in boxes))
+        frame = gerber.bbox_frame(bbox, float(source['dpi']))
+        pixels = max(pixels, frame[2]*frame[3])
+    return pixels*export_bytes_per_pixel.get(job.get('diff_mode', 'ssim'), max(export_bytes_per_pixel.values()))
+
+
+# Plan the png export of a number of jobs (see run_export_jobs()) for the memory budget in bytes, a part of the
+# available memory by default. A job that doesn't fit in the budget by itself is changed to a coarse to fine diff at a
+# coarse dpi that fits. Returns the jobs, the estimated memory of every job (0 if it isn't known) and the budget, which
+# is None if the available memory isn't known.
+def plan_export_jobs(jobs, profiles, budget=None):
+    import math
+
+    if budget is None:
+        available = available_memory()
+        if available is None:
+            print("Unable to find the available memory. Not planning the png export for it.")
+            return jobs, [0] * len(jobs), None
+        budget = int(available*export_memory_fraction)
+    planned = []
+    estimates = []
+    for job, profile in zip(jobs, profiles):
+        with profile_stage(profile, 'plan') as info:
+            estimate = estimate_job_memory(job)
+            dpi = float(job['sources'][0]['dpi'])
+            if estimate is None:
+                decision = "unknown size"
+            elif estimate <= budget:
+                decision = "fits"
+            else:
+                coarse_dpi = max(1, int(dpi*math.sqrt(budget/float(estimate))))
+                decision = ("lower coarse dpi " if job.get('fine_dpi') else "coarse to fine at ") + str(coarse_dpi)
+                sources = [dict(source, dpi=str(coarse_dpi)) for source in job['sources']]
+                renders = [gerbv_export_args(render[0], source['files'], source['colors'], source['bg_color'],
+                                             source['dpi'], image)
+                           for render, source, image in zip(job['renders'], sources, job['images'])]
+                job = dict(job, sources=sources, renders=renders,
+                           fine_dpi=job.get('fine_dpi') or job['sources'][0]['dpi'])
+                estimate = int(estimate*(coarse_dpi/dpi)**2)
+            info.update(estimate_mb=None if estimate is None else round(estimate/1048576.0, 1),
+                        budget_mb=round(budget/1048576.0, 1), decision=decision)
+        print("Png export of " + (job.get('layer') or os.path.basename(job['images'][0])) + ": about",
+              "?" if estimate is None else round(estimate/1048576.0), "MB at", job['sources'][0]['dpi'],
+              "DPI with a budget of", round(budget/1048576.0), "MB,", decision)
+        planned.append(job)
+        estimates.append(estimate or 0)
+    return planned, estimates, budget
+
+
+# Run the png export of a number of layers on a pool of workers. Every job has the 'renders', 'sources', 'images' and
+# 'renderer' of a layer, and optionally 'tile_size', 'merge_distance', 'report', 'diff_mode', 'fine_dpi', 'pyramids',
+# 'raw', 'png', 'artifact', 'skip_identical', 'cache' and 'memory_cache' (see export_jobs()). 'progress(done, total)'
+# is called on the calling thread, and 'layer_done(index, result)' on a worker thread. Setting 'cancel' (a
+# threading.Event) cancels the export.
+# Returns the result text of every job, in the same order as the jobs.
+def run_export_jobs(jobs, workers, progress=None, layer_done=None, cancel=None, profile=None):
+    results = [None] * len(jobs)
+    if not jobs:
+        return results
+
+    workers = max(1, int(workers))
+    profiles = [layer_profile(profile, job.get('layer') or os.path.basename(job['images'][0])) for job in jobs]
+    (jobs, estimates, budget) = plan_export_jobs(jobs, profiles)
+    # Memory that the layers that have been started are estimated to use, and the number of those layers
+    memory = {'used': 0, 'layers': 0}
+
+    # Every render and every diff is one step, and the second pass of a coarse to fine diff is one more
+    def job_steps(job):
+        return len(job['renders']) + (2 if job.get('fine_dpi') else 1)
+
+    total = sum(job_steps(job) for job in jobs)
+    finished = queue.Queue()
+    lock = threading.Lock()
+    renders_left = [len(job['renders']) for job in jobs]
+    # All jobs of an export use the same render cache
+    context = new_render_context(jobs[0].get('cache'), cancel, jobs[0].get('memory_cache'))
+    share_files(context, [job['sources'] for job in jobs if job['renderer'] != 'gerbv'])
+    raw_dir = None
+    if any(job.get('raw') or not job.get('png', True) for job in jobs):
+        import tempfile
+        raw_dir = tempfile.mkdtemp(prefix="GrbDiff-Raw-")
+
+    # Get the path of the raw image of a render of a job
+    def raw_filepath(job_index, render_index):
+        return os.path.join(raw_dir, str(job_index) + "-" + str(render_index) + ".raw")
+
+    def finish_layer(job_index, result):
+        results[job_index] = result
+        with lock:
+            memory['used'] -= estimates[job_index]
+            memory['layers'] -= 1
+        if layer_done is not None:
+            layer_done(job_index, result)
+
+    def diff_job(job_index, images=None, frames=None, raw=False):
+        job = jobs[job_index]
+        png = job.get('png', True)
+        # The image pyramid of every image is written and the image is added to the diff artifact as soon as it has
+        # been marked, so that the marked images aren't kept
+        pyramids = set()
+        artifact = {'artifact': None, 'images': set()}
+
+        def image_marked(index, image, regions):
+            img = job['images'][index]
+            if cancel is not None and cancel.is_set():
+                return
+            if job.get('pyramids'):
+                try:
+                    with profile_stage(profiles[job_index], 'pyramid', image=img):
+                        grbpyramid.write_image_pyramid(img, image=image)
+                    pyramids.add(index)
+                except Exception as e:
+                    print("Unable to write the image pyramid of", img, "Error:", e)
+            if job.get('artifact'):
+                try:
+                    with profile_stage(profiles[job_index], 'artifact', image=img):
+                        # The images of a coarse diff are marked again when the whole layer is compared at the fine dpi
+                        if artifact['artifact'] is None or index in artifact['images']:
+                            grbartifact.discard_diff_artifact(artifact['artifact'])
+                            artifact['images'] = set()
+                            artifact['artifact'] = grbartifact.open_diff_artifact(job['artifact'], {
+                                'layer': job.get('layer'), 'dpi': float(job['sources'][0]['dpi'])})
+                        grbartifact.add_artifact_image(artifact['artifact'], grbartifact.artifact_image_name(img),
+                                                       image, regions, render_background(job['sources'][0]))
+                    artifact['images'].add(index)
+                except Exception as e:
+                    print("Unable to add", img, "to the diff artifact", job['artifact'], "Error:", e)
+
+        annotated = image_marked if job.get('pyramids') or job.get('artifact') else None
+        try:
+            check_cancelled(cancel)
+            if raw:
+                images = []
+                for render_index in range(len(job['renders'])):
+                    with profile_stage(profiles[job_index], 'rawread'):
+                        images.append(read_raw_image(raw_filepath(job_index, render_index)))
+            if job.get('fine_dpi'):
+                results[job_index] = coarse_to_fine_diff(job, images, frames, context, profiles[job_index], annotated,
+                                                         png)
+            else:
+                results[job_index] = diff_layer_images(*job['images'], job.get('tile_size', default_ssim_tile_size),
+                                                       images, diff_report(job, job['sources'][0],
+                                                                           frames[0] if frames else None),
+                                                       profiles[job_index], annotated, png,
+                                                       job.get('diff_mode', 'ssim'))
+        except Cancelled:
+            results[job_index] = "Cancelled."
+        except Exception as e:
+            print("Unable to compare", job['images'][0], "and", job['images'][1], "Error:", e)
+            results[job_index] = "Failed to compare images. Error: "+str(e)
+            write_failed_report(job, job['sources'][0], results[job_index])
+        images = None
+        # The image pyramids of an earlier export would be shown in the viewer, for the images that couldn't be marked
+        # or when no image pyramids are written
+        for index, img in enumerate(job['images']):
+            if index not in pyramids:
+                shutil.rmtree(grbpyramid.pyramid_dir(img), ignore_errors=True)
+        if cancel is not None and cancel.is_set():
+            grbartifact.discard_diff_artifact(artifact['artifact'])
+        elif job.get('artifact'):
+            if len(artifact['images']) != sum(img is not None for img in job['images']):
+                # An artifact of an earlier export would not match the images
+                print("Unable to write the diff artifact", job['artifact'], "Not all images could be added.")
+                grbartifact.discard_diff_artifact(artifact['artifact'])
+                if os.path.exists(job['artifact']):
+                    os.remove(job['artifact'])
+            else:
+                report = read_change_report(job['report']) if job.get('report') else None
+                windows = [img for window in (report or {}).get('windows', []) for img in window['images']]
+                try:
+                    with profile_stage(profiles[job_index], 'artifact', image=job['artifact']):
+                        grbartifact.close_diff_artifact(artifact['artifact'], windows)
+                    # The images of the windows are in the artifact
+                    if not png:
+                        for img in windows:
+                            if os.path.exists(img):
+                                os.remove(img)
+                except Exception as e:
+                    grbartifact.discard_diff_artifact(artifact['artifact'])
+                    print("Unable to write the diff artifact", job['artifact'], "Error:", e)
+        artifact = None
+        # Images of an earlier export would not match the image pyramids
+        if not png:
+            for img in job['images']:
+                if os.path.exists(img):
+                    os.remove(img)
+        finish_layer(job_index, results[job_index])
+        if job.get('fine_dpi'):
+            finished.put(1)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def render_done(job_index, future):
+            if future.exception() is not None and not isinstance(future.exception(), Cancelled):
+                print("Unable to run GerbV. Error:", future.exception())
+            with lock:
+                renders_left[job_index] -= 1
+                start_diff = renders_left[job_index] == 0
+            if start_diff:
+                job = jobs[job_index]
+                raw = ((job.get('raw') or not job.get('png', True)) and
+                       all(os.path.exists(raw_filepath(job_index, render_index))
+                           for render_index in range(len(job['renders']))))
+                diff_future = executor.submit(diff_job, job_index, raw=raw)
+                diff_future.add_done_callback(lambda f: finished.put(1))
+            finished.put(1)
+
+        # Render an image of a job with GerbV. With raw images, GerbV exports to a temporary png image, which is
+        # converted to a raw image.
+        def render_gerbv_image(job_index, render_index):
+            job = jobs[job_index]
+            process_args = job['renders'][render_index]
+            export_filepath = job['images'][render_index]
+            if job.get('raw') or not job.get('png', True):
+                export_filepath = os.path.splitext(raw_filepath(job_index, render_index))[0] + ".png"
+                process_args = [arg for arg in process_args if not arg.startswith("-o")] + ["-o" + export_filepath]
+            returncode = render_gerbv(process_args, job['sources'][render_index], export_filepath, context['cache'],
+                                      context['digests'], cancel, profiles[job_index])
+            if export_filepath != job['images'][render_index] and returncode == 0:
+                convert_to_raw_image(export_filepath, raw_filepath(job_index, render_index), profiles[job_index])
+            return returncode
+
+        def submit_gerbv_renders(job_index):
+            job = jobs[job_index]
+            for render_index in range(len(job['renders'])):
+                future = executor.submit(render_gerbv_image, job_index, render_index)
+                future.add_done_callback(lambda f, job_index=job_index: render_done(job_index, f))
+
+        def layer_job(job_index):
+            import gerber
+
+            job = jobs[job_index]
+            steps = []
+
+            def step():
+                steps.append(1)
+                finished.put(1)
+
+            frames = [] if job.get('report') or job.get('fine_dpi') else None
+            try:
+                check_cancelled(cancel)
+                images = render_images(job['sources'], job['renderer'] == 'native', job['renders'][0][0], context, step,
+                                       frames, profiles[job_index])
+            except gerber.Unsupported as e:
+                print("Unable to parse the files of", job['images'][0], "(", e, "). Using GerbV for every image.")
+                submit_gerbv_renders(job_index)
+                return
+            except Cancelled:
+                finish_layer(job_index, "Cancelled.")
+                finished.put(job_steps(job) - len(steps))
+                return
+            except Exception as e:
+                print("Unable to render", job['images'][0], "Error:", e)
+                finish_layer(job_index, "Failed to render images. Error: "+str(e))
+                finished.put(job_steps(job) - len(steps))
+                return
+            diff_job(job_index, images, frames)
+            finished.put(1)
+
+        def start_job(job_index):
+            job = jobs[job_index]
+            if job.get('skip_identical'):
+                try:
+                    identical = identical_renders(job['sources'][0], job['sources'][1], context['digests'])
+                except OSError as e:
+                    print("Unable to read the files of", job['images'][0], "Error:", e)
+                    identical = False
+                if identical:
+                    print("The files of", job['images'][0], "are identical. Not rendering them.")
+                    result = "OK. Identical files, not rendered."
+                    try:
+                        remove_layer_images(job['images'])
+                        if job.get('artifact') and os.path.exists(job['artifact']):
+                            os.remove(job['artifact'])
+                    except OSError as e:
+                        print("Unable to remove the images of", job['images'][0], "Error:", e)
+                    write_identical_report(job, result)
+                    finish_layer(job_index, result)
+                    finished.put(job_steps(job))
+                    return
+            if job['renderer'] == 'gerbv':
+                submit_gerbv_renders(job_index)
+            else:
+                layer_job(job_index)
+
+        # A layer is started when the memory it's estimated to use fits in the memory budget with the layers that are
+        # running, or when no layer is running. Every layer is started at once if the budget isn't known.
+        pending = list(range(len(jobs)))
+        waiting = None
+        done = 0
+        while done < total:
+            with lock:
+                while pending and (budget is None or memory['layers'] == 0 or
+                                   memory['used'] + estimates[pending[0]] <= budget):
+                    memory['used'] += estimates[pending[0]]
+                    memory['layers'] += 1
+                    executor.submit(start_job, pending.pop(0))
+                if pending and pending[0] != waiting:
+                    waiting = pending[0]
+                    print("Waiting for memory to start the png export of " +
+                          (jobs[waiting].get('layer') or os.path.basename(jobs[waiting]['images'][0])) + ".",
+                          memory['layers'], "layers running.")
+            try:
+                done = done + finished.get(timeout=0.1)
+            except queue.Empty:
+                pass
+            if progress is not None:
+                progress(done, total)
+    finish_render_context(context)
+    if raw_dir is not None:
+        shutil.rmtree(raw_dir, ignore_errors=True)
+    return results
+
+
+# Get the sources (see render_images()) of the images of a layer, which is the index of the layer in 'filetypes', for
+# the png export of two gerber sets (see open_gerber_set()) with a png color template. The outline of the board (the
+# last layer) is drawn in every image. The images are Gerber 1, Gerber 2 and both of them combined.
+def export_layer_sources(set1, set2, layer, template, dpi):
+    (bg_color, color1, color2, combined1, combined2) = template[1:6]
+    outline1 = set1['filepaths'][-1]
+    outline2 = set2['filepaths'][-1]
+    sources = []
+    for files, colors in (([set1['filepaths'][layer], outline1], [color1, color1]),
+                          ([set2['filepaths'][layer], outline2], [color2, color2]),
+                          ([set1['filepaths'][layer], set2['filepaths'][layer], outline1, outline2],
+                           [combined1, combined2, combined1, combined2])):
+        files_colors = [(filepath, color) for filepath, color in zip(files, colors) if filepath is not None]
+        sources.append({'files': [filepath for filepath, color in files_colors],
+                        'colors': [color for filepath, color in files_colors], 'bg_color': bg_color, 'dpi': str(dpi)})
+    return sources
+
+
+# Get the jobs (see run_export_jobs()) for the png export of the layers that are in both of two gerber sets (see
+# open_gerber_set()), with the images and change reports written to 'export_path' with the same names as in GrbDiff.
+# 'options' is a dict with the path of GerbV ('gerbv'), the png color template ('template', see png_color_template),
+# the 'dpi' and optionally the coarse dpi ('coarse_dpi', see coarse_to_fine_diff()), the 'renderer', the 'tile_size',
+# the 'merge_distance', the 'diff_mode', the render 'cache', the 'memory_cache', whether image pyramids are written
+# ('pyramids'), whether the images are written as png images ('png'), whether diff artifacts are written ('artifact')
+# and whether layers with identical files are skipped ('skip_identical', True by default, see run_export_jobs()).
+# The diff artifact of a layer is written next to its images, as <Layer>-diff.zip.
+# Returns the jobs and the index of the layer of every job.
+def export_jobs(set1, set2, export_path, options):
+    dpi = options['dpi']
+    coarse_dpi = options.get('coarse_dpi')
+    coarse = coarse_dpi is not None and 0 < float(coarse_dpi) < float(dpi)
+    jobs = []
+    job_layers = []
+    for index, layer in enumerate(filetypes):
+        if set1['filepaths'][index] is None or set2['filepaths'][index] is None:
+            continue
+        sources = export_layer_sources(set1, set2, index, options['template'], coarse_dpi if coarse else dpi)
+        name = layer[0].replace(" ", "_")
+        images = [os.path.join(export_path, name + "-" + sel + ".png") for sel in ('1', '2', 'combined')]
+        renders = [gerbv_export_args(options.get('gerbv', ''), source['files'], source['colors'], source['bg_color'],
+                                     source['dpi'], image)
+                   for source, image in zip(sources, images)]
+        job = {'renders': renders, 'sources': sources, 'images': images, 'layer': layer[0],
+               'renderer': options.get('renderer', renderers[0]),
+               'tile_size': options.get('tile_size', default_ssim_tile_size),
+               'merge_distance': options.get('merge_distance', default_change_merge_distance),
+               'diff_mode': options.get('diff_mode', 'ssim'),
+               'report': os.path.join(export_path, name + "-diff.json"), 'cache': options.get('cache'),
+               'memory_cache': options.get('memory_cache'), 'pyramids': options.get('pyramids', False), 'raw': True,
+               'png': options.get('png', True), 'skip_identical': options.get('skip_identical', True),
+               'artifact': os.path.join(export_path, name + "-diff.zip") if options.get('artifact') else None}
+        if coarse:
+            job['fine_dpi'] = str(dpi)
+        jobs.append(job)
+        job_layers.append(index)
+    return jobs, job_layers
+
+
+# Read the settings of GrbDiff (settings.ini) for the png export without the GUI (see grbservice.py and grbbatch.py).
+# The settings are only read, and the defaults are used for what isn't in the file.
+def read_settings(filepath):
+    from configparser import ConfigParser
+    import drilldiff
+
+    settings = ConfigParser()
+    settings['PATHS'] = {'gerbv_path': '', 'png_export_path': '', 'render_cache_path': ''}
+    settings['TEMPLATES'] = {'png_color_combobox': '0'}
+    settings['OTHER'] = {'png_export_dpi': '300', 'png_export_workers': str(default_workers()),
+                         'ssim_tile_size': str(default_ssim_tile_size), 'png_renderer': '0',
+                         'render_cache_size': str(default_render_cache_size),
+                         'change_merge_distance': str(default_change_merge_distance), 'png_coarse_dpi': '0',
+                         'png_export_images': '1', 'png_diff_mode': '0', 'png_export_artifact': '0',
+                         'drill_position_tolerance': str(drilldiff.default_position_tolerance),
+                         'drill_diameter_tolerance': str(drilldiff.default_diameter_tolerance)}
+    if os.path.exists(filepath):
+        settings.read(filepath)
+    else:
+        print("No settings file", filepath, "found. Using the default settings.")
+    return settings
+
+
+# Get the options of the png export (see export_jobs()) of a request to compare two gerber sets, with the settings
+# (see read_settings()) for what isn't given in the request. The keys of the request are described in grbservice.py.
+# 'memory_cache' is passed on to the export (see new_memory_cache()).
+# Raises ValueError if the request has an unknown renderer, diff mode or png color template.
+def request_export_options(settings, request, memory_cache=None):
+    paths, templates, other = settings['PATHS'], settings['TEMPLATES'], settings['OTHER']
+    cache = None
+    if paths.get('render_cache_path'):
+        cache = (paths['render_cache_path'], float(other.get('render_cache_size')))
+    renderer = request.get('renderer', renderers[int(other.get('png_renderer', '0'))])
+    if renderer not in renderers:
+        raise ValueError("Unknown renderer " + str(renderer))
+    diff_mode = request.get('diff_mode', diff_modes[int(other.get('png_diff_mode', '0'))])
+    if diff_mode not in diff_modes:
+        raise ValueError("Unknown diff mode " + str(diff_mode))
+    template = int(request.get('template', templates.get('png_color_combobox', '0')))
+    if not 0 <= template < len(png_color_template):
+        raise ValueError("Unknown png color template " + str(template))
+    return {'gerbv': paths.get('gerbv_path', ''), 'template': png_color_template[template],
+            'dpi': str(request.get('dpi', other.get('png_export_dpi'))),
+            'coarse_dpi': str(request.get('coarse_dpi', other.get('png_coarse_dpi', '0'))),
+            'renderer': renderer, 'tile_size': int(other.get('ssim_tile_size')),
+            'merge_distance': float(request.get('merge_distance', other.get('change_merge_distance'))),
+            'diff_mode': diff_mode,
+            'cache': cache, 'memory_cache': memory_cache, 'pyramids': bool(request.get('pyramids', False)),
+            'png': bool(request.get('png', other.get('png_export_images', '1') != '0')),
+            'artifact': bool(request.get('artifact', other.get('png_export_artifact', '0') != '0')),
+            'skip_identical': bool(request.get('skip_identical', True))}
+
+
+# Get the result of the png export of two gerber sets as a dict that can be written as JSON, from the jobs and their
+# layers (see export_jobs()) and the results of the jobs (see run_export_jobs()): the result, the images, the change
+# report and the diff artifact of every layer ('layers') and the layers that aren't in both gerber sets ('missing').
+def export_results(jobs, job_layers, results):
+    layers = []
+    for job, index, result in zip(jobs, job_layers, results):
+        layers.append({'layer': filetypes[index][0], 'result': result, 'images': job['images'],
+                       'report': job['report'], 'diff': read_change_report(job['report']),
+                       'artifact': job.get('artifact')})
+    missing = [layer[0] for index, layer in enumerate(filetypes) if index not in job_layers]
+    return {'layers': layers, 'missing': missing}
+
+
+# Compare two gerber or drill files without rendering them (see gerberdiff.py). If 'drill' is given, the files are
+# compared hole by hole instead (see drilldiff.py), and 'drill' is a dict with the tolerances for
+# drilldiff.compare_files(), which may be empty. The changes are written as JSON to report_filepath if it is given.
+# Returns the result text for the layer.
+def vector_diff_layer(filepath1, filepath2, report_filepath=None, drill=None):
+    import gerber
+    import gerberdiff
+    import drilldiff
+
+    differ = gerberdiff if drill is None else drilldiff
+    try:
+        if drill is None:
+            result = gerberdiff.compare_files(filepath1, filepath2)
+        else:
+            result = drilldiff.compare_files(filepath1, filepath2, **drill)
+    except gerber.Unsupported as e:
+        print("Unable to compare", filepath1, "and", filepath2, "Error:", e)
+        return "Not supported by the vector diff: "+str(e)
+    except OSError as e:
+        print("Unable to compare", filepath1, "and", filepath2, "Error:", e)
+        return "Failed to compare files. Error: "+str(e)
+
+    if report_filepath:
+        with open(report_filepath, 'w') as f:
+            json.dump(differ.report(result), f, indent=1)
+    return differ.summary(result)
+
+
+# Get the revisions in a git revision range, like "v1.0..main", that have changed 'path' in the repository.
+# The first revision of the range is included as well, so "v1.0..v1.1" starts with v1.0. The revisions are ordered
+# from the oldest to the newest.
+def git_revisions(path, rev_range):
+    directory = path if os.path.isdir(path) else os.path.dirname(path)
+    name = '.' if os.path.isdir(path) else os.path.basename(path)
+    if '..' not in rev_range:
+        raise ValueError("A revision range like \"v1.0..main\" is needed, got \"" + rev_range + "\"")
+    first = rev_range.split('..')[0] or 'HEAD'
+    output = subprocess.check_output(['git', 'rev-list', '--reverse', '--first-parent', rev_range, '--', name],
+                                     cwd=directory, universal_newlines=True)
+    revisions = output.split()
+    first_revision = subprocess.check_output(['git', 'rev-parse', first + '^{commit}'], cwd=directory,
+                                             universal_newlines=True).strip()
+    if first_revision not in revisions:
+        revisions.insert(0, first_revision)
+    return revisions
+
+
+# Write the gerber files of 'path' in a revision of a git repository to target_dir, without changing the work tree.
+# 'path' is either a directory with the gerber files or a zip archive with the gerber files. The files are matched
+# with the layers in 'filetypes' like when 'path' is opened in the GUI, and only the files of the layers are extracted
+# from a zip archive (see open_gerber_set()).
+# Returns the path of the file of every layer in 'filetypes', or None for layers that don't have a file.
+def git_revision_files(path, revision, target_dir, filetypes):
+    directory = path if os.path.isdir(path) else os.path.dirname(path)
+    name = '.' if os.path.isdir(path) else os.path.basename(path)
+    os.makedirs(target_dir, exist_ok=True)
+    # Only the files directly in the directory are used, in the same way as when a directory is opened in the GUI
+    output = subprocess.check_output(['git', 'ls-tree', '-z', revision, '--', name], cwd=directory)
+    blobs = []
+    for entry in output.decode('utf-8').split('\0'):
+        if not entry:
+            continue
+        (info, filepath) = entry.split('\t', 1)
+        (mode, object_type, object_id) = info.split()
+        if object_type == 'blob':
+            blobs.append((os.path.basename(filepath), object_id))
+
+    def write_blob(object_id, filepath):
+        with open(filepath, 'wb') as f:
+            f.write(subprocess.check_output(['git', 'cat-file', 'blob', object_id], cwd=directory))
+
+    if os.path.isdir(path):
+        for (filename, object_id) in blobs:
+            write_blob(object_id, os.path.join(target_dir, filename))
+        layer_files = classify_files([filename for (filename, object_id) in blobs], filetypes,
+                                     lambda f: read_file_head(os.path.join(target_dir, f)))
+        return [None if filename is None else os.path.join(target_dir, filename) for filename in layer_files]
+    if not blobs:
+        raise ValueError(name + " isn't in revision " + revision)
+    # The zip archive is written next to target_dir, so that it isn't mistaken for one of the files
+    zip_filepath = target_dir.rstrip(os.sep) + ".zip"
+    write_blob(blobs[0][1], zip_filepath)
+    try:
+        members = zip_members(zip_filepath)
+        layer_files = classify_zip_files(zip_filepath, members, filetypes)
+        return [None if filename is None else extract_zip_member(zip_filepath, members[filename], target_dir, filename)
+                for filename in layer_files]
+    finally:
+        os.remove(zip_filepath)
+
+
+# Compare two images that have already been exported, and write them with the differences marked to the paths in
+# diff['outputs']. diff['source'] is the render of the first image (see render_images()). The diff is measured if
+# 'profile' is given (see profile_stage()). Returns the result text.
+def diff_exported_images(diff, profile=None):
+    import cv2  # opencv-python
+
+    images = []
+    for img in diff['images']:
+        with profile_stage(profile, 'imread', image=img):
+            images.append(cv2.imread(img))
+    for img, image in zip(diff['images'], images):
+        if image is None:
+            return "Failed to compare images. Error: Unable to read " + img
+    return diff_layer_images(diff['outputs'][0], diff['outputs'][1], None,
+                             diff.get('tile_size', default_ssim_tile_size), images, diff_report(diff, diff['source']),
+                             profile, mode=diff.get('diff_mode', 'ssim'))
+
+
+# Render a number of images and then compare pairs of them on a pool of workers, like the revisions of a git revision
+# range. A render has the GerbV 'args', the 'source', the 'image' and the 'renderer', and a diff has the two 'images',
+# the 'source' of the first one, the 'outputs' and the diff options of a job of run_export_jobs().
+# Returns the result text of every diff, in the same order as the diffs.
+def run_render_and_diff_jobs(renders, diffs, workers, progress=None, profile=None):
+    from concurrent.futures import as_completed
+
+    workers = max(1, int(workers))
+    total = len(renders) + len(diffs)
+    done = 0
+    context = new_render_context(renders[0].get('cache') if renders else None)
+    share_files(context, [[render['source']] for render in renders if render['renderer'] != 'gerbv'])
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(render_file, render['args'], render['source'], render['image'], render['renderer'],
+                                   context, layer_profile(profile, render['image'])): render
+                   for render in renders}
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                print("Unable to render", futures[future]['image'], "Error:", future.exception())
+            done = done + 1
+            if progress is not None:
+                progress(done, total)
+
+        futures = [executor.submit(diff_exported_images, diff, layer_profile(profile, diff['outputs'][0]))
+                   for diff in diffs]
+        results = []
+        for diff, future in zip(diffs, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print("Unable to compare", diff['images'][0], "and", diff['images'][1], "Error:", e)
+                results.append("Failed to compare images. Error: "+str(e))
+                write_failed_report(diff, diff['source'], results[-1])
+            done = done + 1
+            if progress is not None:
+                progress(done, total)
+    finish_render_context(context)
+    return results
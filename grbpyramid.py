@@ -0,0 +1,63 @@
+import json
+import os
+import shutil
+
+# Image pyramids of the exported images, which the viewer of GrbDiff shows one tile at a time
+
+
+# Size in pixels of the tiles of the image pyramids that are shown in the viewer of GrbDiff
+pyramid_tile_size = 256
+
+
+# Get the directory of the image pyramid of an exported image
+def pyramid_dir(img):
+    return os.path.splitext(img)[0] + ".tiles"
+
+
+# Get the path of a tile of the image pyramid of an exported image. The tile may not exist (see write_image_pyramid()).
+def pyramid_tile_path(img, level, row, column):
+    return os.path.join(pyramid_dir(img), str(level), str(row) + "_" + str(column) + ".png")
+
+
+# Write the image pyramid of an exported image: the image at full size (level 0) and scaled down by 2, 4, 8 ... until
+# it fits in one tile, cut into tiles of tile_size pixels (see pyramid_tile_path()). The size of the image, the tile
+# size, the number of levels and the background color are written to pyramid.json in the directory of the pyramid,
+# after all tiles. Tiles that only have the background color are left out, since large parts of a board are empty.
+# The image is read from img, unless it's given in 'image'.
+def write_image_pyramid(img, tile_size=pyramid_tile_size, image=None):
+    import cv2  # opencv-python
+
+    if image is None:
+        image = cv2.imread(img)
+    if image is None:
+        raise OSError("Unable to read " + img)
+    directory = pyramid_dir(img)
+    shutil.rmtree(directory, ignore_errors=True)
+    (height, width) = image.shape[:2]
+    (blue, green, red) = [int(value) for value in image[0, 0]]
+    level = 0
+    while True:
+        os.makedirs(os.path.join(directory, str(level)))
+        for y in range(0, image.shape[0], tile_size):
+            for x in range(0, image.shape[1], tile_size):
+                tile = image[y:y + tile_size, x:x + tile_size]
+                if (tile != image[0, 0]).any():
+                    cv2.imwrite(pyramid_tile_path(img, level, y // tile_size, x // tile_size), tile)
+        if max(image.shape[:2]) <= tile_size:
+            break
+        image = cv2.resize(image, ((image.shape[1] + 1) // 2, (image.shape[0] + 1) // 2), interpolation=cv2.INTER_AREA)
+        level = level + 1
+    info = {'width': width, 'height': height, 'tile_size': tile_size, 'levels': level + 1,
+            'background': "#{:02x}{:02x}{:02x}".format(red, green, blue)}
+    with open(os.path.join(directory, "pyramid.json"), 'w') as f:
+        json.dump(info, f)
+
+
+# Read the information about the image pyramid of an exported image (see write_image_pyramid()).
+# Returns None if the image doesn't have a pyramid.
+def read_image_pyramid(img):
+    try:
+        with open(os.path.join(pyramid_dir(img), "pyramid.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,161 @@
+import grbbitplane
+
+# Lining up the images of a layer that have moved or have different sizes, before they are compared (see
+# grbcore.diff_layer_images())
+
+
+# Largest size in pixels of the images used when estimating the translation between two images
+registration_size = 1024
+
+# Smallest response of the phase correlation for a translation to be trusted
+registration_min_response = 0.05
+
+
+# Estimate the translation of grayscale image b relative to grayscale image a. The images may have different sizes.
+# The translation is first estimated with phase correlation on copies of the images that are scaled down to at most
+# max_size pixels. It's then refined to sub-pixel precision with the ECC algorithm on a part of the images at full
+# resolution, since the sub-pixel estimate of the phase correlation is off by up to half a pixel on rendered images.
+# 'background' is the gray value of the background of both images, or None to use the upper left corner of each image.
+# Returns (dx, dy, response), where (dx, dy) is how far the contents of b are moved relative to a and response tells
+# how much the images look alike after moving (0-1).
+def estimate_shift(a, b, max_size=registration_size, background=None):
+    import numpy as np
+    import cv2  # opencv-python
+
+    # Compare the "ink" of the images: how much every pixel differs from the background, which is the color of the
+    # upper left corner unless it's given (the border of a rendered image is always background). The images are padded
+    # with no ink.
+    def ink(gray, scale, height, width):
+        background_value = gray[0, 0] if background is None else background
+        if scale != 1.0:
+            gray = cv2.resize(gray, (max(1, int(gray.shape[1]*scale)), max(1, int(gray.shape[0]*scale))),
+                              interpolation=cv2.INTER_AREA)
+        padded = np.zeros((height, width), dtype=np.float32)
+        padded[:gray.shape[0], :gray.shape[1]] = np.abs(gray.astype(np.float32) - float(background_value))
+        return padded
+
+    height = max(a.shape[0], b.shape[0])
+    width = max(a.shape[1], b.shape[1])
+    scale = min(1.0, float(max_size)/max(height, width))
+    h, w = max(1, int(height*scale)), max(1, int(width*scale))
+    (sx, sy), response = cv2.phaseCorrelate(ink(a, scale, h, w), ink(b, scale, h, w))
+    sx, sy = sx/scale, sy/scale
+
+    # Refine the translation on the middle of the part of the images that overlap
+    cx, cy = int(round(sx)), int(round(sy))
+    x0, x1 = max(0, -cx), min(a.shape[1], b.shape[1] - cx)
+    y0, y1 = max(0, -cy), min(a.shape[0], b.shape[0] - cy)
+    if x1 - x0 < 32 or y1 - y0 < 32:
+        return sx, sy, response
+    if x1 - x0 > max_size:
+        x0 = (x0 + x1 - max_size) // 2
+        x1 = x0 + max_size
+    if y1 - y0 > max_size:
+        y0 = (y0 + y1 - max_size) // 2
+        y1 = y0 + max_size
+    (background_a, background_b) = (a[0, 0], b[0, 0]) if background is None else (background, background)
+    crop_a = np.abs(a[y0:y1, x0:x1].astype(np.float32) - float(background_a))
+    crop_b = np.abs(b[y0+cy:y1+cy, x0+cx:x1+cx].astype(np.float32) - float(background_b))
+    warp = np.array([[1, 0, sx - cx], [0, 1, sy - cy]], dtype=np.float32)
+    try:
+        criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 50, 1e-4)
+        (correlation, warp) = cv2.findTransformECC(crop_a, crop_b, warp, cv2.MOTION_TRANSLATION, criteria, None, 5)
+    except cv2.error as e:
+        # Happens when there is nothing to line up in the part of the images, like when it's empty
+        print("Unable to refine the translation. Error:", e)
+        return sx, sy, response
+    # The refined translation must be close to the first estimate, which is within a pixel of the scaled down images
+    limit = 2.0/scale
+    if abs(warp[0, 2] - (sx - cx)) > limit or abs(warp[1, 2] - (sy - cy)) > limit:
+        return sx, sy, response
+    return cx + float(warp[0, 2]), cy + float(warp[1, 2]), response
+
+
+# Find how grayscale image b must be moved to line up with grayscale image a, and the common frame of both images.
+# Returns (offset of a, offset of b, (height, width) of the common frame, (dx, dy)) where the offsets are whole pixels
+# (x, y) in the common frame, and (dx, dy) is the translation of b with sub-pixel precision.
+# Returns None if the images are already lined up, or if no translation can be found.
+def register_images(a, b):
+    (sx, sy, response) = estimate_shift(a, b)
+    return registration_frame(a.shape[:2], b.shape[:2], sx, sy, response)
+
+
+# Get the registration (see register_images()) of an image of (height, width) size_b that is moved by (sx, sy) pixels
+# relative to an image of size_a, found with a response of the phase correlation (see estimate_shift()).
+def registration_frame(size_a, size_b, sx, sy, response):
+    dx, dy = int(round(sx)), int(round(sy))
+    print("Estimated translation:", format(sx, '.2f'), format(sy, '.2f'), "Response:", format(response, '.3f'))
+    if (response < registration_min_response or
+            (abs(sx) <= subpixel_threshold and abs(sy) <= subpixel_threshold and tuple(size_a) == tuple(size_b))):
+        return None
+    offset_a = (max(0, dx), max(0, dy))
+    offset_b = (offset_a[0] - dx, offset_a[1] - dy)
+    height = max(offset_a[1] + size_a[0], offset_b[1] + size_b[0])
+    width = max(offset_a[0] + size_a[1], offset_b[0] + size_b[1])
+    return (offset_a, offset_b, (height, width), (sx, sy))
+
+
+# Estimate the translation of the image of bitplane b relative to the image of bitplane a, like estimate_shift(),
+# without unpacking the bitplanes at full size. The translation is estimated on the images scaled down to at most
+# max_size pixels (see grbbitplane.bitplane_thumbnail()), and refined on the middle of the part of the images that
+# overlap, which is unpacked at full resolution by itself.
+# Returns (dx, dy, response) like estimate_shift().
+def estimate_bitplane_shift(plane_a, width_a, plane_b, width_b, max_size=registration_size):
+    import math
+
+    (height_a, height_b) = (plane_a.shape[0], plane_b.shape[0])
+    factor = max(1, int(math.ceil(max(height_a, height_b, width_a, width_b)/float(max_size))))
+    (sx, sy, response) = estimate_shift(grbbitplane.bitplane_thumbnail(plane_a, width_a, factor),
+                                        grbbitplane.bitplane_thumbnail(plane_b, width_b, factor), max_size, 0)
+    if factor == 1:
+        return sx, sy, response
+    (sx, sy) = (sx*factor, sy*factor)
+    cx, cy = int(round(sx)), int(round(sy))
+    x0, x1 = max(0, -cx), min(width_a, width_b - cx)
+    y0, y1 = max(0, -cy), min(height_a, height_b - cy)
+    if x1 - x0 < 32 or y1 - y0 < 32:
+        return sx, sy, response
+    if x1 - x0 > max_size:
+        x0 = (x0 + x1 - max_size) // 2
+        x1 = x0 + max_size
+    if y1 - y0 > max_size:
+        y0 = (y0 + y1 - max_size) // 2
+        y1 = y0 + max_size
+    window_a = grbbitplane.unpack_bitplane_window(plane_a, x0, y0, x1, y1)
+    window_b = grbbitplane.unpack_bitplane_window(plane_b, x0 + cx, y0 + cy, x1 + cx, y1 + cy)
+    (rx, ry, refined) = estimate_shift(window_a, window_b, max_size, 0)
+    # The refined translation must be close to the first estimate, which is within a pixel of the scaled down images
+    if refined < registration_min_response or abs(rx) > 2*factor or abs(ry) > 2*factor:
+        return sx, sy, response
+    return cx + rx, cy + ry, response
+
+
+# Find how the image of bitplane b must be moved to line up with the image of bitplane a, like register_images(), but
+# without unpacking the bitplanes at full size (see estimate_bitplane_shift())
+def register_bitplanes(plane_a, width_a, plane_b, width_b):
+    (sx, sy, response) = estimate_bitplane_shift(plane_a, width_a, plane_b, width_b)
+    return registration_frame((plane_a.shape[0], width_a), (plane_b.shape[0], width_b), sx, sy, response)
+
+
+# Smallest part of a pixel that an image is moved by when lining it up. Resampling an image makes its edges a bit
+# blurry, which is worse than a small misalignment.
+subpixel_threshold = 0.25
+
+
+# Move an image by (dx, dy) pixels and place it at a whole pixel offset (x, y) in a larger frame of (height, width).
+# The part of the translation that isn't whole pixels is done by resampling the image, if it's large enough.
+# The rest of the frame is filled with the background color, which is the color of the upper left corner of the image.
+def place_image(image, offset, size, translation=(0.0, 0.0)):
+    import numpy as np
+    import cv2  # opencv-python
+
+    fx = translation[0] - round(translation[0])
+    fy = translation[1] - round(translation[1])
+    if abs(fx) > subpixel_threshold or abs(fy) > subpixel_threshold:
+        warp = np.array([[1, 0, -fx], [0, 1, -fy]], dtype=np.float32)
+        image = cv2.warpAffine(image, warp, (image.shape[1], image.shape[0]), flags=cv2.INTER_LINEAR,
+                               borderMode=cv2.BORDER_REPLICATE)
+    placed = np.empty(size + image.shape[2:], dtype=image.dtype)
+    placed[:] = image[0, 0]
+    placed[offset[1]:offset[1] + image.shape[0], offset[0]:offset[0] + image.shape[1]] = image
+    return placed
@@ -0,0 +1,223 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import grbcore
+
+# A local service that runs the png export of GrbDiff for other programs, like a CI job. Opened gerber sets, parsed
+# files and rendered images are kept in memory between the diffs.
+#
+# python grbservice.py [--port PORT] [--settings settings.ini] [--output DIR] [--jobs N] [--memory-cache MB]
+#
+# The service only listens on localhost. A diff is started with a POST to /diff with a JSON object:
+#     {"gerber1": "C:\\gerbers\\rev-a.zip", "gerber2": "C:\\gerbers\\rev-b.zip", "dpi": 300, "template": 0}
+# "gerber1" and "gerber2" are zip archives, directories or gerber files in a directory, like in GrbDiff. The other
+# keys are optional: "dpi", "coarse_dpi", "template" (the index of the png color template), "renderer" (see
+# grbcore.renderers), "merge_distance", "diff_mode" (see grbcore.diff_modes), "output" (the directory of the images
+# and change reports), "png" (false to only write the change reports), "pyramids" (true to write the tiles for the
+# viewer of GrbDiff), "artifact" (true to write a diff artifact of every layer, see grbartifact.py),
+# "skip_identical" (false to render and compare layers whose files are identical) and "wait".
+# The settings that aren't given are taken from settings.ini, like in GrbDiff.
+# The answer is the job with the result of every layer, the paths of its images and its change report. With "wait":
+# false the answer is sent at once, and the job can be read with a GET of /jobs/<id> until its "status" is "done".
+# A GET of /status gives the number of jobs and the usage of the caches.
+
+# Number of opened gerber sets that are kept
+gerber_set_cache_size = 16
+
+# Number of finished jobs that are kept, so that they can be read from /jobs/<id>
+finished_jobs_size = 256
+
+
+# The state of the service: the settings, the caches and the jobs
+service = {'settings': None, 'output': None, 'memory': None, 'executor': None, 'workers': 1,
+           'lock': threading.Lock(), 'gerber_sets': OrderedDict(), 'jobs': OrderedDict()}
+
+
+# Get a key that changes when the files of a gerber set (see grbcore.open_gerber_set()) are changed, from the size
+# and modification time of the zip archive or of the files in the directory
+def gerber_set_key(path):
+    path = os.path.abspath(path)
+    if path.endswith(".zip"):
+        return (path, grbcore.path_signature(path))
+    directory = path if os.path.isdir(path) else os.path.dirname(path)
+    return (directory, grbcore.path_signature(directory))
+
+
+# Open a gerber set, or get it from the gerber sets that have been opened before if its files haven't changed.
+# The set is marked as used until release_gerber_set() is called, so that its extracted files aren't removed.
+def acquire_gerber_set(path):
+    key = gerber_set_key(path)
+    with service['lock']:
+        entry = service['gerber_sets'].get(key)
+        if entry is not None:
+            service['gerber_sets'].move_to_end(key)
+            entry['users'] += 1
+            print("Using the opened gerber set", path)
+            return entry
+    entry = {'key': key, 'set': grbcore.open_gerber_set(path, grbcore.filetypes), 'users': 1}
+    with service['lock']:
+        if key in service['gerber_sets']:
+            # Opened by another job at the same time
+            if entry['set']['temp_dir']:
+                grbcore.remove_dir_later(entry['set']['temp_dir'])
+            entry = service['gerber_sets'][key]
+            entry['users'] += 1
+            return entry
+        service['gerber_sets'][key] = entry
+        # Remove the least recently used sets that aren't used by a job
+        for old_key in list(service['gerber_sets']):
+            if len(service['gerber_sets']) <= gerber_set_cache_size:
+                break
+            old = service['gerber_sets'][old_key]
+            if old['users'] == 0:
+                del service['gerber_sets'][old_key]
+                if old['set']['temp_dir']:
+                    grbcore.remove_dir_later(old['set']['temp_dir'])
+    return entry
+
+
+def release_gerber_set(entry):
+    with service['lock']:
+        entry['users'] -= 1
+
+
+# Run a diff job on a worker of the service
+def run_job(job, request):
+    job['status'] = 'running'
+    started = time.perf_counter()
+    entries = []
+    try:
+        options = grbcore.request_export_options(service['settings'], request, service['memory'])
+        entries = [acquire_gerber_set(request['gerber1']), acquire_gerber_set(request['gerber2'])]
+        os.makedirs(job['output'], exist_ok=True)
+        (jobs, job_layers) = grbcore.export_jobs(entries[0]['set'], entries[1]['set'], job['output'], options)
+        print("Job", job['id'], "exports", len(jobs), "layers to", job['output'])
+        workers = int(service['settings']['OTHER'].get('png_export_workers'))
+        results = grbcore.run_export_jobs(jobs, workers)
+        job.update(grbcore.export_results(jobs, job_layers, results))
+        job['status'] = 'done'
+    except Exception as e:
+        print("Job", job['id'], "failed. Error:", e)
+        job['error'] = str(e)
+        job['status'] = 'failed'
+    finally:
+        for entry in entries:
+            release_gerber_set(entry)
+    job['seconds'] = round(time.perf_counter() - started, 3)
+    job['memory_cache'] = grbcore.memory_cache_stats(service['memory'])
+    print("Job", job['id'], job['status'], "in", job['seconds'], "s")
+    job['done'].set()
+
+
+# Queue a diff job. Returns the job, which is filled in when it's done.
+def submit_job(request):
+    for name in ('gerber1', 'gerber2'):
+        if not isinstance(request.get(name), str) or not os.path.exists(request[name]):
+            raise ValueError("No such gerber file or directory: " + str(request.get(name)))
+    job_id = uuid.uuid4().hex[:12]
+    output = request.get('output') or os.path.join(service['output'], job_id)
+    job = {'id': job_id, 'status': 'queued', 'gerber1': request['gerber1'], 'gerber2': request['gerber2'],
+           'output': os.path.abspath(output), 'done': threading.Event()}
+    with service['lock']:
+        service['jobs'][job_id] = job
+        while len(service['jobs']) > finished_jobs_size:
+            old_id = next((key for key, old in service['jobs'].items() if old['done'].is_set()), None)
+            if old_id is None:
+                break
+            del service['jobs'][old_id]
+    service['executor'].submit(run_job, job, request)
+    return job
+
+
+# Get a job as a dict that can be sent as JSON
+def job_json(job):
+    return {key: value for key, value in job.items() if key != 'done'}
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    def send_json(self, status, content):
+        data = json.dumps(content, indent=1).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/status':
+            with service['lock']:
+                jobs = list(service['jobs'].values())
+                gerber_sets = len(service['gerber_sets'])
+            self.send_json(200, {'queued': sum(1 for job in jobs if job['status'] == 'queued'),
+                                 'running': sum(1 for job in jobs if job['status'] == 'running'),
+                                 'workers': service['workers'], 'gerber_sets': gerber_sets,
+                                 'memory_cache': grbcore.memory_cache_stats(service['memory'])})
+        elif self.path.startswith('/jobs/'):
+            with service['lock']:
+                job = service['jobs'].get(self.path[len('/jobs/'):])
+            if job is None:
+                self.send_json(404, {'error': "No such job"})
+            else:
+                self.send_json(200, job_json(job))
+        else:
+            self.send_json(404, {'error': "Unknown path " + self.path})
+
+    def do_POST(self):
+        if self.path != '/diff':
+            self.send_json(404, {'error': "Unknown path " + self.path})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', '0'))
+            request = json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+            if not isinstance(request, dict):
+                raise ValueError("The request must be a JSON object")
+            job = submit_job(request)
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        if request.get('wait', True):
+            job['done'].wait()
+            self.send_json(200, job_json(job))
+        else:
+            self.send_json(202, job_json(job))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Local diff service of GrbDiff")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--settings', default="settings.ini", help="settings of GrbDiff to use")
+    parser.add_argument('--output', default="", help="where the images of the jobs are written (default: the export "
+                                                     "png dir of the settings)")
+    parser.add_argument('--jobs', type=int, default=1, help="number of diffs that run at the same time")
+    parser.add_argument('--memory-cache', type=float, default=grbcore.default_memory_cache_size,
+                        help="size in MB of the cache of parsed files and rendered images")
+    options = parser.parse_args(argv)
+
+    service['settings'] = grbcore.read_settings(options.settings)
+    service['output'] = options.output or service['settings']['PATHS'].get('png_export_path') or "GrbDiff-service"
+    service['memory'] = grbcore.new_memory_cache(options.memory_cache)
+    service['workers'] = max(1, options.jobs)
+    service['executor'] = ThreadPoolExecutor(max_workers=service['workers'])
+
+    server = ThreadingHTTPServer(('127.0.0.1', options.port), ServiceHandler)
+    print("GrbDiff service listening on http://127.0.0.1:" + str(server.server_address[1]), "Writing to",
+          os.path.abspath(service['output']))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    service['executor'].shutdown(wait=False)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,63 @@
+import argparse
+import os
+import sys
+from zipfile import BadZipFile, ZipFile
+
+import grbartifact
+
+# Make the full size png images of a layer again from its diff artifact (see grbartifact.py), for when the png export
+# only kept the artifacts, like in CI. The parts of the images around the changes are the same as the full size images
+# of the export. The rest of the images (where image 1 and 2 are the same) is scaled up from the low resolution
+# overview, so it's lossy: fine lines and the edges of pads are blurred there.
+#
+# python grbunpack.py ARTIFACT [--output DIR] [--images 1,2,combined]
+#
+# The images are written as <Layer>-1.png, <Layer>-2.png and <Layer>-combined.png, like the png export writes them,
+# to the output dir (the directory of the artifact by default). The images of the windows of a coarse to fine diff
+# are written there as well.
+
+
+def main(argv):
+    import cv2  # opencv-python
+
+    parser = argparse.ArgumentParser(description="Make the png images of a layer from its GrbDiff diff artifact. "
+                                     "The parts of the images around the changes are exact. The unchanged parts are "
+                                     "scaled up from a low resolution overview, so they are lossy.")
+    parser.add_argument('artifact', help="diff artifact of a layer, like Copper_Layer_L1-diff.zip")
+    parser.add_argument('--output', default="", help="where the images are written (default: next to the artifact)")
+    parser.add_argument('--images', default="", help="names of the images to make, like 1,2 (default: all)")
+    options = parser.parse_args(argv)
+
+    try:
+        content = grbartifact.read_diff_artifact(options.artifact)
+    except (OSError, ValueError, KeyError, BadZipFile) as e:
+        print("Unable to read the diff artifact", options.artifact, "Error:", e)
+        return 1
+    output = options.output or os.path.dirname(os.path.abspath(options.artifact))
+    os.makedirs(output, exist_ok=True)
+    layer = os.path.basename(options.artifact)
+    if layer.endswith("-diff.zip"):
+        layer = layer[:-len("-diff.zip")]
+    names = [name for name in options.images.split(",") if name] or [image['name'] for image in content['images']]
+    for name in names:
+        try:
+            image = grbartifact.reconstruct_artifact_image(options.artifact, name)
+        except (OSError, ValueError, KeyError, BadZipFile) as e:
+            print("Unable to make image", name, "of", options.artifact, "Error:", e)
+            return 1
+        filepath = os.path.join(output, layer + "-" + name + ".png")
+        if not cv2.imwrite(filepath, image):
+            print("Unable to write", filepath)
+            return 1
+        print("Wrote", filepath, image.shape[1], "x", image.shape[0])
+    with ZipFile(options.artifact) as archive:
+        for window in content.get('windows', []):
+            filepath = os.path.join(output, os.path.basename(window))
+            with open(filepath, 'wb') as f:
+                f.write(archive.read(window))
+            print("Wrote", filepath)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
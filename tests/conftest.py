@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules of GrbDiff are in the directory above the tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,64 @@
+import os
+
+import cv2
+import numpy as np
+
+import grbartifact
+import grbcore
+
+# Tests of writing the diff artifact of a layer and making its images again (see grbartifact.py)
+
+
+# Images 1 and 2 of a synthetic layer, where two pads have moved in image 2
+def layer_images():
+    image1 = np.zeros((600, 900, 3), dtype=np.uint8)
+    for x in range(40, 880, 60):
+        for y in range(40, 580, 90):
+            cv2.rectangle(image1, (x, y), (x + 30, y + 20), (0, 200, 255), -1)
+    cv2.line(image1, (20, 300), (880, 320), (0, 200, 255), 5)
+    image2 = image1.copy()
+    for (x, y) in ((100, 130), (700, 490)):
+        cv2.rectangle(image2, (x, y), (x + 30, y + 20), (0, 0, 0), -1)
+        cv2.rectangle(image2, (x + 7, y + 4), (x + 37, y + 24), (0, 200, 255), -1)
+    return image1, image2
+
+
+def write_artifact(tmp_path, images, regions, **sizes):
+    filepath = str(tmp_path / "Layer-diff.zip")
+    imgs = [str(tmp_path / ("Layer-" + name + ".png")) for name in ("1", "2")]
+    content = grbartifact.write_diff_artifact(filepath, imgs, images, regions=[regions]*len(images), **sizes)
+    return filepath, content
+
+
+def test_the_changes_are_exact_and_the_rest_is_scaled_up(tmp_path):
+    images = layer_images()
+    thresh = (images[0] != images[1]).any(axis=2).astype(np.uint8)*255
+    regions = grbcore.change_regions(thresh, 4)
+    assert len(regions) == 2
+    (filepath, content) = write_artifact(tmp_path, images, regions, tile_size=64, overview_size=256)
+    assert [image['name'] for image in content['images']] == ["1", "2"]
+    for (name, image) in zip(("1", "2"), images):
+        rebuilt = grbartifact.reconstruct_artifact_image(filepath, name)
+        assert rebuilt.shape == image.shape
+        for (x, y, w, h, pixels) in regions:
+            assert np.array_equal(rebuilt[y:y + h, x:x + w], image[y:y + h, x:x + w])
+        # The rest is scaled up from the overview, so it's only close to the image
+        assert not np.array_equal(rebuilt, image)
+        assert np.abs(rebuilt.astype(int) - image).mean() < 20
+    # Only the tiles around the changes are kept
+    assert 0 < sum(len(image['tiles']) for image in content['images']) <= 2*2*4
+    assert os.path.getsize(filepath) < sum(len(cv2.imencode(".png", image)[1]) for image in images)
+
+
+def test_unchanged_layer_has_no_tiles(tmp_path):
+    images = layer_images()
+    (filepath, content) = write_artifact(tmp_path, [images[0], images[0]], [], tile_size=64, overview_size=256)
+    assert all(image['tiles'] == [] and image['scale'] == 4 for image in content['images'])
+    assert grbartifact.reconstruct_artifact_image(filepath, "2").shape == images[0].shape
+
+
+def test_small_images_are_kept_as_they_are(tmp_path):
+    images = layer_images()
+    (filepath, content) = write_artifact(tmp_path, images, [], tile_size=64, overview_size=1024)
+    for (name, image) in zip(("1", "2"), images):
+        assert np.array_equal(grbartifact.reconstruct_artifact_image(filepath, name), image)
@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+import pytest
+
+import grbcore
+
+# Tests of the render cache of the png export (see grbcore.render_cache_key() and render_cache_store())
+
+
+@pytest.fixture
+def render(tmp_path):
+    (tmp_path / "layer.gbr").write_text("%FSLAX46Y46*%\n%MOMM*%\n%ADD10C,0.5*%\nD10*\nX0Y0D03*\nM02*\n")
+    (tmp_path / "outline.gbr").write_text("%FSLAX46Y46*%\n%MOMM*%\n%ADD10C,0.1*%\nD10*\nX0Y0D02*\nX1Y0D01*\nM02*\n")
+    return {'files': [str(tmp_path / "layer.gbr"), str(tmp_path / "outline.gbr")], 'colors': ["#FF0000", "#FF0000"],
+            'bg_color': "#000000", 'dpi': "300"}
+
+
+def key(render, renderer='native'):
+    return grbcore.render_cache_key(renderer, render, {})
+
+
+def test_moved_files_have_the_same_key(render, tmp_path):
+    original = key(render)
+    (tmp_path / "moved").mkdir()
+    moved = []
+    for filepath in render['files']:
+        moved.append(str(tmp_path / "moved" / ("renamed-" + os.path.basename(filepath))))
+        os.replace(filepath, moved[-1])
+    assert key(dict(render, files=moved)) == original
+
+
+@pytest.mark.parametrize('change', [
+    {'dpi': "600"}, {'colors': ["#00FF00", "#FF0000"]}, {'bg_color': "#FFFFFF"}, {'frame': (0.0, 0.0, 100, 100)}])
+def test_settings_change_the_key(render, change):
+    assert key(render) != key(dict(render, **change))
+
+
+def test_contents_and_renderer_change_the_key(render):
+    original = key(render)
+    assert key(render, 'gerbv') != original
+    with open(render['files'][0], 'a') as f:
+        f.write("G04 A comment*\n")
+    assert key(render) != original
+
+
+# An image that doesn't compress, so that its png file has a known size
+def noise(seed):
+    return np.random.default_rng(seed).integers(0, 256, (64, 64, 3)).astype(np.uint8)
+
+
+def test_least_recently_used_renders_are_removed(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    images = {name: noise(seed) for seed, name in enumerate(("a", "b", "c"))}
+    grbcore.render_cache_store((cache_dir, 1000), "a", image=images["a"])
+    size = os.path.getsize(grbcore.render_cache_path((cache_dir, 0), "a"))
+    # Room for two renders
+    cache = (cache_dir, 2.5*size/1024/1024)
+    grbcore.render_cache_store(cache, "b", image=images["b"])
+    os.utime(grbcore.render_cache_path(cache, "a"), (1000, 1000))
+    os.utime(grbcore.render_cache_path(cache, "b"), (2000, 2000))
+    # Using render a makes b the least recently used
+    assert grbcore.render_cache_fetch(cache, "a", str(tmp_path / "a.png"))
+    grbcore.render_cache_store(cache, "c", image=images["c"])
+    assert sorted(os.listdir(cache_dir)) == ["a.png", "c.png"]
+    assert grbcore.render_cache_load(cache, "b") is None
+    assert not grbcore.render_cache_fetch(cache, "b", str(tmp_path / "b.png"))
+    assert np.array_equal(grbcore.render_cache_load(cache, "c"), images["c"])
+    with open(str(tmp_path / "a.png"), 'rb') as f, open(grbcore.render_cache_path(cache, "a"), 'rb') as cached:
+        assert f.read() == cached.read()
+
+
+def test_a_render_larger_than_the_cache_is_kept(tmp_path):
+    cache = (str(tmp_path / "cache"), 0.001)
+    grbcore.render_cache_store(cache, "a", image=noise(0))
+    grbcore.render_cache_store(cache, "b", image=noise(1))
+    assert os.listdir(cache[0]) == ["b.png"]
@@ -0,0 +1,98 @@
+import builtins
+
+import pytest
+
+import drilldiff
+
+# Tests of the comparison of drill files hole by hole (see drilldiff.py). Holes are (x, y, diameter, slot) in inches.
+
+
+def hit(x, y, diameter):
+    return (x/25.4, y/25.4, diameter/25.4, None)
+
+
+def slot(x1, y1, x2, y2, diameter):
+    return ((x1 + x2)/2/25.4, (y1 + y2)/2/25.4, diameter/25.4, (x1/25.4, y1/25.4, x2/25.4, y2/25.4))
+
+
+def counts(result):
+    return (result['unchanged'], len(result['removed']), len(result['added']), len(result['moved']),
+            len(result['resized']))
+
+
+@pytest.fixture(params=['kdtree', 'grid'])
+def near_pairs(request, monkeypatch):
+    # Without scipy the nearest holes are found with a grid of cells, which must find the same pairs
+    if request.param == 'grid':
+        import_module = builtins.__import__
+
+        def no_scipy(name, *args, **kwargs):
+            if name.startswith('scipy'):
+                raise ImportError(name)
+            return import_module(name, *args, **kwargs)
+
+        monkeypatch.setattr(builtins, '__import__', no_scipy)
+    return request.param
+
+
+def test_identical_holes(near_pairs):
+    holes = [hit(0, 0, 0.8), hit(10, 5, 1.0), slot(0, 0, 2, 0, 0.6)]
+    result = drilldiff.compare(holes, list(reversed(holes)))
+    assert counts(result) == (3, 0, 0, 0, 0)
+    assert drilldiff.summary(result) == "Identical. 3 holes."
+
+
+def test_holes_drilled_twice(near_pairs):
+    result = drilldiff.compare([hit(0, 0, 0.8), hit(0, 0, 0.8)], [hit(0, 0, 0.8)])
+    assert counts(result) == (1, 1, 0, 0, 0)
+
+
+def test_holes_within_the_tolerances_are_unchanged(near_pairs):
+    result = drilldiff.compare([hit(0, 0, 0.8), hit(10, 0, 0.8)], [hit(0.003, 0, 0.8), hit(10, 0, 0.804)])
+    assert counts(result) == (2, 0, 0, 0, 0)
+    result = drilldiff.compare([hit(0, 0, 0.8)], [hit(0.003, 0, 0.8)], position_tolerance=0.001)
+    assert counts(result) == (0, 0, 0, 1, 0)
+
+
+def test_nearest_holes_are_moved_or_resized(near_pairs):
+    holes1 = [hit(0, 0, 0.8), hit(10, 0, 0.8), hit(20, 0, 0.8)]
+    holes2 = [hit(0.1, 0, 0.8), hit(10, 0, 1.0), hit(21, 0, 0.8)]
+    result = drilldiff.compare(holes1, holes2)
+    assert counts(result) == (0, 1, 1, 1, 1)
+    assert result['moved'] == [(holes1[0], holes2[0])]
+    assert result['resized'] == [(holes1[1], holes2[1])]
+    assert result['removed'] == [holes1[2]] and result['added'] == [holes2[2]]
+    assert drilldiff.report(result)['moved'][0]['distance_mm'] == pytest.approx(0.1)
+
+
+def test_nearest_hole_is_matched_first(near_pairs):
+    # Both holes of gerber 2 are within the match distance of the hole of gerber 1, the nearest one is matched
+    holes1 = [hit(0, 0, 0.8)]
+    holes2 = [hit(0.3, 0, 0.8), hit(0.1, 0, 0.8)]
+    result = drilldiff.compare(holes1, holes2)
+    assert result['moved'] == [(holes1[0], holes2[1])]
+    assert result['added'] == [holes2[0]]
+
+
+def test_slots(near_pairs):
+    result = drilldiff.compare([slot(0, 0, 2, 0, 0.6)], [slot(0, 0, 2, 0, 0.6), hit(1, 0, 0.6)])
+    assert counts(result) == (1, 0, 1, 0, 0)
+    # A slot that is turned around its middle has moved, and one whose length has changed has been resized
+    result = drilldiff.compare([slot(0, 0, 2, 0, 0.6), slot(10, 0, 12, 0, 0.6)],
+                               [slot(1, -1, 1, 1, 0.6), slot(10, 0, 12.2, 0, 0.6)])
+    assert counts(result) == (0, 0, 0, 1, 1)
+    # The ends of a slot may be in either order
+    result = drilldiff.compare([slot(0, 0, 2, 0, 0.6)], [slot(2, 0, 0, 0, 0.6)])
+    assert counts(result) == (1, 0, 0, 0, 0)
+    # A slot is never matched with a drill hit
+    result = drilldiff.compare([slot(0, 0, 0.1, 0, 0.6)], [hit(0.05, 0, 0.6)])
+    assert counts(result) == (0, 1, 1, 0, 0)
+
+
+def test_compare_files(tmp_path):
+    drill1 = tmp_path / "1.drl"
+    drill2 = tmp_path / "2.drl"
+    drill1.write_text("M48\nMETRIC,TZ\nT1C0.800\n%\nT1\nX10.0Y5.0\nX20.0Y5.0\nM30\n")
+    drill2.write_text("M48\nMETRIC,TZ\nT1C0.800\n%\nT1\nX10.0Y5.0\nX20.2Y5.0\nM30\n")
+    result = drilldiff.compare_files(str(drill1), str(drill2))
+    assert drilldiff.summary(result) == "0 added, 0 removed, 1 moved, 0 resized, 1 unchanged holes."
@@ -0,0 +1,130 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import benchmark
+import grbcore
+
+# Tests of the png export (see grbcore.run_export_jobs()) and of planning it for the available memory (see
+# grbcore.plan_export_jobs()) on a small generated board (see benchmark.py), rendered by the GerbV stand-in of
+# benchmark.py or the built-in renderer
+
+
+@pytest.fixture(scope='module')
+def board(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("board")
+    filelist = benchmark.generate_board(str(directory), size=20.0, copper_layers=2, density=4.0, change=0.2)
+    layers = [filename for (filename, file_function, kind) in benchmark.board_layers(2) if kind != 'outline']
+    return str(directory), benchmark.write_gerbv_stand_in(str(directory)), layers, filelist
+
+
+# Get the export jobs of every layer of the board, with the images in export_dir
+def layer_jobs(board, export_dir, renderer, mode, dpi=600):
+    (board_dir, gerbv, layers, filelist) = board
+    jobs = []
+    for filename in layers:
+        sources = benchmark.layer_sources(board_dir, filename, dpi)
+        images = [os.path.join(export_dir, filename.replace(".", "_") + "-" + sel + ".png")
+                  for sel in ('1', '2', 'combined')]
+        renders = [grbcore.gerbv_export_args(gerbv, source['files'], source['colors'], source['bg_color'], dpi, image)
+                   for source, image in zip(sources, images)]
+        jobs.append({'renders': renders, 'sources': sources, 'images': images, 'renderer': renderer,
+                     'diff_mode': mode, 'report': os.path.join(export_dir, filename + "-diff.json")})
+    return jobs
+
+
+# Export every layer of the board to export_dir and get the results, and the contents of every file that was written
+def export(board, export_dir, renderer, mode, workers):
+    os.makedirs(export_dir)
+    results = grbcore.run_export_jobs(layer_jobs(board, export_dir, renderer, mode), workers)
+    files = {}
+    for filename in sorted(os.listdir(export_dir)):
+        with open(os.path.join(export_dir, filename), 'rb') as f:
+            files[filename] = f.read()
+    return results, files
+
+
+@pytest.mark.parametrize('renderer,mode', [('gerbv', 'ssim'), ('native', 'ssim'), ('native', 'exact')])
+def test_parallel_export_is_the_same_as_serial(board, tmp_path, renderer, mode):
+    (serial_results, serial_files) = export(board, str(tmp_path / "serial"), renderer, mode, 1)
+    (parallel_results, parallel_files) = export(board, str(tmp_path / "parallel"), renderer, mode, 4)
+    assert all(result.startswith("OK.") for result in serial_results)
+    assert parallel_results == serial_results
+    assert sorted(parallel_files) == sorted(serial_files)
+    assert sum(filename.endswith(".png") for filename in serial_files) == 3*len(board[2])
+    for filename, content in serial_files.items():
+        if filename.endswith(".json"):
+            # The reports are the same, scores included, apart from the paths of the images
+            (serial, parallel) = (json.loads(content), json.loads(parallel_files[filename]))
+            assert json.dumps(parallel).replace("parallel", "serial") == json.dumps(serial)
+        else:
+            assert parallel_files[filename] == content, filename
+
+
+def plan(jobs, budget):
+    return grbcore.plan_export_jobs(jobs, [None]*len(jobs), budget)
+
+
+def test_jobs_that_fit_are_not_changed(board, tmp_path):
+    jobs = layer_jobs(board, str(tmp_path), 'native', 'ssim')
+    (planned, estimates, budget) = plan(jobs, 1 << 40)
+    assert planned == jobs
+    assert all(estimate == grbcore.estimate_job_memory(job) > 0 for job, estimate in zip(jobs, estimates))
+
+
+def test_a_job_that_doesnt_fit_is_changed_to_coarse_to_fine(board, tmp_path):
+    jobs = layer_jobs(board, str(tmp_path), 'native', 'exact')
+    estimate = max(grbcore.estimate_job_memory(job) for job in jobs)
+    (planned, estimates, budget) = plan(jobs, estimate // 4)
+    for job in planned:
+        # A quarter of the memory is at most half the dpi
+        coarse_dpi = job['sources'][0]['dpi']
+        assert job['fine_dpi'] == "600" and 250 < int(coarse_dpi) <= 300
+        assert [source['dpi'] for source in job['sources']] == [coarse_dpi]*len(job['sources'])
+        assert all("--dpi=" + coarse_dpi in render for render in job['renders'])
+    assert all(0 < value <= budget for value in estimates)
+
+
+def test_jobs_of_unknown_size_are_not_changed(board, tmp_path):
+    jobs = layer_jobs(board, str(tmp_path), 'native', 'ssim')
+    jobs = [dict(job, sources=[dict(source, files=[str(tmp_path / "missing.gbr")]) for source in job['sources']])
+            for job in jobs]
+    (planned, estimates, budget) = plan(jobs, 1000)
+    assert planned == jobs and estimates == [0]*len(jobs)
+
+
+# Run the export with the memory budget of 'layers' layers at a time, and get the largest number of layers that were
+# compared at the same time
+def layers_at_once(board, export_dir, monkeypatch, layers):
+    jobs = layer_jobs(board, export_dir, 'native', 'exact')
+    estimate = max(grbcore.estimate_job_memory(job) for job in jobs)
+    monkeypatch.setattr(grbcore, 'available_memory', lambda: (layers + 0.5)*estimate/grbcore.export_memory_fraction)
+    diff_layer_images = grbcore.diff_layer_images
+    running = {'now': 0, 'most': 0}
+    lock = threading.Lock()
+
+    def diff(*args, **kwargs):
+        with lock:
+            running['now'] += 1
+            running['most'] = max(running['most'], running['now'])
+        # Long enough for the other layers to be started, if they fit
+        time.sleep(0.3)
+        try:
+            return diff_layer_images(*args, **kwargs)
+        finally:
+            with lock:
+                running['now'] -= 1
+
+    monkeypatch.setattr(grbcore, 'diff_layer_images', diff)
+    os.makedirs(export_dir)
+    results = grbcore.run_export_jobs(jobs, 4)
+    assert all(result.startswith("OK.") for result in results)
+    return running['most']
+
+
+def test_layers_wait_for_memory(board, tmp_path, monkeypatch):
+    assert layers_at_once(board, str(tmp_path / "one"), monkeypatch, 1) == 1
+    assert layers_at_once(board, str(tmp_path / "all"), monkeypatch, len(board[2])) > 1
@@ -0,0 +1,154 @@
+import pytest
+
+import gerber
+import grbcore
+
+# Tests of the fingerprints of Gerber and Excellon files (see gerber.fingerprint_file()), which must be the same for
+# files that draw the same image and differ for files that don't, and of finding the layers with identical files with
+# them (see grbcore.identical_renders())
+
+
+@pytest.fixture
+def fingerprint(tmp_path):
+    files = []
+
+    def fingerprint_data(data):
+        filepath = tmp_path / (str(len(files)) + ".gbr")
+        filepath.write_bytes(data.encode('latin-1'))
+        files.append(filepath)
+        return gerber.fingerprint_file(str(filepath))
+
+    return fingerprint_data
+
+
+def gerber_data(*blocks, header="%FSLAX46Y46*%\n%MOMM*%"):
+    return header + "\n" + "\n".join(blocks) + "\nM02*\n"
+
+
+# A copper layer with a circle, a rectangle and a macro aperture
+apertures = ("%ADD10C,0.5*%", "%ADD11R,1.0X2.0*%", "%AMTHERMAL*1,1,$1,0,0*1,0,$2,0,0*%", "%ADD12THERMAL,1.5X1.0*%")
+operations = ("D10*", "X0Y0D02*", "X10000000Y0D01*", "D11*", "X5000000Y5000000D03*", "D12*", "X0Y5000000D03*")
+
+
+def test_the_same_file_has_the_same_fingerprint(fingerprint):
+    assert fingerprint(gerber_data(*apertures, *operations)) == fingerprint(gerber_data(*apertures, *operations))
+
+
+def test_renumbered_apertures(fingerprint):
+    renumbered = ("%ADD21C,0.5*%", "%ADD17R,1.0X2.0*%", "%AMRELIEF*1,1,$1,0,0*1,0,$2,0,0*%", "%ADD10RELIEF,1.5X1.0*%")
+    assert fingerprint(gerber_data(*apertures, *operations)) == fingerprint(gerber_data(
+        *renumbered, "D21*", "X0Y0D02*", "X10000000Y0D01*", "D17*", "X5000000Y5000000D03*", "D10*",
+        "X0Y5000000D03*"))
+
+
+def test_metadata_and_comments(fingerprint):
+    plain = gerber_data(*apertures, *operations)
+    annotated = gerber_data("G04 Exported by some CAD tool, version 9.1*", "%TF.CreationDate,2026-10-18T10:00:00*%",
+                            "%TF.FileFunction,Copper,L1,Top*%", "%LNTOP*%", "%TA.AperFunction,SMDPad*%",
+                            "%AMTHERMAL*0 Two circles*1,1,$1,0,0*1,0,$2,0,0*%",
+                            *[a for a in apertures if not a.startswith("%AM")], "%TD*%", "G04 The traces*",
+                            *operations[:3], "G4 The pads*", *operations[3:])
+    assert fingerprint(plain) == fingerprint(annotated)
+
+
+def test_units_format_and_modal_coordinates(fingerprint):
+    mm = gerber_data("%ADD10C,2.54*%", "D10*", "X0Y0D02*", "X25400000Y0D01*", "X25400000Y12700000D01*")
+    inches = gerber_data("%ADD10C,0.1*%", "D10*", "X0Y0D02*", "X1000000D01*", "Y500000D01*",
+                         header="%FSLAX26Y26*%\n%MOIN*%")
+    fewer_digits = gerber_data("%ADD10C,2.54*%", "D10*", "X0Y0D02*", "X2540000Y0D01*", "X2540000Y1270000D01*",
+                               header="%FSLAX35Y35*%\n%MOMM*%")
+    assert fingerprint(mm) == fingerprint(inches) == fingerprint(fewer_digits)
+
+
+def test_blocks_split_between_chunks(fingerprint, monkeypatch):
+    data = gerber_data(*apertures, *operations)
+    whole = fingerprint(data)
+    monkeypatch.setattr(gerber, '_fingerprint_chunk_size', 7)
+    assert fingerprint(data) == whole
+
+
+def test_polarity(fingerprint):
+    dark = gerber_data(*apertures, *operations)
+    clear = gerber_data(*apertures, *operations[:3], "%LPC*%", *operations[3:])
+    assert fingerprint(dark) != fingerprint(clear)
+
+
+def test_aperture_size(fingerprint):
+    larger = ("%ADD10C,0.6*%",) + apertures[1:]
+    assert fingerprint(gerber_data(*apertures, *operations)) != fingerprint(gerber_data(*larger, *operations))
+    thicker = apertures[:3] + ("%ADD12THERMAL,1.5X1.1*%",)
+    assert fingerprint(gerber_data(*apertures, *operations)) != fingerprint(gerber_data(*thicker, *operations))
+
+
+def test_swapped_aperture_definitions(fingerprint):
+    swapped = ("%ADD11C,0.5*%", "%ADD10R,1.0X2.0*%") + apertures[2:]
+    assert fingerprint(gerber_data(*apertures, *operations)) != fingerprint(gerber_data(*swapped, *operations))
+
+
+def test_moved_pad(fingerprint):
+    moved = operations[:4] + ("X5000000Y5000100D03*",) + operations[5:]
+    assert fingerprint(gerber_data(*apertures, *operations)) != fingerprint(gerber_data(*apertures, *moved))
+
+
+def excellon_data(*lines, header="METRIC,TZ"):
+    return "M48\n" + header + "\n" + "\n".join(lines) + "\nM30\n"
+
+
+def test_excellon_renumbered_tools_and_comments(fingerprint):
+    drill = excellon_data("T1C0.800", "T2C1.000", "%", "T1", "X10.0Y5.0", "X20.0Y5.0", "T2", "X-2.5Y0.0")
+    renumbered = excellon_data("; Drill file of the top layer", "T5C1.000", "T3C0.800", "%", "T3", "X10.0Y5.0",
+                               "; Second hole", "X20.0Y5.0", "T5", "X-2.5Y0.0")
+    assert fingerprint(drill) == fingerprint(renumbered)
+
+
+def test_excellon_moved_and_resized_holes(fingerprint):
+    drill = excellon_data("T1C0.800", "%", "T1", "X10.0Y5.0", "X20.0Y5.0")
+    moved = excellon_data("T1C0.800", "%", "T1", "X10.0Y5.0", "X20.1Y5.0")
+    resized = excellon_data("T1C0.900", "%", "T1", "X10.0Y5.0", "X20.0Y5.0")
+    assert len({fingerprint(drill), fingerprint(moved), fingerprint(resized)}) == 3
+
+
+def test_other_files_by_bytes(fingerprint):
+    assert fingerprint("Not a drill or gerber file\n") == fingerprint("Not a drill or gerber file\n")
+    assert fingerprint("Not a drill or gerber file\n") != fingerprint("Not a drill or gerber file \n")
+
+
+# The files of the renders of a layer in both gerbers: the layer and the outline
+def write_render(tmp_path, name, layer, outline):
+    (tmp_path / (name + ".gbr")).write_text(layer)
+    (tmp_path / (name + "-outline.gbr")).write_text(outline)
+    return {'files': [str(tmp_path / (name + ".gbr")), str(tmp_path / (name + "-outline.gbr"))], 'dpi': "300"}
+
+
+def fingerprinted_files(monkeypatch):
+    grbcore.fingerprint_cache.clear()
+    files = []
+    fingerprint_file = gerber.fingerprint_file
+
+    def fingerprint(filepath):
+        files.append(filepath)
+        return fingerprint_file(filepath)
+
+    monkeypatch.setattr(gerber, 'fingerprint_file', fingerprint)
+    return files
+
+
+def test_identical_bytes_are_not_fingerprinted(tmp_path, monkeypatch):
+    files = fingerprinted_files(monkeypatch)
+    data = gerber_data(*apertures, *operations)
+    outline = gerber_data("%ADD10C,0.1*%", "D10*", "X0Y0D02*", "X10000000Y0D01*")
+    render1 = write_render(tmp_path, "1", data, outline)
+    render2 = write_render(tmp_path, "2", data.replace("%MOMM*%", "%MOMM*%\n%TF.CreationDate,2024*%"), outline)
+    assert grbcore.identical_renders(render1, render2, {})
+    # Only the layer differs byte by byte
+    assert sorted(files) == sorted(render1['files'][:1] + render2['files'][:1])
+
+
+def test_a_changed_small_file_is_found_first(tmp_path, monkeypatch):
+    files = fingerprinted_files(monkeypatch)
+    data = gerber_data(*apertures, *operations)
+    render1 = write_render(tmp_path, "1", data, gerber_data("%ADD10C,0.1*%", "D10*", "X0Y0D02*", "X1Y0D01*"))
+    render2 = write_render(tmp_path, "2", data.replace("X0Y5000000D03*", "X0Y5000001D03*"),
+                           gerber_data("%ADD10C,0.1*%", "D10*", "X0Y0D02*", "X2Y0D01*"))
+    assert not grbcore.identical_renders(render1, render2, {})
+    assert sorted(files) == sorted(render1['files'][1:] + render2['files'][1:])
@@ -0,0 +1,104 @@
+import time
+
+import pytest
+
+import gerber
+
+# Tests of the Gerber and Excellon parser of the built-in renderer (see gerber.py)
+
+
+def gerber_data(*blocks, units="MM"):
+    return "%FSLAX46Y46*%\n%MO" + units + "*%\n" + "\n".join(blocks) + "\nM02*\n"
+
+
+def test_flash_with_standard_apertures():
+    objects = gerber.parse_data(gerber_data("%ADD10C,0.5*%", "%ADD11R,1.0X2.0*%",
+                                            "D10*", "X1000000Y2000000D03*", "D11*", "X-254000Y0D03*"))
+    assert [obj[0] for obj in objects] == ['flash', 'flash']
+    assert objects[0][1:3] == pytest.approx((1/25.4, 2/25.4))
+    assert objects[0][3][0] == ('C', (round(0.5/25.4, 7),))
+    assert objects[1][1:3] == pytest.approx((-0.01, 0.0))
+    assert gerber.shape_extents(objects[1][3][1]) == pytest.approx((-0.5/25.4, -1/25.4, 0.5/25.4, 1/25.4))
+
+
+def test_macro_with_variables_and_expressions():
+    objects = gerber.parse_data(gerber_data("%AMDONUT*0 A ring*1,1,$1,0,0*$3=$1x0.5-$2*1,0,$3,0,0*%",
+                                            "%ADD10DONUT,2.0X0.25*%", "D10*", "X0Y0D03*"))
+    shape = objects[0][3][1]
+    assert shape[0] == ('circle', 0.0, 0.0, pytest.approx(2.0/25.4), 1)
+    assert shape[1] == ('circle', 0.0, 0.0, pytest.approx(0.75/25.4), 0)
+
+
+def test_macro_outline_and_rotation():
+    objects = gerber.parse_data(gerber_data("%AMTRI*4,1,3,0,0,1,0,0,1,0,0,90*%", "%ADD10TRI*%",
+                                            "D10*", "X0Y0D03*"))
+    (kind, points, exposure) = objects[0][3][1][0]
+    assert (kind, exposure) == ('poly', 1)
+    # Rotated by 90 degrees counterclockwise around the origin
+    assert points[1] == pytest.approx((0.0, 1/25.4))
+    assert points[2] == pytest.approx((-1/25.4, 0.0))
+
+
+def test_macro_expressions():
+    variables = {1: 2.0, 2: 3.5}
+    assert gerber._evaluate("1+2x3", variables) == 7.0
+    assert gerber._evaluate("(1+2)X3", variables) == 9.0
+    assert gerber._evaluate("-$1/4", variables) == -0.5
+    assert gerber._evaluate("$2x2-$1", variables) == 5.0
+    assert gerber._evaluate("2x-3", variables) == -6.0
+    assert gerber._evaluate("8/2/2", variables) == 2.0
+    assert gerber._evaluate("$9", variables) == 0.0
+
+
+@pytest.mark.parametrize('expression', ["9**9**9**9", "1+", "(1", "2)", "1/0", "__import__('os')", "", "1e999",
+                                        "(" * 10000 + "1" + ")" * 10000])
+def test_macro_expressions_that_are_not_allowed(expression):
+    started = time.perf_counter()
+    with pytest.raises(gerber.Unsupported):
+        gerber._evaluate(expression, {})
+    assert time.perf_counter() - started < 5
+
+
+def test_crafted_macro_is_unsupported():
+    with pytest.raises(gerber.Unsupported):
+        gerber.parse_data(gerber_data("%AMBAD*1,1,9**9**9**9,0,0*%", "%ADD10BAD*%", "D10*", "X0Y0D03*"))
+
+
+def test_polarity():
+    objects = gerber.parse_data(gerber_data("%ADD10C,0.5*%", "D10*", "X0Y0D03*", "%LPC*%", "X1000000Y0D03*",
+                                            "%LPD*%", "X2000000Y0D02*", "X3000000Y0D01*"))
+    assert [(obj[0], obj[-1]) for obj in objects] == [('flash', True), ('flash', False), ('draw', True)]
+
+
+def test_clear_region():
+    objects = gerber.parse_data(gerber_data("%LPC*%", "G36*", "X0Y0D02*", "G01X1000000Y0D01*", "X1000000Y1000000D01*",
+                                            "X0Y0D01*", "G37*"))
+    assert len(objects) == 1
+    assert objects[0][0] == 'region' and objects[0][2] is False
+    assert len(objects[0][1]) == 4
+
+
+def test_step_and_repeat():
+    with pytest.raises(gerber.Unsupported):
+        gerber.parse_data(gerber_data("%SRX2Y3I5.0J5.0*%", "%ADD10C,0.5*%", "D10*", "X0Y0D03*", "%SR*%"))
+    # A step and repeat of one block doesn't repeat anything
+    objects = gerber.parse_data(gerber_data("%SRX1Y1I0J0*%", "%ADD10C,0.5*%", "D10*", "X0Y0D03*", "%SR*%"))
+    assert len(objects) == 1
+
+
+def test_inches_and_trailing_zeros():
+    objects = gerber.parse_data("%FSTAX24Y24*%\n%MOIN*%\n%ADD10C,0.01*%\nD10*\nX015Y-0025D03*\nM02*\n")
+    assert objects[0][1:3] == pytest.approx((1.5, -0.25))
+
+
+def test_excellon():
+    objects = gerber.parse_data("M48\nMETRIC,TZ\nT1C0.800\nT2C1.000\n%\nT1\nX10.0Y5.0\nT2\nX-2.5Y0.0\n"
+                                "G85X0.0Y0.0G85X1.0Y0.0\nM30\n")
+    flashes = [obj for obj in objects if obj[0] == 'flash']
+    assert [obj[1:3] for obj in flashes] == [pytest.approx((10/25.4, 5/25.4)), pytest.approx((-2.5/25.4, 0.0))]
+    assert [obj[3][0] for obj in flashes] == [('C', (round(0.8/25.4, 7),)), ('C', (round(1.0/25.4, 7),))]
+
+
+def test_unknown_format():
+    with pytest.raises(gerber.Unsupported):
+        gerber.parse_data("This is not a gerber file\n")
@@ -0,0 +1,59 @@
+import gerber
+import gerberdiff
+
+# Tests of the comparison of gerber files without rendering them (see gerberdiff.py)
+
+
+def parse(*blocks):
+    return gerber.parse_data("%FSLAX46Y46*%\n%MOMM*%\n%ADD10C,0.5*%\n%ADD11R,2.0X2.0*%\n%ADD12C,0.6*%\n" +
+                             "\n".join(blocks) + "\nM02*\n")
+
+
+pad = ("%LPD*%", "D11*", "X0Y0D03*")
+hole = ("%LPC*%", "D10*", "X0Y0D03*")
+track = ("%LPD*%", "D10*", "X5000000Y0D02*", "X8000000Y0D01*")
+
+
+def test_reordered_objects_of_one_polarity_are_identical():
+    result = gerberdiff.compare(parse("D11*", "X0Y0D03*", "X3000000Y0D03*", "D10*", "X0Y5000000D03*"),
+                                parse("D10*", "X0Y5000000D03*", "D11*", "X3000000Y0D03*", "X0Y0D03*"))
+    assert gerberdiff.summary(result) == "Identical. 3 objects."
+
+
+def test_clear_object_moved_before_a_dark_one():
+    # The hole is erased by the pad when it's drawn before it, so the images differ
+    result = gerberdiff.compare(parse(*pad, *hole), parse(*hole, *pad))
+    assert not gerberdiff.summary(result).startswith("Identical")
+    assert len(result['modified']) == 2
+    changes = [change['change'] for change in gerberdiff.report(result)['modified']]
+    assert all(change.startswith("drawn in polarity layer") for change in changes)
+
+
+def test_objects_after_a_new_polarity_layer():
+    # Adding a hole after the track leaves the pad and the track in their layers
+    result = gerberdiff.compare(parse(*pad, *track), parse(*pad, *track, *hole))
+    assert (result['unchanged'], len(result['added']), len(result['removed'])) == (2, 1, 0)
+
+
+def test_moved_and_changed_objects():
+    result = gerberdiff.compare(parse("D11*", "X0Y0D03*", "D10*", "X5000000Y0D02*", "X8000000Y0D01*"),
+                                parse("D11*", "X100000Y0D03*", "D12*", "X5000000Y0D02*", "X8000000Y0D01*",
+                                      "D10*", "X20000000Y0D03*"))
+    report = gerberdiff.report(result)
+    assert [change['change'] for change in report['modified']] == ["moved 0.1000, 0.0000 mm",
+                                                                  "aperture changed from C 0.5 mm to C 0.6 mm"]
+    assert [added['position'] for added in report['added']] == [[20.0, 0.0]]
+    assert report['removed'] == []
+
+
+def test_polarity_change():
+    result = gerberdiff.compare(parse(*pad), parse("%LPC*%", "D11*", "X0Y0D03*"))
+    assert [change['change'] for change in gerberdiff.report(result)['modified']] == ["polarity changed"]
+
+
+def test_regions_with_another_start_and_direction_are_the_same():
+    square = ["X0Y0D02*", "X1000000Y0D01*", "X1000000Y1000000D01*", "X0Y1000000D01*", "X0Y0D01*"]
+    reversed_square = ["X1000000Y1000000D02*", "X1000000Y0D01*", "X0Y0D01*", "X0Y1000000D01*",
+                       "X1000000Y1000000D01*"]
+    result = gerberdiff.compare(parse("G36*", *square, "G37*"), parse("G36*", *reversed_square, "G37*"))
+    assert gerberdiff.summary(result) == "Identical. 1 objects."
@@ -0,0 +1,79 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+import gerber
+import grbcore
+
+# Tests that the built-in renderer (see gerber.py) draws the same images as GerbV. The sample files and the images
+# that GerbV exported from them are in tests/data/gerbv. GerbV itself is used when an image is missing, if it's found
+# in the GERBV environment variable or in the PATH, and the test is skipped otherwise. Write the images again with
+# "python -m tests.test_gerbv <path to gerbv>" in the directory of GrbDiff when the sample files are changed.
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "gerbv")
+dpi = 600
+bg_color = "#FFFFFF"
+# Name of the image, and the files and colors of the layers in it. GerbV uses the alpha 177 for colors without one.
+samples = [("pads", ["pads.gbr"], ["#FF0000"]),
+           ("drill", ["drill.drl"], ["#0000FF"]),
+           ("combined", ["pads.gbr", "drill.drl"], ["#FF0000", "#0000FFFF"])]
+
+
+def export_with_gerbv(gerbv, filenames, colors, export_filepath):
+    files = [os.path.join(data_dir, filename) for filename in filenames]
+    returncode = grbcore.run_gerbv(grbcore.gerbv_export_args(gerbv, files, colors, bg_color, dpi, export_filepath))
+    assert returncode == 0 and os.path.isfile(export_filepath)
+    return export_filepath
+
+
+def render(filenames, colors):
+    files = [gerber.parse_file(os.path.join(data_dir, filename)) for filename in filenames]
+    return gerber.render_image(files, colors, bg_color, dpi)[0]
+
+
+# Assert that an image is the same as the image of GerbV. The renderers antialias the edges in different ways and may
+# round them to the other pixel, so the pixels along the edges may be different. Anything that is different in more
+# than 2 pixels next to each other, like a missing or moved shape, isn't allowed.
+def assert_same_image(image, reference):
+    import numpy as np
+    import cv2  # opencv-python
+
+    assert image.shape == reference.shape
+    different = (cv2.absdiff(image, reference).max(axis=2) > 64).astype(np.uint8)
+    assert cv2.countNonZero(cv2.erode(different, np.ones((3, 3), np.uint8))) == 0
+    assert cv2.countNonZero(different) <= different.size // 20
+
+
+@pytest.mark.parametrize('name, filenames, colors', samples, ids=[sample[0] for sample in samples])
+def test_same_image_as_gerbv(tmp_path, name, filenames, colors):
+    import cv2  # opencv-python
+
+    reference = os.path.join(data_dir, name + ".png")
+    if not os.path.isfile(reference):
+        gerbv = os.environ.get('GERBV') or shutil.which('gerbv')
+        if gerbv is None:
+            pytest.skip("No image of GerbV in tests/data/gerbv, and GerbV isn't found")
+        reference = export_with_gerbv(gerbv, filenames, colors, str(tmp_path / (name + ".png")))
+    assert_same_image(render(filenames, colors), cv2.imread(reference, cv2.IMREAD_COLOR))
+
+
+def test_edges_may_be_different():
+    import numpy as np
+
+    image = render(["pads.gbr"], ["#FF0000"])
+    assert_same_image(image, image)
+    # Every edge moved by a pixel
+    moved = np.full_like(image, 255)
+    moved[1:, 1:] = image[:-1, :-1]
+    assert_same_image(image, moved)
+    with pytest.raises(AssertionError):
+        assert_same_image(image, np.roll(image, 4, axis=1))
+    with pytest.raises(AssertionError):
+        assert_same_image(image, render(["pads.gbr", "drill.drl"], ["#FF0000", "#0000FF"]))
+
+
+if __name__ == '__main__':
+    for (name, filenames, colors) in samples:
+        export_with_gerbv(sys.argv[1], filenames, colors, os.path.join(data_dir, name + ".png"))
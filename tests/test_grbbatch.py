@@ -0,0 +1,33 @@
+import json
+
+import pytest
+
+import grbbatch
+
+# Tests of reading the manifest of a batch (see grbbatch.py)
+
+
+def write_manifest(tmp_path, pairs):
+    filepath = tmp_path / "manifest.json"
+    filepath.write_text(json.dumps({'defaults': {'dpi': 300}, 'pairs': pairs}))
+    return str(filepath)
+
+
+def test_pairs_are_named_and_made_absolute(tmp_path):
+    pairs = grbbatch.read_manifest(write_manifest(tmp_path, [{'gerber1': "a.zip", 'gerber2': "b.zip"},
+                                                             {'name': "rev-b", 'gerber1': "a.zip", 'gerber2': "c"}]))
+    assert [pair['name'] for pair in pairs] == ["pair-1", "rev-b"]
+    assert pairs[0]['gerber1'] == str(tmp_path / "a.zip")
+    assert pairs[1]['dpi'] == 300
+
+
+@pytest.mark.parametrize('name', ["..", ".", "", "../out", "a/b", "a\\b", "/tmp/x", "C:x", 7])
+def test_names_that_are_paths_are_rejected(tmp_path, name):
+    with pytest.raises(ValueError):
+        grbbatch.read_manifest(write_manifest(tmp_path, [{'name': name, 'gerber1': "a.zip", 'gerber2': "b.zip"}]))
+
+
+def test_names_must_be_unique(tmp_path):
+    pair = {'name': "rev-b", 'gerber1': "a.zip", 'gerber2': "b.zip"}
+    with pytest.raises(ValueError):
+        grbbatch.read_manifest(write_manifest(tmp_path, [pair, pair]))
@@ -0,0 +1,85 @@
+import os
+import shutil
+import zipfile
+from collections import OrderedDict
+
+import pytest
+
+import grbcore
+import grbservice
+
+# Tests of keeping the opened gerber sets of the diff service (see grbservice.acquire_gerber_set())
+
+
+@pytest.fixture
+def removed(monkeypatch):
+    monkeypatch.setattr(grbservice, 'gerber_set_cache_size', 2)
+    monkeypatch.setitem(grbservice.service, 'gerber_sets', OrderedDict())
+    removed = []
+    monkeypatch.setattr(grbcore, 'remove_dir_later', removed.append)
+    yield removed
+    for directory in removed + [entry['set']['temp_dir'] for entry in grbservice.service['gerber_sets'].values()]:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def write_zip(directory, name, content="G04 top copper*\nM02*\n"):
+    filepath = os.path.join(str(directory), name + ".zip")
+    with zipfile.ZipFile(filepath, 'w') as zipObj:
+        zipObj.writestr("board.gtl", content)
+    return filepath
+
+
+def extracted_file(entry):
+    return [filepath for filepath in entry['set']['filepaths'] if filepath][0]
+
+
+def test_an_unchanged_set_is_opened_once(tmp_path, removed):
+    filepath = write_zip(tmp_path, "a")
+    entry = grbservice.acquire_gerber_set(filepath)
+    assert grbservice.acquire_gerber_set(filepath) is entry
+    assert entry['users'] == 2
+    grbservice.release_gerber_set(entry)
+    grbservice.release_gerber_set(entry)
+    assert entry['users'] == 0 and removed == []
+
+
+def test_a_changed_set_is_opened_again(tmp_path, removed):
+    filepath = write_zip(tmp_path, "a")
+    entry = grbservice.acquire_gerber_set(filepath)
+    grbservice.release_gerber_set(entry)
+    write_zip(tmp_path, "a", "G04 top copper, changed*\nM02*\n")
+    changed = grbservice.acquire_gerber_set(filepath)
+    assert changed is not entry and changed['key'] != entry['key']
+    assert open(extracted_file(changed)).read() == "G04 top copper, changed*\nM02*\n"
+
+
+def test_only_unused_sets_are_removed(tmp_path, removed):
+    a = grbservice.acquire_gerber_set(write_zip(tmp_path, "a"))
+    grbservice.release_gerber_set(a)
+    b = grbservice.acquire_gerber_set(write_zip(tmp_path, "b"))
+    c = grbservice.acquire_gerber_set(write_zip(tmp_path, "c"))
+    # a is the least recently used set, and isn't used
+    assert list(grbservice.service['gerber_sets'].values()) == [b, c]
+    assert removed == [a['set']['temp_dir']]
+    # Every set is used, so the cache gets larger than its size
+    d = grbservice.acquire_gerber_set(write_zip(tmp_path, "d"))
+    assert list(grbservice.service['gerber_sets'].values()) == [b, c, d]
+    grbservice.release_gerber_set(c)
+    e = grbservice.acquire_gerber_set(write_zip(tmp_path, "e"))
+    assert list(grbservice.service['gerber_sets'].values()) == [b, d, e]
+    assert removed == [a['set']['temp_dir'], c['set']['temp_dir']]
+    for entry in (b, d, e):
+        assert os.path.isfile(extracted_file(entry))
+
+
+def test_using_a_set_keeps_it(tmp_path, removed):
+    a = grbservice.acquire_gerber_set(write_zip(tmp_path, "a"))
+    b = grbservice.acquire_gerber_set(write_zip(tmp_path, "b"))
+    grbservice.release_gerber_set(a)
+    grbservice.release_gerber_set(b)
+    # Using a again makes b the least recently used set
+    assert grbservice.acquire_gerber_set(a['set']['path']) is a
+    grbservice.release_gerber_set(a)
+    grbservice.acquire_gerber_set(write_zip(tmp_path, "c"))
+    assert removed == [b['set']['temp_dir']]
+    assert list(grbservice.service['gerber_sets'].values())[0] is a
@@ -0,0 +1,47 @@
+import struct
+
+import numpy as np
+import pytest
+
+import grbcore
+
+# Tests of the raw images that are used between the render and the diff of the png export (see grbcore.py)
+
+
+@pytest.mark.parametrize('shape', [(37, 53, 3), (37, 53)])
+def test_round_trip_is_memory_mapped(tmp_path, shape):
+    image = np.random.default_rng(0).integers(0, 256, shape).astype(np.uint8)
+    filepath = str(tmp_path / "image.raw")
+    grbcore.write_raw_image(filepath, image)
+    raw = grbcore.read_raw_image(filepath)
+    assert isinstance(raw, np.memmap)
+    assert raw.shape == shape and raw.dtype == np.uint8
+    assert np.array_equal(raw, image)
+    # Drawing on the image doesn't change the file
+    raw[0:5, 0:5] = 0
+    del raw
+    assert np.array_equal(grbcore.read_raw_image(filepath), image)
+
+
+def write_file(tmp_path, data):
+    filepath = tmp_path / "image.raw"
+    filepath.write_bytes(data)
+    return str(filepath)
+
+
+def header(height, width, channels, magic=grbcore.raw_image_magic):
+    return (magic + struct.pack('<III', height, width, channels)).ljust(grbcore.raw_image_header_size, b'\0')
+
+
+@pytest.mark.parametrize('data', [
+    pytest.param(b"", id="empty"),
+    pytest.param(header(10, 10, 3)[:20], id="short header"),
+    pytest.param(header(10, 10, 3, magic=b"GRBRAW02") + bytes(300), id="other magic"),
+    pytest.param(header(10, 10, 3) + bytes(299), id="truncated"),
+    pytest.param(header(10, 10, 3) + bytes(301), id="too long"),
+    pytest.param(header(10, 10, 2) + bytes(200), id="channels"),
+    pytest.param(header(0, 10, 1), id="no pixels"),
+])
+def test_bad_files_are_rejected(tmp_path, data):
+    with pytest.raises(OSError):
+        grbcore.read_raw_image(write_file(tmp_path, data))
@@ -0,0 +1,101 @@
+import numpy as np
+import cv2
+import pytest
+
+import grbcore
+
+# Tests of merging the changed pixels of a layer into change regions (see grbcore.change_regions()) and of the change
+# report with them (see grbcore.change_report()). Regions are (x, y, width, height, number of changed pixels).
+
+
+def random_changes(seed, height, width, fraction):
+    rng = np.random.default_rng(seed)
+    thresh = ((rng.random((height, width)) < fraction)*255).astype(np.uint8)
+    # A long diagonal line reaches across many strips
+    for i in range(min(height, width)):
+        thresh[i, i] = 255
+    return thresh
+
+
+def whole_image_regions(thresh, distance):
+    # The regions found with the whole image labelled at once
+    radius = max(0, int(np.ceil(distance/2.0)))
+    merged = cv2.dilate(thresh, cv2.getStructuringElement(cv2.MORPH_RECT, (2*radius + 1, 2*radius + 1)))
+    labels = cv2.connectedComponents(merged, connectivity=8, ltype=cv2.CV_32S)[1]
+    regions = {}
+    for y, x in zip(*np.nonzero(thresh)):
+        (x0, y0, x1, y1, n) = regions.get(labels[y, x], (x, y, x, y, 0))
+        regions[labels[y, x]] = (min(x0, x), min(y0, y), max(x1, x), max(y1, y), n + 1)
+    return sorted((int(x0), int(y0), int(x1 - x0 + 1), int(y1 - y0 + 1), n) for (x0, y0, x1, y1, n) in regions.values())
+
+
+@pytest.mark.parametrize('distance', [0, 1, 3, 8])
+@pytest.mark.parametrize('strip_pixels', [1, 7*90, 40*90])
+def test_strips_find_the_regions_of_the_whole_image(distance, strip_pixels):
+    thresh = random_changes(distance, 120, 90, 0.01)
+    regions = grbcore.strip_change_regions(lambda y0, y1: thresh[y0:y1], 120, 90, distance, strip_pixels)
+    assert sorted(regions) == whole_image_regions(thresh, distance)
+
+
+def test_regions_are_in_the_order_of_their_first_pixel():
+    thresh = np.zeros((40, 40), dtype=np.uint8)
+    thresh[30, 2] = thresh[5, 30] = thresh[5, 10] = thresh[20, 0] = 255
+    regions = grbcore.strip_change_regions(lambda y0, y1: thresh[y0:y1], 40, 40, 0, 40*3)
+    assert [(x, y) for (x, y, w, h, n) in regions] == [(10, 5), (30, 5), (0, 20), (2, 30)]
+
+
+def test_no_changes():
+    assert grbcore.change_regions(np.zeros((10, 10), dtype=np.uint8), 4) == []
+
+
+def test_otsu_threshold_is_the_threshold_of_opencv():
+    rng = np.random.default_rng(0)
+    for i in range(50):
+        diff = rng.integers(0, 256, (30, 40)).astype(np.uint8)
+        diff[rng.random((30, 40)) < rng.random()] = 255
+        level = cv2.threshold(diff, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[0]
+        assert grbcore.otsu_threshold(grbcore.image_histogram(diff)) == level
+
+
+# Find the change report of a layer where squares of 'size' mm are added at (x, y) in mm from the upper left corner of
+# image 2, at 'dpi', with the board frame 'frame' (left, bottom in inches, width, height in pixels)
+def square_changes(squares, dpi, merge_distance, size=0.2, frame=None):
+    (height, width) = (int(30/25.4*dpi), int(40/25.4*dpi))
+    image1 = np.zeros((height, width, 3), dtype=np.uint8)
+    image2 = image1.copy()
+    for (x, y) in squares:
+        (x0, y0, side) = (int(round(x/25.4*dpi)), int(round(y/25.4*dpi)), int(round(size/25.4*dpi)))
+        image2[y0:y0 + side, x0:x0 + side] = (0, 200, 255)
+    report = {'dpi': dpi, 'frame': frame, 'filepath': None, 'merge_distance': merge_distance,
+              'background': (0, 0, 0)}
+    grbcore.diff_layer_images("1.png", "2.png", None, images=[image1, image2, None], report=report, png=False,
+                              mode='exact')
+    return report['content']
+
+
+@pytest.mark.parametrize('dpi', [300, 1200])
+def test_changes_are_merged_by_their_distance_in_mm(dpi):
+    # Squares 0.3 mm apart are merged with a merge distance of 0.5 mm, and squares 2 mm apart aren't
+    squares = [(5.0, 5.0), (5.5, 5.0), (10.0, 5.0), (10.0, 7.2), (20.0, 20.0)]
+    regions = square_changes(squares, dpi, 0.5)['regions']
+    assert len(regions) == 4
+    assert regions[0]['pixels'][2] == pytest.approx(0.7/25.4*dpi, abs=2)
+    # With a merge distance of 5 mm, only the square that is far from the others is by itself
+    assert len(square_changes(squares, dpi, 5.0)['regions']) == 2
+
+
+def test_bounds_in_mm():
+    dpi = 1000
+    frame = (1.0, 2.0, int(40/25.4*dpi), int(30/25.4*dpi))
+    content = square_changes([(10.0, 5.0)], dpi, 0.5, size=1.0, frame=frame)
+    [region] = content['regions']
+    (x, y, w, h) = region['pixels']
+    assert (w, h) == (39, 39)
+    assert region['changed_area_mm2'] == pytest.approx(39*39*0.0254**2, abs=1e-4)
+    # The board coordinates grow upwards, from the lower left corner of the frame
+    top = 2.0*25.4 + frame[3]/dpi*25.4
+    assert region['bounds_mm'] == pytest.approx([25.4 + x*0.0254, top - (y + h)*0.0254, 25.4 + (x + w)*0.0254,
+                                                 top - y*0.0254], abs=1e-3)
+    assert region['bounds_mm'][0] == pytest.approx(25.4 + 10.0, abs=0.03)
+    assert region['bounds_mm'][3] == pytest.approx(top - 5.0, abs=0.03)
+    assert content['changed_area_mm2'] == region['changed_area_mm2']
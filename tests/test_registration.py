@@ -0,0 +1,77 @@
+import cv2
+import numpy as np
+import pytest
+
+import grbbitplane
+import grbregistration
+
+# Tests of lining up the images of a layer that have moved (see grbregistration.py)
+
+
+# A grayscale render of pads and tracks of a board of (height, width) pixels, in an image of 'size' (height, width)
+# where the board is moved by (dx, dy) pixels. The shapes are drawn with sub-pixel precision.
+def render(height, width, size=None, dx=0.0, dy=0.0):
+    rng = np.random.default_rng(3)
+    image = np.zeros(size or (height, width), dtype=np.uint8)
+    scale = 16  # 4 fractional bits of the coordinates
+
+    def point(x, y):
+        return (int(round((x + dx)*scale)), int(round((y + dy)*scale)))
+
+    for i in range(300):
+        (x, y) = (rng.uniform(60, width - 100), rng.uniform(60, height - 100))
+        cv2.circle(image, point(x, y), int(rng.integers(5, 20))*scale, 255, -1, cv2.LINE_AA, 4)
+    for i in range(40):
+        (x, y) = (rng.uniform(60, width - 200), rng.uniform(60, height - 100))
+        cv2.line(image, point(x, y), point(x + 120, y), 255, 4, cv2.LINE_AA, 4)
+    return image
+
+
+# Whole-pixel and sub-pixel shifts, in images that are smaller and larger than the images that the shift is first
+# estimated on (grbregistration.registration_size)
+@pytest.mark.parametrize('size', [(700, 900), (1500, 2300)])
+@pytest.mark.parametrize('shift', [(37, -12), (12.5, 3.25), (-20.4, 15.7)])
+def test_shift_and_frame(size, shift):
+    (height, width) = size
+    (dx, dy) = shift
+    a = render(height, width)
+    b = render(height, width, (height + 40, width + 60), dx, dy)
+    (sx, sy, response) = grbregistration.estimate_shift(a, b)
+    assert sx == pytest.approx(dx, abs=0.05) and sy == pytest.approx(dy, abs=0.05)
+    assert response > 0.9
+    (offset_a, offset_b, frame, translation) = grbregistration.register_images(a, b)
+    # The whole-pixel offsets come from the estimate, since 12.5 could be rounded either way
+    (x, y) = (int(round(translation[0])), int(round(translation[1])))
+    assert offset_a == (max(0, x), max(0, y))
+    assert offset_b == (offset_a[0] - x, offset_a[1] - y)
+    assert frame == (max(offset_a[1] + height, offset_b[1] + height + 40),
+                     max(offset_a[0] + width, offset_b[0] + width + 60))
+    # The images line up in the common frame, apart from the edges of the shapes, and the part of the translation that
+    # isn't whole pixels lines them up better
+    placed_a = grbregistration.place_image(a, offset_a, frame).astype(int)
+    error = np.mean(np.abs(placed_a - grbregistration.place_image(b, offset_b, frame, translation)))
+    assert error < 2.0
+    if (dx, dy) != (round(dx), round(dy)):
+        assert error < np.mean(np.abs(placed_a - grbregistration.place_image(b, offset_b, frame)))
+
+
+def test_bitplanes_are_lined_up_by_whole_pixels():
+    a = cv2.cvtColor(render(1500, 2300), cv2.COLOR_GRAY2BGR)
+    b = cv2.cvtColor(render(1500, 2300, (1530, 2350), 25, -8), cv2.COLOR_GRAY2BGR)
+    (plane_a, plane_b) = (grbbitplane.pack_bitplane(a), grbbitplane.pack_bitplane(b))
+    (offset_a, offset_b, frame, (sx, sy)) = grbregistration.register_bitplanes(plane_a, 2300, plane_b, 2350)
+    assert (round(sx), round(sy)) == (25, -8)
+    assert (offset_a, offset_b, frame) == ((25, 0), (0, 8), (1538, 2350))
+    placed_a = grbbitplane.place_bitplane(plane_a, 2300, offset_a, frame)
+    placed_b = grbbitplane.place_bitplane(plane_b, 2350, offset_b, frame)
+    assert np.array_equal(placed_a, placed_b)
+
+
+def test_images_that_are_lined_up_are_not_moved():
+    a = render(700, 900)
+    assert grbregistration.register_images(a, render(700, 900, dx=0.1, dy=-0.1)) is None
+
+
+def test_images_without_anything_in_common_are_not_moved():
+    a = render(700, 900)
+    assert grbregistration.register_images(a, np.zeros((720, 900), dtype=np.uint8)) is None
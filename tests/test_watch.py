@@ -0,0 +1,46 @@
+import os
+
+import grbcore
+
+# Tests of the signature of the gerber files that is watched for changes (see grbcore.path_signature())
+
+
+def write(filepath, content, mtime_ns=None):
+    with open(filepath, 'w') as f:
+        f.write(content)
+    # Set the time, so that a change isn't missed when the file is written twice in the same tick of the clock
+    if mtime_ns is not None:
+        os.utime(filepath, ns=(mtime_ns, mtime_ns))
+    return filepath
+
+
+def test_signature_of_a_file(tmp_path):
+    filepath = write(str(tmp_path / "board.gtl"), "G04 top*\nM02*\n", 10**18)
+    signature = grbcore.path_signature(filepath)
+    assert grbcore.path_signature(filepath) == signature
+    with open(filepath) as f:
+        f.read()
+    assert grbcore.path_signature(filepath) == signature
+    # The same size, written later
+    write(filepath, "G04 bot*\nM02*\n", 10**18 + 1)
+    assert grbcore.path_signature(filepath) != signature
+
+
+def test_signature_of_a_directory(tmp_path):
+    write(str(tmp_path / "board.gtl"), "G04 top*\nM02*\n", 10**18)
+    write(str(tmp_path / "board.gbl"), "G04 bottom*\nM02*\n", 10**18)
+    signature = grbcore.path_signature(str(tmp_path))
+    assert signature == (("board.gbl", 17, 10**18), ("board.gtl", 14, 10**18))
+    # Files in subdirectories aren't part of the set
+    os.mkdir(str(tmp_path / "old"))
+    write(str(tmp_path / "old" / "board.gtl"), "G04 old*\nM02*\n")
+    assert grbcore.path_signature(str(tmp_path)) == signature
+
+    write(str(tmp_path / "board.gtl"), "G04 top, changed*\nM02*\n", 10**18)
+    written = grbcore.path_signature(str(tmp_path))
+    assert written != signature
+    write(str(tmp_path / "board.drl"), "M48\nM30\n", 10**18)
+    added = grbcore.path_signature(str(tmp_path))
+    assert added != written
+    os.remove(str(tmp_path / "board.gbl"))
+    assert grbcore.path_signature(str(tmp_path)) not in (signature, written, added)
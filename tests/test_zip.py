@@ -0,0 +1,90 @@
+import os
+import subprocess
+import zipfile
+
+import pytest
+
+import benchmark
+import grbcore
+
+# Tests of opening the gerber files of a zip archive and of a revision in a git repository (see grbcore.py)
+
+
+@pytest.fixture
+def board(tmp_path):
+    filelist = benchmark.generate_board(str(tmp_path / "board"), size=20.0, copper_layers=2)
+    return str(tmp_path / "board" / "1"), filelist
+
+
+def write_zip(filepath, files):
+    with zipfile.ZipFile(filepath, 'w') as zipObj:
+        for (member, content) in files:
+            zipObj.writestr(member, content)
+    return filepath
+
+
+def layer_file(filetypes, filepaths, layer):
+    return filepaths[[filetype[0] for filetype in filetypes].index(layer)]
+
+
+def test_files_with_the_same_name_are_not_hidden(tmp_path):
+    zip_filepath = write_zip(str(tmp_path / "a.zip"), [("gerbers/board.gtl", b"1"), ("old/board.gtl", b"2"),
+                                                       ("board.gbl", b"3"), ("gerbers/", b"")])
+    members = grbcore.zip_members(zip_filepath)
+    assert members == {"gerbers_board.gtl": "gerbers/board.gtl", "old_board.gtl": "old/board.gtl",
+                       "board.gbl": "board.gbl"}
+    for filename, content in (("gerbers_board.gtl", b"1"), ("old_board.gtl", b"2")):
+        filepath = grbcore.extract_zip_member(zip_filepath, members[filename], str(tmp_path), filename)
+        with open(filepath, 'rb') as f:
+            assert f.read() == content
+
+
+def test_only_the_files_of_the_layers_are_extracted(board, tmp_path):
+    (board_dir, filelist) = board
+    files = [("gerbers/" + filename, open(os.path.join(board_dir, filename), 'rb').read()) for filename in filelist]
+    zip_filepath = write_zip(str(tmp_path / "board.zip"), files + [("readme.txt", b"Not a layer")])
+    gerber_set = grbcore.open_gerber_set(zip_filepath, grbcore.filetypes)
+    try:
+        extracted = sorted(os.listdir(gerber_set['temp_dir']))
+        assert extracted == sorted(os.path.basename(f) for f in gerber_set['filepaths'] if f is not None)
+        assert "readme.txt" not in extracted and benchmark.board_name + "-job.gbrjob" not in extracted
+        assert os.path.basename(layer_file(grbcore.filetypes, gerber_set['filepaths'], "Copper Layer L1")) == \
+            benchmark.board_name + "-F_Cu.gtl"
+    finally:
+        grbcore.remove_dir_later(gerber_set['temp_dir'])
+
+
+@pytest.mark.parametrize('zipped', [False, True])
+def test_files_of_a_git_revision(board, tmp_path, zipped):
+    (board_dir, filelist) = board
+    repository = tmp_path / "repository"
+    repository.mkdir()
+
+    def git(*args):
+        return subprocess.check_output(['git', '-c', 'user.name=Test', '-c', 'user.email=test@example.com'] +
+                                       list(args), cwd=str(repository), universal_newlines=True).strip()
+
+    git('init', '-q')
+    if zipped:
+        path = write_zip(str(repository / "board.zip"),
+                         [("gerbers/" + filename, open(os.path.join(board_dir, filename), 'rb').read())
+                          for filename in filelist] + [("other/" + filelist[0], b"Not the same file")])
+    else:
+        path = str(repository)
+        for filename in filelist:
+            with open(os.path.join(board_dir, filename), 'rb') as source, open(str(repository / filename), 'wb') as f:
+                f.write(source.read())
+    git('add', '-A')
+    git('commit', '-q', '-m', "Board")
+    revision = git('rev-parse', 'HEAD')
+    target_dir = str(tmp_path / "revision")
+    filepaths = grbcore.git_revision_files(path, revision, target_dir, grbcore.filetypes)
+    top = layer_file(grbcore.filetypes, filepaths, "Copper Layer L1")
+    with open(top, 'rb') as f, open(os.path.join(board_dir, benchmark.board_name + "-F_Cu.gtl"), 'rb') as original:
+        assert f.read() == original.read()
+    # All the files of a directory are written, but only the files of the layers are extracted from a zip archive
+    if zipped:
+        assert sorted(os.listdir(target_dir)) == sorted(os.path.basename(f) for f in filepaths if f is not None)
+    else:
+        assert sorted(os.listdir(target_dir)) == sorted(filelist)
+    assert not os.path.exists(target_dir + ".zip")